@@ -0,0 +1,102 @@
+from pathlib import Path
+import hydra
+from hydra.utils import to_absolute_path
+from omegaconf import OmegaConf, DictConfig
+
+import torch
+import pytorch_lightning as pl
+
+# My library
+from fp_pred_group.module import MyLightningModel
+from fp_pred_group.util.bench_util import (
+    cache_split_batches, calc_batch_scores, get_state_dict_size, load_fp_rate_dict,
+    measure_latency, measure_train_steps, unpad_feats)
+from fp_pred_group.util.eval_util import METRICS
+
+@hydra.main(config_path="conf/benchmark_model", config_name="config")
+def main(config: DictConfig):
+
+    # Phase
+    phase = "bench"
+
+    # Out directory
+    exp_dir = Path(to_absolute_path(config[phase].exp_dir))
+    out_dir = Path(to_absolute_path(config[phase].out_dir))
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # Save config
+    with open(out_dir / "config.yaml", "w") as f:
+        OmegaConf.save(config, f)
+
+    # Random seed
+    pl.seed_everything(config.random_seed)
+    torch.set_num_threads(config[phase].n_threads)
+    device = torch.device(config[phase].device)
+
+    # FPs
+    fp_list_path = Path(to_absolute_path(config.data.fp_list))
+    with open(fp_list_path, "r") as f:
+        fp_list = [l.strip() for l in f]
+
+    cached_batches = {}
+    rows = []
+    for model_name, step in config[phase].models.items():
+        exp_dir_m = exp_dir / model_name
+        train_config = OmegaConf.load(exp_dir_m / "config.yaml")
+
+        # Cache train and dev batches of the features (shared by models on the same features)
+        preprocessed_dir = Path(to_absolute_path(train_config.data.preprocessed_dir))
+        if preprocessed_dir not in cached_batches.keys():
+            print(f"loading features of {preprocessed_dir}...")
+            cached_batches[preprocessed_dir] = cache_split_batches(
+                config.data, preprocessed_dir, device, config[phase].n_train_steps)
+        batches = cached_batches[preprocessed_dir]
+        dev_fp_rate_dict = load_fp_rate_dict(preprocessed_dir / "dev_all_fp_rate.list")
+
+        # Training speed from scratch
+        print(f"benchmark {model_name}...")
+        model = hydra.utils.instantiate(train_config.model.netG).to(device)
+        train_steps_per_sec = measure_train_steps(model, batches["train"])
+
+        # Trained model
+        ckpt_path = list((exp_dir_m / "ckpt").glob("*-step={}.ckpt".format(str(step))))[0]
+        pl_model = MyLightningModel.load_from_checkpoint(
+            str(ckpt_path),
+            model=hydra.utils.instantiate(train_config.model.netG),
+            fp_list=fp_list,
+            strict=False)
+        model = pl_model.model.to(device)
+        model.eval()
+
+        # Scores on dev split
+        scores = calc_batch_scores(model, batches["dev"], fp_list, dev_fp_rate_dict)
+
+        # Inference latency on utterances without padding
+        feats = unpad_feats(batches["dev"])
+        latencies = [
+            measure_latency(model, feats, batch_size, config[phase].n_latency_batches)
+            for batch_size in config[phase].batch_sizes]
+
+        rows.append(
+            [model_name, train_config.model.netG._target_.split(".")[-1]]
+            + ["{:.2f}".format(get_state_dict_size(model) / 1e6), "{:.2f}".format(train_steps_per_sec)]
+            + ["{:.2f}".format(latency * 1e3) for latency in latencies]
+            + [
+                "{:.4f}".format(float(scores[score_type][metric]))
+                for score_type in ["fp_position", "fp_word"] for metric in METRICS
+            ])
+
+    # Write comparison table
+    header = ["model", "netG", "size[MB]", "train_steps/sec"] + [
+        f"latency_bs{batch_size}[ms]" for batch_size in config[phase].batch_sizes
+    ] + [
+        f"{score_type}/{metric}"
+        for score_type in ["fp_position", "fp_word"] for metric in METRICS
+    ]
+    out_text = "\n".join(["\t".join(row) for row in [header] + rows])
+    print(out_text)
+    with open(out_dir / "benchmark_model.tsv", "w") as f:
+        f.write(out_text)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,271 @@
+import itertools
+import json
+import platform
+import random
+import shutil
+import subprocess
+import time
+from pathlib import Path
+import hydra
+from hydra.utils import to_absolute_path, get_original_cwd
+from omegaconf import OmegaConf, DictConfig
+
+import torch
+import pytorch_lightning as pl
+from pytorch_lightning import loggers as pl_loggers
+
+# My library
+from evaluate import cache_batches, evaluate, predict_cached, write_scores
+from fp_pred_group.module import MyLightningModel
+from fp_pred_group.preprocessor import extract_feats, split_data, process_tagtext, analyze_fp
+from fp_pred_group.preprocessor import my_analyze_token
+from fp_pred_group.preprocessor.synth_corpus import (
+    make_words, stub_get_morph, write_synthetic_corpus, write_tiny_bert)
+from fp_pred_group.util.bench_util import (
+    cache_split_batches, get_split_loader, load_fp_rate_dict, measure_train_steps)
+from fp_pred_group.util.memory_util import MemoryCallback, MemoryTracker
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=get_original_cwd(),
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def measure_loader(data_loader, n_epochs):
+    """Utterances and batches per second of iterating data loader."""
+    n_utts = 0
+    n_batches = 0
+    start = time.perf_counter()
+    for _ in range(n_epochs):
+        for x, _ in data_loader:
+            n_utts += x.size(0)
+            n_batches += 1
+    elapsed_time = time.perf_counter() - start
+    return {"utts/sec": n_utts / elapsed_time, "batches/sec": n_batches / elapsed_time}
+
+def count_lines(path):
+    with open(path, "r") as f:
+        return len([l for l in f if len(l.strip()) > 0])
+
+def measure_memory(config, model, fp_list, preprocessed_dir, work_dir, device):
+    """Memory of short training and of evaluation (``evaluate.evaluate``) on the synthetic splits."""
+
+    phase = "bench"
+    memory_config = config[phase].memory
+    memory_tracker = MemoryTracker(track_tensors=memory_config.track_tensors)
+    gpus = 1 if device.type == "cuda" else 0
+
+    # Training and validation for n_epochs
+    pl_model = MyLightningModel(
+        model, fp_list,
+        train_fp_rate_dict=load_fp_rate_dict(preprocessed_dir / "train_all_fp_rate.list"),
+        dev_fp_rate_dict=load_fp_rate_dict(preprocessed_dir / "dev_all_fp_rate.list"),
+        optimizer_params={"lr": 1.0e-05},
+        lr_scheduler_params={"step_size": 100000, "gamma": 0.1},
+    )
+    loggers = [
+        pl_loggers.TensorBoardLogger(save_dir=str(work_dir), name="memory", sub_dir=split)
+        for split in ["train", "val"]]
+    trainer = pl.Trainer(
+        gpus=gpus,
+        max_epochs=memory_config.n_epochs,
+        enable_checkpointing=False,
+        callbacks=[MemoryCallback(
+            memory_tracker, work_dir / "memory.json",
+            sample_every_n_steps=memory_config.sample_every_n_steps)],
+        logger=loggers,
+    )
+    trainer.fit(
+        pl_model,
+        get_split_loader(config.data, preprocessed_dir, "train_all", True),
+        get_split_loader(config.data, preprocessed_dir, "dev_all", False))
+
+    # Evaluation on eval split
+    eval_dir = work_dir / "eval_memory"
+    eval_dir.mkdir(parents=True, exist_ok=True)
+    eval_trainer = pl.Trainer(
+        gpus=gpus,
+        callbacks=[MemoryCallback(
+            memory_tracker, work_dir / "memory.json",
+            sample_every_n_steps=memory_config.sample_every_n_steps)],
+        logger=False,
+    )
+    evaluate(
+        config,
+        OmegaConf.create({"data": {"preprocessed_dir": str(preprocessed_dir)}}),
+        preprocessed_dir / "eval_all.list",
+        eval_trainer, pl_model, eval_dir, fp_list,
+        load_fp_rate_dict(preprocessed_dir / "eval_all_fp_rate.list"),
+        memory_tracker=memory_tracker)
+
+    return memory_tracker
+
+def benchmark_size(config, n_speakers, words, fp_list, fp_list_path, bert_model_dir, device):
+    """Time every stage from synthetic corpus of n_speakers to scores of evaluation."""
+
+    phase = "bench"
+    work_dir = Path(to_absolute_path(config[phase].out_dir)) / f"speakers{n_speakers}"
+    corpus_dir = work_dir / "corpus"
+    preprocessed_dir = work_dir / "preprocessed"
+
+    # Fresh directory (analyze_fp reads every list in out_dir, including outputs of earlier runs)
+    if work_dir.exists():
+        shutil.rmtree(work_dir)
+    write_synthetic_corpus(
+        corpus_dir, words, fp_list, n_speakers,
+        config[phase].corpus.n_lectures_per_speaker,
+        config[phase].corpus.n_ipus_per_lecture,
+        config[phase].corpus.n_groups,
+        seed=config.random_seed + n_speakers)
+
+    # Preprocess
+    preprocess_config = OmegaConf.create({
+        "n_jobs": config.n_jobs,
+        "corpus_dir": str(corpus_dir),
+        "out_dir": str(preprocessed_dir),
+        "group_list_path": str(corpus_dir / "group.list"),
+        "bert_model_dir": str(bert_model_dir),
+        "fp_list_path": str(fp_list_path),
+    })
+    stages = {}
+    for name, fn in [
+        ("process_tagtext", process_tagtext),
+        ("extract_feats", extract_feats),
+        ("split_data", split_data),
+        ("analyze_fp", analyze_fp),
+    ]:
+        print(f"{name}...")
+        stages[name] = timed(fn, preprocess_config)
+    n_ipus = count_lines(preprocessed_dir / "ipu.list")
+
+    # Data loader
+    print("data loader...")
+    data_loader = get_split_loader(config.data, preprocessed_dir, "train_all", True)
+    loader = measure_loader(data_loader, config[phase].n_loader_epochs)
+
+    # Training steps
+    print("train steps...")
+    batches = cache_split_batches(config.data, preprocessed_dir, device, config[phase].n_train_steps)
+    model = hydra.utils.instantiate(config.model.netG).to(device)
+    train_steps_per_sec = measure_train_steps(
+        model, list(itertools.islice(itertools.cycle(batches["train"]), config[phase].n_train_steps)))
+
+    # Evaluation (prediction and scoring of evaluate.py)
+    print("evaluate...")
+    utt_list_path = preprocessed_dir / "eval_all.list"
+    eval_fp_rate_dict = load_fp_rate_dict(preprocessed_dir / "eval_all_fp_rate.list")
+    train_config = OmegaConf.create({"data": {"preprocessed_dir": str(preprocessed_dir)}})
+    pl_model = MyLightningModel(model, fp_list)
+    start = time.perf_counter()
+    eval_batches = cache_batches(config, train_config, utt_list_path, device)
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    outputs = predict_cached(pl_model, eval_batches, device)
+    predict_time = time.perf_counter() - start
+    eval_dir = work_dir / "eval"
+    eval_dir.mkdir(parents=True, exist_ok=True)
+    score_time = timed(write_scores, outputs, eval_dir, fp_list, eval_fp_rate_dict)
+    n_eval_utts = count_lines(utt_list_path)
+
+    # Memory, whose growth per epoch is checked after all results are written
+    memory = None
+    if config[phase].memory.enable:
+        print("memory...")
+        memory_tracker = measure_memory(config, model, fp_list, preprocessed_dir, work_dir, device)
+        memory_tracker.save(
+            Path(to_absolute_path(config[phase].out_dir)) / f"memory_speakers{n_speakers}.json")
+        memory_tracker.print_summary()
+        memory = memory_tracker.summary()
+        memory["exceeded_epochs"] = memory_tracker.exceeded_epochs(
+            config[phase].memory.max_epoch_growth_mb * 1e6)
+
+    if not config[phase].keep_data:
+        shutil.rmtree(work_dir)
+
+    return {
+        "n_speakers": n_speakers,
+        "n_lectures": n_speakers * config[phase].corpus.n_lectures_per_speaker,
+        "n_ipus": n_ipus,
+        "n_eval_utts": n_eval_utts,
+        "stages": stages,
+        "data_loader": loader,
+        "train_steps/sec": train_steps_per_sec,
+        "evaluate": {
+            "load": load_time,
+            "predict": predict_time,
+            "write_scores": score_time,
+        },
+        "memory": memory,
+    }
+
+@hydra.main(config_path="conf/benchmark_pipeline", config_name="config")
+def main(config: DictConfig):
+
+    # Phase
+    phase = "bench"
+
+    # Out directory
+    out_dir = Path(to_absolute_path(config[phase].out_dir))
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # Random seed
+    pl.seed_everything(config.random_seed)
+    torch.set_num_threads(config[phase].n_threads)
+    device = torch.device(config[phase].device)
+
+    # Morphological analyzer (workers of process_tagtext are forked and inherit the stub)
+    if config[phase].morph_analyzer == "stub":
+        my_analyze_token.get_morph = stub_get_morph
+
+    # FPs
+    fp_list_path = Path(to_absolute_path(config.data.fp_list))
+    with open(fp_list_path, "r") as f:
+        fp_list = [l.strip() for l in f]
+
+    # Tiny bert on the vocabulary shared by corpora of all sizes
+    bert_model_dir = out_dir / "bert"
+    words = make_words(config[phase].corpus.n_words, random.Random(config.random_seed))
+    write_tiny_bert(bert_model_dir, words, fp_list, seed=config.random_seed, **config[phase].bert)
+
+    results = []
+    for n_speakers in config[phase].corpus.n_speakers:
+        print(f"benchmark corpus of {n_speakers} speakers...")
+        results.append(benchmark_size(
+            config, n_speakers, words, fp_list, fp_list_path, bert_model_dir, device))
+
+    # Write results, to be compared across commits
+    out_json = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "config": OmegaConf.to_container(config, resolve=True),
+        "results": results,
+    }
+    with open(out_dir / "benchmark_pipeline.json", "w") as f:
+        json.dump(out_json, f, indent=4)
+
+    for result in results:
+        print("speakers {} ({} IPUs): {}, loader {:.1f} utts/sec, train {:.2f} steps/sec, evaluate {}".format(
+            result["n_speakers"], result["n_ipus"],
+            ", ".join(["{} {:.2f}s".format(k, v) for k, v in result["stages"].items()]),
+            result["data_loader"]["utts/sec"],
+            result["train_steps/sec"],
+            ", ".join(["{} {:.2f}s".format(k, v) for k, v in result["evaluate"].items()])))
+
+    # Fail if memory grew too much in an epoch
+    exceeded = {
+        result["n_speakers"]: result["memory"]["exceeded_epochs"] for result in results
+        if result["memory"] is not None and len(result["memory"]["exceeded_epochs"]) > 0}
+    assert len(exceeded) == 0, \
+        "rss grew more than {} [MB] in an epoch ({{speakers: epochs}}: {})".format(
+            config[phase].memory.max_epoch_growth_mb, exceeded)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,142 @@
+import subprocess
+import sys
+from pathlib import Path
+import hydra
+from hydra.utils import to_absolute_path, get_original_cwd
+from omegaconf import OmegaConf, DictConfig
+
+import torch
+import pytorch_lightning as pl
+
+# My library
+from fp_pred_group.model import BiLSTM
+from fp_pred_group.util.bench_util import (
+    calc_batch_scores, get_split_loader, get_state_dict_size, load_fp_rate_dict,
+    measure_latency, unpad_feats)
+from fp_pred_group.util.ckpt_util import get_model_state_dict, save_inference_ckpt
+from fp_pred_group.util.compress_util import (
+    factorize_input_weights, get_bilstm_netG_config, prune_hidden_units)
+
+def load_trained_model(ckpt_dir, step, netG_config):
+    ckpt_paths = list(ckpt_dir.glob("*-step={}.ckpt".format(str(step))))
+    assert len(ckpt_paths) > 0, "no checkpoint of step {} in {}".format(step, ckpt_dir)
+    ckpt_path = ckpt_paths[0]
+    model = hydra.utils.instantiate(netG_config)
+    model.load_state_dict(get_model_state_dict(torch.load(ckpt_path, map_location="cpu")["state_dict"]))
+    model.eval()
+    return model
+
+def fine_tune(config, preprocessed_dir, init_ckpt_path, out_dir):
+    """Fine-tune compressed model with train.py and load the last checkpoint."""
+
+    phase = "compress"
+    max_steps = config[phase].fine_tune.max_steps
+    subprocess.run([
+        sys.executable, "train.py",
+        "train.model_type=non_personalized",
+        "train.fine_tune=False",
+        f"train.init_ckpt={init_ckpt_path}",
+        f"train.out_dir={out_dir}",
+        f"train.max_steps={max_steps}",
+        # Save the last step whether or not validation has run (val_loss may not exist yet)
+        f"train.checkpoint.params.every_n_train_steps={max_steps}",
+        "train.checkpoint.params.monitor=null",
+        f"data.preprocessed_dir={preprocessed_dir}",
+    ] + list(config[phase].fine_tune.overrides), check=True, cwd=get_original_cwd())
+
+    out_dir_m = out_dir / "non_personalized"
+    return load_trained_model(
+        out_dir_m / "ckpt", max_steps - 1,
+        OmegaConf.load(out_dir_m / "config.yaml").model.netG)
+
+@hydra.main(config_path="conf/compress_model", config_name="config")
+def main(config: DictConfig):
+
+    # Phase
+    phase = "compress"
+
+    # Out directory
+    exp_dir_m = Path(to_absolute_path(config[phase].exp_dir)) / config[phase].model_name
+    out_dir = Path(to_absolute_path(config[phase].out_dir))
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # Save config
+    with open(out_dir / "config.yaml", "w") as f:
+        OmegaConf.save(config, f)
+
+    # Random seed
+    pl.seed_everything(config.random_seed)
+    torch.set_num_threads(config[phase].n_threads)
+    device = torch.device(config[phase].device)
+
+    # FPs
+    fp_list_path = Path(to_absolute_path(config.data.fp_list))
+    with open(fp_list_path, "r") as f:
+        fp_list = [l.strip() for l in f]
+
+    # Trained model
+    train_config = OmegaConf.load(exp_dir_m / "config.yaml")
+    model = load_trained_model(exp_dir_m / "ckpt", config[phase].step, train_config.model.netG)
+    assert isinstance(model, BiLSTM), "only BiLSTM can be compressed"
+
+    # Dev batches
+    preprocessed_dir = Path(to_absolute_path(train_config.data.preprocessed_dir))
+    batches = [
+        (x.to(device), y.to(device))
+        for x, y in get_split_loader(config.data, preprocessed_dir, "dev_all", False)]
+    dev_fp_rate_dict = load_fp_rate_dict(preprocessed_dir / "dev_all_fp_rate.list")
+    feats = unpad_feats(batches)
+
+    def report(model):
+        model.to(device)
+        scores = calc_batch_scores(model, batches, fp_list, dev_fp_rate_dict)
+        return [
+            str(sum([p.numel() for p in model.parameters()])),
+            "{:.2f}".format(get_state_dict_size(model) / 1e6),
+        ] + [
+            "{:.2f}".format(measure_latency(
+                model, feats, batch_size, config[phase].n_latency_batches) * 1e3)
+            for batch_size in config[phase].batch_sizes
+        ] + [
+            "{:.4f}".format(float(scores[score_type]["f_score"]))
+            for score_type in ["fp_position", "fp_word"]
+        ]
+
+    rows = [["original", "-", "1.0"] + report(model) + ["-", "-"]]
+    compress_fns = {"prune": prune_hidden_units, "low_rank": factorize_input_weights}
+    for method in config[phase].methods:
+        for ratio in config[phase].ratios:
+            name = "{}{}".format(method, ratio)
+            print(f"compress {name}...")
+            compressed_model = compress_fns[method](model.cpu(), ratio)
+            ckpt_path = out_dir / "{}.pt".format(name)
+            save_inference_ckpt(
+                ckpt_path, compressed_model.state_dict(),
+                OmegaConf.create(get_bilstm_netG_config(compressed_model)))
+            row = report(compressed_model)
+
+            # Short fine-tune, exported as weight-only checkpoint
+            if config[phase].fine_tune.enable:
+                fine_tuned_model = fine_tune(config, preprocessed_dir, ckpt_path, out_dir / name)
+                save_inference_ckpt(
+                    out_dir / "{}.ft.pt".format(name), fine_tuned_model.state_dict(),
+                    OmegaConf.create(get_bilstm_netG_config(fine_tuned_model)))
+                row += report(fine_tuned_model)[-2:]
+            else:
+                row += ["-", "-"]
+            rows.append([name, method, str(ratio)] + row)
+
+    # Write comparison table
+    header = ["model", "method", "ratio", "n_params", "size[MB]"] + [
+        f"latency_bs{batch_size}[ms]" for batch_size in config[phase].batch_sizes
+    ] + [
+        "fp_position/f_score", "fp_word/f_score",
+        "fp_position/f_score(fine-tuned)", "fp_word/f_score(fine-tuned)",
+    ]
+    out_text = "\n".join(["\t".join(row) for row in [header] + rows])
+    print(out_text)
+    with open(out_dir / "compress_model.tsv", "w") as f:
+        f.write(out_text)
+
+if __name__=="__main__":
+    main()
@@ -1,84 +1,91 @@
+import copy
 from pathlib import Path
 from tqdm import tqdm
 import hydra
 from hydra.utils import to_absolute_path
 from omegaconf import OmegaConf, DictConfig
 
+import numpy as np
 import torch
 from torch.utils.data import DataLoader
 import pytorch_lightning as pl
 
 # My library
-from fp_pred_group.dataset import MyDataset
+from fp_pred_group.dataset import NoFPDataset
+from fp_pred_group.model import GroupHead
 from fp_pred_group.module import MyLightningModel
-from fp_pred_group.util.train_util import collate_fn
-from fp_pred_group.util.eval_util import calc_score_all, calc_score_each_fp
-
-def evaluate(
-    config, train_config, utt_list_path, trainer, model, out_dir, fp_list, eval_fp_rate_dict):
+from fp_pred_group.preprocessor.preprocess_feat import load_bert, load_projection
+from fp_pred_group.runtime import quantize_tagger
+from fp_pred_group.streaming import ChunkedBertEmbedder
+from fp_pred_group.util.bench_util import get_state_dict_size, measure_latency
+from fp_pred_group.util.ckpt_util import load_inference_model
+from fp_pred_group.util.memory_util import MemoryCallback, MemoryTracker
+from fp_pred_group.util.train_util import get_mask, pad_2d
+from fp_pred_group.util.eval_util import (
+    METRICS, calc_confusion_matrices, calc_scores, bootstrap_scores)
+
+def get_data_loader(config, train_config, utt_list_path):
 
     # Load utt list
     with open(utt_list_path, "r") as f:
-        sentence_list = [l.strip() for l in f]
-        utt_name_list = ["-".join(sen.split(":")[:3]) for sen in sentence_list]
+        utt_name_list = [
+            "-".join(l.strip().split(":")[:3]) for l in f if len(l.strip()) > 0]
 
     # Dataset
     in_feat_dir = Path(train_config.data.preprocessed_dir) / "infeats"
     out_feat_dir = Path(train_config.data.preprocessed_dir) / "outfeats"
 
-    in_feats_paths = [p for p in in_feat_dir.glob("*-feats.npy") if p.stem.split("-feats")[0] in utt_name_list]
+    in_feats_paths = [
+        in_feat_dir / f"{utt_name}-feats.npy" for utt_name in utt_name_list
+        if (in_feat_dir / f"{utt_name}-feats.npy").exists()]
     out_feats_paths = [out_feat_dir / in_path.name for in_path in in_feats_paths]
 
-    dataset = MyDataset(in_feats_paths, out_feats_paths)
+    dataset = NoFPDataset(in_feats_paths, out_feats_paths, utt_list_path)
     data_loader = DataLoader(
         dataset,
         batch_size=config.data.batch_size,
-        collate_fn=collate_fn,
+        collate_fn=dataset.collate_fn,
         pin_memory=True,
         num_workers=config.data.num_workers,
         shuffle=False,
     )
-    
+
+    return data_loader
+
+def write_scores(outputs, out_dir, fp_list, eval_fp_rate_dict):
+
     # Prediction
     out_utt_list = []
+    speaker_index_dict = {}
     prediction_list = []
-    prediction_dict = {}
     target_list = []
-    target_dict = {}
-    outputs = trainer.predict(model, data_loader)
+    speaker_index_list = []
     for output in tqdm(outputs):
-        batch_idx = output["batch_idx"]
-        predictions = output["predictions"]
-        targets = output["targets"]
+        predictions = torch.argmax(output["predictions"], dim=-1).cpu()
+        targets = output["targets"].to(torch.long).cpu()
+        masks = output["masks"].cpu()
 
-        for in_feats_path, prediction, target in zip(
-            in_feats_paths[batch_idx*config.data.batch_size : (batch_idx+1)*config.data.batch_size],
+        for utt_id, ipu_text, prediction, target, mask in zip(
+            output["utt_ids"],
+            output["tagged_texts"],
             predictions,
-            targets
+            targets,
+            masks,
         ):
-            speaker_id, koen_id, ipu_id = in_feats_path.stem.split("-")[:3]
+            speaker_id, koen_id, ipu_id = utt_id.split("-")[:3]
             out_utt_list.append(f"{speaker_id}, {koen_id}, {ipu_id}:")
-            for sen in sentence_list:
-                if sen.startswith(f"{speaker_id}:{koen_id}:{ipu_id}:"):
-                    ipu_text = sen.split(":")[-1]
             out_utt_list.append(f"\ttarget text: \t{ipu_text}")
 
-            fp_prediction = [str(int(i)) for i in torch.argmax(prediction, dim=1)]
-            fp_prediction = " ".join(fp_prediction)
+            fp_prediction = " ".join([str(int(i)) for i in prediction])
             out_utt_list.append(f"\tpredicted text: \t{fp_prediction}")
 
-            prediction_list.append(prediction)
-            target_list.append(target)
-
-            # Each speaker
-            if speaker_id in prediction_dict.keys():
-                prediction_dict[speaker_id].append(prediction)
-            else:
-                prediction_dict[speaker_id] = [prediction]
-            if speaker_id in target_dict.keys():
-                target_dict[speaker_id].append(target)
-            else:
-                target_dict[speaker_id] = [target]
+            # Valid positions of each speaker
+            if speaker_id not in speaker_index_dict.keys():
+                speaker_index_dict[speaker_id] = len(speaker_index_dict)
+            prediction_list.append(prediction[mask])
+            target_list.append(target[mask])
+            speaker_index_list.append(
+                torch.full((int(mask.sum()),), speaker_index_dict[speaker_id], dtype=torch.long))
 
     with open(out_dir / "fp_prediction.txt", "w") as f:
         print("writing prediction...")
@@ -86,124 +93,441 @@ def evaluate(
 
     # Calc score
     print("calc score...")
-
-    # FP position
-    precision, recall, f_score, specificity = calc_score_all(
-        prediction_list,
-        target_list
+    speaker_confusion_matrices = calc_confusion_matrices(
+        torch.cat(prediction_list),
+        torch.cat(target_list),
+        len(fp_list) + 1,
+        group_index=torch.cat(speaker_index_list),
+        n_groups=len(speaker_index_dict),
     )
-    out_text = \
-        "--- fp position ---\nprecision:\t{}\nrecall:\t{}\nf_score:\t{}\nspecificity:{}\n\n".format(
-            precision, recall, f_score, specificity
-        )
+    scores = calc_scores(speaker_confusion_matrices.sum(dim=0), fp_list, eval_fp_rate_dict)
+    speaker_scores = calc_scores(speaker_confusion_matrices, fp_list, eval_fp_rate_dict)
 
-    # Each fp word
-    precision_word = 0
-    recall_word = 0
-    f_score_word = 0
-    specificity_word = 0
-    rate_sum = 0
-    out_texts = []
-    for i in tqdm(range(len(fp_list))):
-        fp_rate = eval_fp_rate_dict[fp_list[i]]
-        rate_sum += fp_rate
-
-        precision, recall, f_score, specificity = calc_score_each_fp(
-            prediction_list,
-            target_list,
-            i + 1
-        )
-        if precision is not None and torch.isnan(precision).sum() == 0:
-            precision_word += precision * fp_rate
-        if recall is not None and torch.isnan(recall).sum() == 0:
-            recall_word += recall * fp_rate
-        if f_score is not None and torch.isnan(f_score).sum() == 0:
-            f_score_word += f_score * fp_rate
-        if specificity is not None and torch.isnan(specificity).sum() == 0:
-            specificity_word += specificity * fp_rate
-
-        out_texts.append(
-            "--- {} ---\nprecision:\t{}\nrecall:\t{}\nf_score:\t{}\nspecificity:{}\n".format(
-                fp_list[i], precision, recall, f_score, specificity
-            )
-        )
+    score_format = "--- {} ---\nprecision:\t{}\nrecall:\t{}\nf_score:\t{}\nspecificity:{}\n"
+
+    # FP position
+    out_text = score_format.format(
+        "fp position", *[float(scores["fp_position"][metric]) for metric in METRICS]) + "\n"
 
-    # FP word
-    out_text += \
-        "--- fp word ---\nprecision:\t{}\nrecall:\t{}\nf_score:\t{}\nspecificity:{}\n\n".format(
-            precision_word / rate_sum, 
-            recall_word / rate_sum, 
-            f_score_word / rate_sum, 
-            specificity_word / rate_sum
-        ) + "\n".join(out_texts)
+    # FP word and each fp word
+    out_text += score_format.format(
+        "fp word", *[float(scores["fp_word"][metric]) for metric in METRICS]) + "\n"
+    out_text += "\n".join([
+        score_format.format(fp, *[float(scores["each_fp"][metric][i]) for metric in METRICS])
+        for i, fp in enumerate(fp_list)
+    ])
 
     # Each speaker
     out_text += "\n--- speakers ---\n"
-    f_scores = []
-    f_score_words = []
-    for spk in prediction_dict.keys():
-        prediction_list = prediction_dict[spk]
-        target_list = target_dict[spk]
-        _, _, f_score, _ = calc_score_all(
-            prediction_list,
-            target_list
+    for spk, spk_index in speaker_index_dict.items():
+        out_text += "{}: \t\t{},\t{}\n".format(
+            spk,
+            float(speaker_scores["fp_position"]["f_score"][spk_index]),
+            float(speaker_scores["fp_word"]["f_score"][spk_index]),
         )
-        f_scores.append(f_score)
-        out_text += "{}: \t\t{},".format(spk, f_score)
-
-        precision_word = 0
-        recall_word = 0
-        f_score_word = 0
-        specificity_word = 0
-        rate_sum = 0
-        for i in tqdm(range(len(fp_list))):
-            fp_rate = eval_fp_rate_dict[fp_list[i]]
-            rate_sum += fp_rate
-
-            precision, recall, f_score, specificity = calc_score_each_fp(
-                prediction_list,
-                target_list,
-                i + 1
-            )
-            if precision is not None and torch.isnan(precision).sum() == 0:
-                precision_word += precision * fp_rate
-            if recall is not None and torch.isnan(recall).sum() == 0:
-                recall_word += recall * fp_rate
-            if f_score is not None and torch.isnan(f_score).sum() == 0:
-                f_score_word += f_score * fp_rate
-            if specificity is not None and torch.isnan(specificity).sum() == 0:
-                specificity_word += specificity * fp_rate
-
-        f_score_words.append(f_score_word)
-        out_text += "\t{}\n".format(f_score_word / rate_sum)
-        
+
     # Write scores
     with open(out_dir / "scores.txt", "w") as f:
         print("writing score...")
         f.write(out_text)
 
+    return scores
+
+def evaluate(
+    config, train_config, utt_list_path, trainer, model, out_dir, fp_list, eval_fp_rate_dict,
+    memory_tracker=None):
+
+    data_loader = get_data_loader(config, train_config, utt_list_path)
+    outputs = trainer.predict(model, data_loader)
+
+    # Memory of all outputs held for scoring, and of scoring
+    if memory_tracker is not None:
+        memory_tracker.sample("predict")
+    scores = write_scores(outputs, out_dir, fp_list, eval_fp_rate_dict)
+    if memory_tracker is not None:
+        memory_tracker.sample("write_scores")
+    return scores
+
+def get_eval_setting(train_config, model_name, split_name=None):
+
+    # Utterance list (eval split of the model, if split name is not given)
+    if split_name is None and model_name == "non_personalized":
+        split_name = "eval_all"
+    elif split_name is None:
+        split_name = "eval_{}".format(model_name)
+    utt_list_path = Path(train_config.data.preprocessed_dir) / "{}.list".format(split_name)
+
+    # Get fp rate
+    eval_fp_rate_dict = {}
+    eval_fp_rate_list_path = \
+        Path(train_config.data.preprocessed_dir) / "{}_fp_rate.list".format(split_name)
+    with open(eval_fp_rate_list_path, "r") as f:
+        for l in f:
+            eval_fp_rate_dict[l.strip().split(":")[0]] = float(l.strip().split(":")[1])
+
+    return utt_list_path, eval_fp_rate_dict
+
+def get_loss_weights(eval_fp_rate_dict, fp_list):
+    loss_weights = [1 / (eval_fp_rate_dict["no_fp"] + eval_fp_rate_dict["others"])]
+    for fp in fp_list:
+        if eval_fp_rate_dict[fp] == 0:
+            loss_weights.append(0)
+        else:
+            loss_weights.append(1 / eval_fp_rate_dict[fp])
+    return loss_weights
+
+def load_model(train_config, ckpt_dir, step, fp_list, loss_weights):
+    model = hydra.utils.instantiate(train_config.model.netG)
+    ckpt_path = list(ckpt_dir.glob(
+        "*-step={}.ckpt".format(str(step))
+    ))[0]
+    pl_model = MyLightningModel.load_from_checkpoint(
+        ckpt_path,
+        model=model,
+        fp_list=fp_list,
+        loss_weights=loss_weights,
+    )
+    return pl_model
+
+def cache_batches(config, train_config, utt_list_path, device):
+    print(f"loading {utt_list_path.name}...")
+    data_loader = get_data_loader(config, train_config, utt_list_path)
+    return [(x.to(device), y.to(device), info) for x, y, info in tqdm(data_loader)]
+
+def cache_chunked_batches(config, train_config, utt_list_path, device, streaming_config):
+    """Cache batches of features embedded chunk-wise by ``ChunkedBertEmbedder``.
+
+    Morphemes of each utterance are embedded in chunks of
+    ``streaming_config.chunk_size`` with up to ``left_context`` previous
+    tokens, as in streaming prediction, instead of the stored features of
+    whole utterances. Targets and texts are the same as ``cache_batches``.
+    """
+
+    bert_tokenizer, bert_model = load_bert(to_absolute_path(config.bert_model_dir))
+    bert_model.to(device)
+    projection_path = Path(train_config.data.preprocessed_dir) / "projection.npz"
+    embedder = ChunkedBertEmbedder(
+        bert_tokenizer, bert_model,
+        chunk_size=streaming_config.chunk_size,
+        left_context=streaming_config.left_context,
+        device=device,
+        projection=load_projection(projection_path) if projection_path.exists() else None,
+    )
+
+    print(f"embedding {utt_list_path.name} (chunk_size={streaming_config.chunk_size})...")
+    data_loader = get_data_loader(config, train_config, utt_list_path)
+    batches = []
+    for x, y, info in tqdm(data_loader):
+        feats_list = []
+        for text, mask in zip(info["texts"], get_mask(x)):
+            morphs = [m for m in text.split(" ") if m != ""]
+            feats = np.concatenate([embedder.push(morphs), embedder.flush()])
+            assert len(feats) == int(mask.sum()), \
+                "{} chunked features should be as many as {} stored ones".format(
+                    len(feats), int(mask.sum()))
+            feats_list.append(torch.from_numpy(pad_2d(feats, x.size(1))))
+        batches.append((torch.stack(feats_list).to(device), y.to(device), info))
+    return batches
+
+def predict_cached(pl_model, batches, device):
+    pl_model.to(device)
+    pl_model.eval()
+    outputs = []
+    with torch.no_grad():
+        for batch_idx, batch in enumerate(batches):
+            outputs.append(pl_model.predict_step(batch, batch_idx))
+    return outputs
+
+def get_device(gpus):
+    return torch.device("cuda" if gpus and torch.cuda.is_available() else "cpu")
+
+def get_sweep_entry(entry):
+    """Name, eval split and streaming setting (or None) of an entry of ``sweep.model_names``.
+
+    An entry is a model name, or a mapping of the name with optional
+    ``split`` (e.g. eval_all) and ``streaming`` ({chunk_size, left_context}).
+    """
+    if isinstance(entry, str):
+        return entry, None, None
+    return entry.name, entry.get("split", None), entry.get("streaming", None)
+
+def sweep(config, exp_dir, out_dir, fp_list):
+    """Evaluate every pair of model and checkpoint step.
+
+    Features of each eval split are read once and cached on the device,
+    and all checkpoints are run over the cached batches. Sweeping over
+    ``StreamingLSTM`` models trained with different lookahead (``train.model_name``)
+    on the same split gives the accuracy-vs-lookahead table. Entries with
+    ``streaming`` are evaluated on features embedded chunk-wise, as in
+    streaming prediction, and the delay of their fp decisions is at most
+    lookahead + chunk_size - 1 morphemes.
+    """
+
+    phase = "eval"
+    device = get_device(config[phase].gpus)
+
+    cached_batches = {}
+    rows = []
+    for entry in config[phase].sweep.model_names:
+        model_name, split_name, streaming_config = get_sweep_entry(entry)
+        exp_dir_m = exp_dir / model_name
+        ckpt_dir = exp_dir_m / "ckpt"
+        train_config = OmegaConf.load(exp_dir_m / "config.yaml")
+
+        utt_list_path, eval_fp_rate_dict = get_eval_setting(train_config, model_name, split_name)
+
+        # Delay of fp decisions [morphemes] (whole utterance with features of whole utterances)
+        if streaming_config is None:
+            feats_name = "utterance"
+            lookahead = str(train_config.model.netG.get("lookahead", "full"))
+            delay = "full"
+        else:
+            feats_name = "chunk{}_left{}".format(
+                streaming_config.chunk_size, streaming_config.left_context)
+            lookahead = str(train_config.model.netG.lookahead)
+            delay = str(train_config.model.netG.lookahead + streaming_config.chunk_size - 1)
+
+        # Load features of eval split once (for each chunking)
+        batches_key = (utt_list_path, feats_name)
+        if batches_key not in cached_batches.keys():
+            cached_batches[batches_key] = cache_batches(
+                config, train_config, utt_list_path, device) if streaming_config is None \
+                else cache_chunked_batches(
+                    config, train_config, utt_list_path, device, streaming_config)
+
+        loss_weights = get_loss_weights(eval_fp_rate_dict, fp_list) \
+            if config[phase].loss_weights else None
+
+        for step in config[phase].sweep.steps:
+            print(f"evaluate {model_name} on {utt_list_path.stem} ({feats_name}, step={step})...")
+            out_dir_m = out_dir / model_name / utt_list_path.stem / feats_name / "step{}".format(str(step))
+            out_dir_m.mkdir(parents=True, exist_ok=False)
+
+            pl_model = load_model(train_config, ckpt_dir, step, fp_list, loss_weights)
+            outputs = predict_cached(pl_model, cached_batches[batches_key], device)
+            scores = write_scores(outputs, out_dir_m, fp_list, eval_fp_rate_dict)
+
+            rows.append([model_name, str(step), utt_list_path.stem, feats_name, lookahead, delay] + [
+                str(float(scores[score_type][metric]))
+                for score_type in ["fp_position", "fp_word"] for metric in METRICS
+            ])
+
+    # Write comparison table
+    header = ["model", "step", "split", "features", "lookahead", "delay"] + [
+        f"{score_type}/{metric}"
+        for score_type in ["fp_position", "fp_word"] for metric in METRICS
+    ]
+    with open(out_dir / "sweep_scores.tsv", "w") as f:
+        print("writing sweep scores...")
+        f.write("\n".join(["\t".join(row) for row in [header] + rows]))
+
+def calc_ipu_confusion_matrices(outputs, tagset_size):
+    """Calculate confusion matrix of each IPU, shape of (n_ipu, tagset_size, tagset_size)."""
+
+    ipu_confusion_matrices = []
+    for output in outputs:
+        predictions = torch.argmax(output["predictions"], dim=-1)
+        targets = output["targets"].to(torch.long)
+        masks = output["masks"]
+        ipu_index = torch.arange(
+            predictions.size(0), device=predictions.device).unsqueeze(1).expand_as(predictions)
+        ipu_confusion_matrices.append(
+            calc_confusion_matrices(
+                predictions[masks],
+                targets[masks],
+                tagset_size,
+                group_index=ipu_index[masks],
+                n_groups=predictions.size(0),
+            ).cpu()
+        )
+    return torch.cat(ipu_confusion_matrices)
+
+def cross_evaluate(config, exp_dir, out_dir, fp_list):
+    """Evaluate every model on every eval split with bootstrap confidence intervals.
+
+    Confusion matrices of each IPU are computed once per pair of model and
+    split, and all scores are bootstrapped over IPUs by vectorized resampling.
+    """
+
+    phase = "eval"
+    device = get_device(config[phase].gpus)
+    cross_config = config[phase].cross
+    score_types = ["fp_position", "fp_word"]
+
+    cached_batches = {}
+    eval_settings = {}
+    results = {}
+    for model_name, step in cross_config.models.items():
+        exp_dir_m = exp_dir / model_name
+        train_config = OmegaConf.load(exp_dir_m / "config.yaml")
+
+        # Loss weights of the model's own eval split, as when evaluating the model alone
+        loss_weights = None
+        if config[phase].loss_weights:
+            loss_weights = get_loss_weights(get_eval_setting(train_config, model_name)[1], fp_list)
+        pl_model = load_model(train_config, exp_dir_m / "ckpt", step, fp_list, loss_weights)
+
+        for split_name in cross_config.split_names:
+            # Load features of eval split once
+            if split_name not in cached_batches.keys():
+                utt_list_path, eval_fp_rate_dict = get_eval_setting(train_config, split_name)
+                eval_settings[split_name] = eval_fp_rate_dict
+                cached_batches[split_name] = cache_batches(
+                    config, train_config, utt_list_path, device)
+            eval_fp_rate_dict = eval_settings[split_name]
+
+            print(f"evaluate {model_name} on {split_name}...")
+            outputs = predict_cached(pl_model, cached_batches[split_name], device)
+            ipu_confusion_matrices = calc_ipu_confusion_matrices(outputs, len(fp_list) + 1)
+            scores = calc_scores(ipu_confusion_matrices.sum(dim=0), fp_list, eval_fp_rate_dict)
+            intervals = bootstrap_scores(
+                ipu_confusion_matrices, fp_list, eval_fp_rate_dict,
+                n_bootstrap=cross_config.n_bootstrap,
+                confidence=cross_config.confidence,
+                random_seed=config.random_seed,
+            )
+            results[(model_name, split_name)] = (scores, intervals)
+
+    # Write all scores with confidence intervals
+    rows = [["model", "split", "score", "value", "lower", "upper"]]
+    for (model_name, split_name), (scores, intervals) in results.items():
+        for score_type in score_types:
+            for metric in METRICS:
+                rows.append([
+                    model_name, split_name, f"{score_type}/{metric}",
+                    str(float(scores[score_type][metric])),
+                    str(float(intervals[score_type][metric][0])),
+                    str(float(intervals[score_type][metric][1])),
+                ])
+    with open(out_dir / "cross_scores.tsv", "w") as f:
+        f.write("\n".join(["\t".join(row) for row in rows]))
+
+    # Write matrix report of f-scores (rows: models, columns: eval splits)
+    out_text = ""
+    for score_type in score_types:
+        out_text += "--- {} f_score ({:.0%} CI) ---\n".format(score_type, cross_config.confidence)
+        out_text += "\t" + "\t".join(cross_config.split_names) + "\n"
+        for model_name in cross_config.models.keys():
+            cells = []
+            for split_name in cross_config.split_names:
+                scores, intervals = results[(model_name, split_name)]
+                cells.append("{:.4f} [{:.4f}, {:.4f}]".format(
+                    float(scores[score_type]["f_score"]),
+                    *intervals[score_type]["f_score"],
+                ))
+            out_text += model_name + "\t" + "\t".join(cells) + "\n"
+        out_text += "\n"
+    with open(out_dir / "cross_scores.txt", "w") as f:
+        print("writing cross scores...")
+        f.write(out_text)
+
+def validate_quantization(
+    config, train_config, utt_list_path, pl_model, out_dir, fp_list, eval_fp_rate_dict):
+    """Compare float and dynamic int8 quantized models on CPU.
+
+    Scores on the eval split, forward latency for several batch sizes,
+    and size of weights are written to quantization.txt.
+    """
+
+    phase = "eval"
+    device = torch.device("cpu")
+    batches = cache_batches(config, train_config, utt_list_path, device)
+
+    # Utterances without padding for latency measurement
+    feats = []
+    for x, _, _ in batches:
+        for x_i, mask in zip(x, get_mask(x)):
+            feats.append(x_i[mask])
+
+    float_model = pl_model.model.cpu()
+    float_model.eval()
+    quantized_model = quantize_tagger(copy.deepcopy(float_model))
+
+    results = {}
+    for name, model in [("float", float_model), ("int8", quantized_model)]:
+        print(f"evaluate {name} model...")
+        outputs = predict_cached(
+            MyLightningModel(model=model, fp_list=fp_list), batches, device)
+        scores = calc_scores(
+            calc_ipu_confusion_matrices(outputs, len(fp_list) + 1).sum(dim=0),
+            fp_list, eval_fp_rate_dict)
+        latencies = {
+            batch_size: measure_latency(
+                model, feats, batch_size, config[phase].quantization.n_latency_batches)
+            for batch_size in config[phase].quantization.batch_sizes
+        }
+        results[name] = (scores, latencies, get_state_dict_size(model))
+
+    # Report
+    out_text = ""
+    for score_type in ["fp_position", "fp_word"]:
+        for metric in METRICS:
+            float_score = float(results["float"][0][score_type][metric])
+            int8_score = float(results["int8"][0][score_type][metric])
+            out_text += "{}/{}:\tfloat {:.4f}\tint8 {:.4f}\tdiff {:+.4f}\n".format(
+                score_type, metric, float_score, int8_score, int8_score - float_score)
+    out_text += "\n"
+    for batch_size in config[phase].quantization.batch_sizes:
+        float_latency = results["float"][1][batch_size]
+        int8_latency = results["int8"][1][batch_size]
+        out_text += "latency (batch_size={}):\tfloat {:.2f} [ms]\tint8 {:.2f} [ms]\tspeedup {:.2f}x\n".format(
+            batch_size, float_latency * 1e3, int8_latency * 1e3, float_latency / int8_latency)
+    out_text += "\nweights:\tfloat {:.2f} [MB]\tint8 {:.2f} [MB]\n".format(
+        results["float"][2] / 1e6, results["int8"][2] / 1e6)
+
+    print(out_text)
+    with open(out_dir / "quantization.txt", "w") as f:
+        f.write(out_text)
+
 @hydra.main(config_path="conf/evaluate", config_name="config")
 def main(config: DictConfig):
 
     # Phase
     phase = "eval"
 
+    # Input and output directory
+    exp_dir = Path(to_absolute_path(config[phase].exp_dir))
+    out_dir = Path(to_absolute_path(config[phase].out_dir))
+
+    # Set rrandom seed
+    pl.seed_everything(config.random_seed)
+
+    # Sweep over models and checkpoints, or evaluate models across groups
+    if config[phase].sweep.enable or config[phase].cross.enable:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        with open(out_dir / "config.yaml", "w") as f:
+            OmegaConf.save(config, f)
+
+        if config[phase].sweep.enable:
+            first_model_name = get_sweep_entry(config[phase].sweep.model_names[0])[0]
+        else:
+            first_model_name = list(config[phase].cross.models.keys())[0]
+        train_config = OmegaConf.load(exp_dir / first_model_name / "config.yaml")
+        with open(Path(train_config.data.fp_list), "r") as f:
+            fp_list = [l.strip() for l in f]
+
+        if config[phase].sweep.enable:
+            sweep(config, exp_dir, out_dir, fp_list)
+        else:
+            cross_evaluate(config, exp_dir, out_dir, fp_list)
+        return
+
     # Model type
     model_type = config[phase].model_type
     if model_type == "non_personalized":
         model_name = "non_personalized"
-    elif model_type == "group":
+    elif model_type in ["group", "multi_group"]:
         group_id = config[phase].group_id
         model_name = "group{}".format(str(group_id))
 
     # Input directory
-    exp_dir = Path(to_absolute_path(config[phase].exp_dir))
-    exp_dir_m = exp_dir / model_name
+    exp_name = "multi_group" if model_type == "multi_group" else model_name
+    exp_dir_m = exp_dir / exp_name
     ckpt_dir = exp_dir_m / "ckpt"
 
     # Output directory
-    out_dir = Path(to_absolute_path(config[phase].out_dir))
-    out_dir_m = out_dir / model_name
+    out_dir_m = out_dir / exp_name / model_name if model_type == "multi_group" \
+        else out_dir / model_name
     out_dir_m.mkdir(parents=True, exist_ok=False)
 
     # Load config
@@ -213,53 +537,49 @@ def main(config: DictConfig):
     with open(out_dir_m / "config.yaml", "w") as f:
         OmegaConf.save(config, f)
 
-    # Set rrandom seed
-    pl.seed_everything(config.random_seed)
-
-    # Utterance list
-    if model_type == "non_personalized":
-        utt_list_path = Path(train_config.data.preprocessed_dir) / "eval_all.list"
-    elif model_type == "group":
-        utt_list_path = Path(train_config.data.preprocessed_dir) / "eval_{}.list".format(model_name)
-
     # FPs
     fp_list_path = Path(train_config.data.fp_list)
     with open(fp_list_path, "r") as f:
         fp_list = [l.strip() for l in f]
 
-    # Get fp rate
-    eval_fp_rate_dict = {}
-    if model_type == "non_personalized":
-        eval_fp_rate_list_path = Path(train_config.data.preprocessed_dir) / "eval_all_fp_rate.list"
-    elif model_type == "group":
-        eval_fp_rate_list_path = \
-            Path(train_config.data.preprocessed_dir) / "eval_{}_fp_rate.list".format(model_name)
-    with open(eval_fp_rate_list_path, "r") as f:
-        for l in f:
-            eval_fp_rate_dict[l.strip().split(":")[0]] = float(l.strip().split(":")[1])
+    # Utterance list and fp rate
+    utt_list_path, eval_fp_rate_dict = get_eval_setting(train_config, model_name)
 
     # Get loss weights
     if config[phase].loss_weights:
-        loss_weights = [1 / (eval_fp_rate_dict["no_fp"] + eval_fp_rate_dict["others"])]
-        for fp in fp_list:
-            if eval_fp_rate_dict[fp] == 0:
-                loss_weights.append(0)
-            else:
-                loss_weights.append(1 / eval_fp_rate_dict[fp])
+        loss_weights = get_loss_weights(eval_fp_rate_dict, fp_list)
     else:
         loss_weights = None
 
     # Load model
-    model = hydra.utils.instantiate(train_config.model.netG)
-    ckpt_path = list(ckpt_dir.glob(
-        "*-step={}.ckpt".format(str(config[phase].checkpoint.step))
-    ))[0]
-    pl_model = MyLightningModel.load_from_checkpoint(
-        ckpt_path,
-        model=model,
-        fp_list=fp_list,
-        loss_weights=loss_weights,
-    )
+    if config[phase].checkpoint.path is not None:
+        pl_model = MyLightningModel(
+            model=load_inference_model(to_absolute_path(config[phase].checkpoint.path)),
+            fp_list=fp_list,
+            loss_weights=loss_weights,
+        )
+    else:
+        pl_model = load_model(
+            train_config, ckpt_dir, config[phase].checkpoint.step, fp_list, loss_weights)
+    if model_type == "multi_group":
+        # Head of the group on shared trunk
+        pl_model.model = GroupHead(
+            pl_model.model, list(train_config.train.group_ids).index(group_id))
+
+    # Validate dynamic int8 quantization
+    if config[phase].quantization.enable:
+        validate_quantization(
+            config, train_config, utt_list_path, pl_model, out_dir_m, fp_list, eval_fp_rate_dict)
+        return
+
+    # Memory of prediction steps and scoring
+    memory_tracker = MemoryTracker(
+        enabled=config[phase].memory.enable, track_tensors=config[phase].memory.track_tensors)
+    callbacks = []
+    if memory_tracker.enabled:
+        callbacks.append(MemoryCallback(
+            memory_tracker, out_dir_m / "memory.json",
+            sample_every_n_steps=config[phase].memory.sample_every_n_steps))
 
     # Trainer
     trainer = pl.Trainer(
@@ -267,14 +587,20 @@ def main(config: DictConfig):
         gpus=config[phase].gpus,
         auto_select_gpus=config[phase].auto_select_gpus,
         default_root_dir=exp_dir_m,
+        callbacks=callbacks,
         # profiler="simple",
     )
 
     # Predict
-    evaluate(config, train_config, utt_list_path, trainer, pl_model, out_dir_m, fp_list, eval_fp_rate_dict)
+    evaluate(
+        config, train_config, utt_list_path, trainer, pl_model, out_dir_m, fp_list, eval_fp_rate_dict,
+        memory_tracker=memory_tracker)
+    if memory_tracker.enabled:
+        memory_tracker.save(out_dir_m / "memory.json")
+        memory_tracker.print_summary()
 
     # elif config.corpus.name == "utokyo_naist_lecture":
     #     predict_utokyo_naist_lecture(config, phase, trainer, pl_model, out_dir, fp_list, eval_fp_rate_dict)
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,113 @@
+import time
+from pathlib import Path
+import hydra
+from hydra.utils import to_absolute_path
+from omegaconf import OmegaConf, DictConfig
+
+import torch
+
+# My library
+from fp_pred_group.module import MyLightningModel
+from fp_pred_group.runtime import export_torchscript, quantize_tagger
+from fp_pred_group.util.ckpt_util import (
+    get_model_state_dict, save_inference_ckpt, save_delta_ckpt, load_inference_model)
+
+def get_ckpt_path(exp_dir, model_name, step):
+    return list((exp_dir / model_name / "ckpt").glob(
+        "*-step={}.ckpt".format(str(step))
+    ))[0]
+
+def measure_load_time(load_fn, n_repeats=3):
+    elapsed_times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        load_fn()
+        elapsed_times.append(time.perf_counter() - start)
+    return min(elapsed_times)
+
+@hydra.main(config_path="conf/export", config_name="config")
+def main(config: DictConfig):
+
+    exp_dir = Path(to_absolute_path(config.exp_dir))
+    out_dir = Path(to_absolute_path(config.out_dir))
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # Save config
+    with open(out_dir / "config.yaml", "w") as f:
+        OmegaConf.save(config, f)
+
+    # Base model
+    base_name = config.base.model_name
+    base_train_config = OmegaConf.load(exp_dir / base_name / "config.yaml")
+    base_ckpt_path = get_ckpt_path(exp_dir, base_name, config.base.step)
+    base_out_path = out_dir / "{}.pt".format(base_name)
+    save_inference_ckpt(
+        base_out_path,
+        get_model_state_dict(torch.load(base_ckpt_path, map_location="cpu")["state_dict"]),
+        base_train_config.model.netG,
+    )
+    exported = [(base_name, base_train_config, base_ckpt_path, base_out_path)]
+
+    # Delta models
+    for model_name, step in config.models.items():
+        train_config = OmegaConf.load(exp_dir / model_name / "config.yaml")
+        ckpt_path = get_ckpt_path(exp_dir, model_name, step)
+        out_path = out_dir / "{}.delta.pt".format(model_name)
+        save_delta_ckpt(
+            out_path,
+            get_model_state_dict(torch.load(ckpt_path, map_location="cpu")["state_dict"]),
+            train_config.model.netG,
+            base_out_path,
+        )
+        exported.append((model_name, train_config, ckpt_path, out_path))
+
+    # FPs
+    with open(base_train_config.data.fp_list, "r") as f:
+        fp_list = [l.strip() for l in f]
+
+    # TorchScript for Lightning-free runtime
+    if config.torchscript:
+        for model_name, train_config, _, out_path in exported:
+            export_torchscript(
+                load_inference_model(out_path),
+                out_dir / "{}.ts".format(model_name),
+                fp_list,
+                train_config.model.netG.embedding_dim,
+            )
+            if config.quantize:
+                export_torchscript(
+                    quantize_tagger(load_inference_model(out_path)),
+                    out_dir / "{}.int8.ts".format(model_name),
+                    fp_list,
+                    train_config.model.netG.embedding_dim,
+                )
+
+    # Report disk usage and load time
+    rows = [["model", "ckpt_size[MB]", "exported_size[MB]", "ckpt_load[sec]", "exported_load[sec]"]]
+    for model_name, train_config, ckpt_path, out_path in exported:
+        def load_ckpt():
+            MyLightningModel.load_from_checkpoint(
+                str(ckpt_path),
+                model=hydra.utils.instantiate(train_config.model.netG),
+                fp_list=fp_list,
+                strict=False)
+        rows.append([
+            model_name,
+            "{:.2f}".format(ckpt_path.stat().st_size / 1e6),
+            "{:.2f}".format(out_path.stat().st_size / 1e6),
+            "{:.3f}".format(measure_load_time(load_ckpt)),
+            "{:.3f}".format(measure_load_time(lambda: load_inference_model(out_path))),
+        ])
+    rows.append([
+        "total",
+        "{:.2f}".format(sum([e[2].stat().st_size for e in exported]) / 1e6),
+        "{:.2f}".format(sum([e[3].stat().st_size for e in exported]) / 1e6),
+        "", "",
+    ])
+    report = "\n".join(["\t".join(row) for row in rows])
+    print(report)
+    with open(out_dir / "export.log", "w") as f:
+        f.write(report)
+
+if __name__=="__main__":
+    main()
@@ -25,6 +25,37 @@ class MyDataset(Dataset):
         y_batch = torch.stack([torch.from_numpy(pad_1d(x[1], max_len)) for x in batch])
         return x_batch, y_batch
 
+class GroupDataset(MyDataset):
+    def __init__(self, in_paths, out_paths, group_ids):
+        super().__init__(in_paths, out_paths)
+        self.group_ids = group_ids
+
+    def __getitem__(self, index):
+        in_feat, out_feat = super().__getitem__(index)
+        return in_feat, out_feat, self.group_ids[index]
+
+    def collate_fn(self, batch):
+        x_batch, y_batch = super().collate_fn(batch)
+        group_batch = torch.tensor([x[2] for x in batch], dtype=torch.long)
+        return x_batch, y_batch, group_batch
+
+class DistillDataset(MyDataset):
+    """Dataset with cached logits of teacher, shape of (length, tagset_size), for distillation."""
+    def __init__(self, in_paths, out_paths, teacher_paths):
+        super().__init__(in_paths, out_paths)
+        self.teacher_paths = teacher_paths
+
+    def __getitem__(self, index):
+        in_feat, out_feat = super().__getitem__(index)
+        teacher_logits = np.load(self.teacher_paths[index]).astype(np.float32)
+        return in_feat, out_feat, teacher_logits
+
+    def collate_fn(self, batch):
+        x_batch, y_batch = super().collate_fn(batch)
+        teacher_batch = torch.stack([
+            torch.from_numpy(pad_2d(x[2], x_batch.size(1))) for x in batch])
+        return x_batch, y_batch, {"teacher_logits": teacher_batch}
+
 class NoFPDataset(Dataset):
     def __init__(self, in_paths, out_paths, utt_list_path=None):
         if utt_list_path is not None:
@@ -34,11 +65,7 @@ class NoFPDataset(Dataset):
                     utt = l.strip()
                     if len(utt) > 0:
                         utt_name = "-".join(utt.split(":")[:-1])
-                        text = " ".join([
-                            w for w in utt.split(":")[-1].split(" ") 
-                            if not w.startswith("(F")])
-                        # text = re.sub(r"\(F.*?\)", "", utt.split(":")[-1])
-                        self.text_dict[utt_name] = text
+                        self.text_dict[utt_name] = utt.split(":")[-1]
 
         self.in_paths = in_paths
         self.out_paths = out_paths
@@ -46,11 +73,19 @@ class NoFPDataset(Dataset):
     def __getitem__(self, index):
         in_feat = np.load(self.in_paths[index]).astype(np.float32)
         out_feat = np.load(self.out_paths[index]).astype(np.float32)
-        in_text = self.text_dict[self.in_paths[index].stem.replace("-feats", "")]
+        utt_id = self.in_paths[index].stem.replace("-feats", "")
+        tagged_text = self.text_dict[utt_id]
+        in_text = " ".join([
+            w for w in tagged_text.split(" ")
+            if not w.startswith("(F")])
+        # text = re.sub(r"\(F.*?\)", "", utt.split(":")[-1])
         sample = {
             "feat": in_feat, 
             "out_feat": out_feat, 
             "text": in_text,
+            "tagged_text": tagged_text,
+            "utt_id": utt_id,
+            "index": index,
         }
         return sample
 
@@ -62,5 +97,10 @@ class NoFPDataset(Dataset):
         max_len = max(lengths)
         x_batch = torch.stack([torch.from_numpy(pad_2d(x["feat"], max_len)) for x in batch])
         y_batch = torch.stack([torch.from_numpy(pad_1d(x["out_feat"], max_len)) for x in batch])
-        text_batch = [x["text"] for x in batch]
-        return x_batch, y_batch, text_batch
\ No newline at end of file
+        info_batch = {
+            "texts": [x["text"] for x in batch],
+            "tagged_texts": [x["tagged_text"] for x in batch],
+            "utt_ids": [x["utt_id"] for x in batch],
+            "indices": [x["index"] for x in batch],
+        }
+        return x_batch, y_batch, info_batch
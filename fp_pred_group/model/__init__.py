@@ -1 +1 @@
-from .model import BiLSTM
\ No newline at end of file
+from .model import BiLSTM, StreamingLSTM, ConvTagger, TagHead, MultiTagger, MultiHeadBiLSTM, GroupHead
\ No newline at end of file
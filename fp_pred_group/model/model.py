@@ -2,6 +2,19 @@ import numpy as np
 import torch
 from torch import nn
 
+class Adapter(nn.Module):
+    """Residual bottleneck adapter, initialized to identity."""
+    def __init__(self, dim, adapter_dim):
+        super().__init__()
+
+        self.down = nn.Linear(dim, adapter_dim)
+        self.up = nn.Linear(adapter_dim, dim)
+        nn.init.zeros_(self.up.weight)
+        nn.init.zeros_(self.up.bias)
+
+    def forward(self, x):
+        return x + self.up(torch.relu(self.down(x)))
+
 class BiLSTM(nn.Module):
     def __init__(
         self, 
@@ -10,6 +23,8 @@ class BiLSTM(nn.Module):
         num_layers,
         dropout,
         tagset_size, 
+        adapter_dim=0,
+        input_rank=0,
     ):
         super().__init__()
 
@@ -18,15 +33,214 @@ class BiLSTM(nn.Module):
         self.num_layers = num_layers
         self.dropout = dropout
         self.tagset_size = tagset_size
+        self.adapter_dim = adapter_dim
+        self.input_rank = input_rank
 
-        self.bilstm = nn.LSTM(embedding_dim, hidden_dim, num_layers, batch_first=True, dropout=dropout, bidirectional=True)
+        # Low-rank factorization of input weights: embeddings are projected to input_rank dims first
+        self.input_proj = nn.Linear(embedding_dim, input_rank, bias=False) if input_rank > 0 else None
+        self.bilstm = nn.LSTM(
+            input_rank if input_rank > 0 else embedding_dim, hidden_dim, num_layers,
+            batch_first=True, dropout=dropout, bidirectional=True)
+        self.adapter = Adapter(hidden_dim * 2, adapter_dim) if adapter_dim > 0 else None
         self.hidden2tag = nn.Linear(hidden_dim * 2, tagset_size)
 
     def forward(self, embeds):
+        if self.input_proj is not None:
+            embeds = self.input_proj(embeds)
         bilstm_outputs, _  = self.bilstm(embeds)
+        if self.adapter is not None:
+            bilstm_outputs = self.adapter(bilstm_outputs)
         tags = self.hidden2tag(bilstm_outputs)
         return tags
 
+class StreamingLSTM(nn.Module):
+    """Unidirectional LSTM tagger with lookahead of k tokens.
+
+    Tag of position i is predicted from the LSTM output after reading
+    position i + lookahead, so it can be emitted as soon as i + lookahead
+    tokens have arrived. Inputs after the end of the sequence are zeros,
+    the same as padding.
+    """
+    def __init__(
+        self, 
+        embedding_dim, 
+        hidden_dim, 
+        num_layers,
+        dropout,
+        tagset_size, 
+        lookahead=0,
+    ):
+        super().__init__()
+
+        self.embedding_dim = embedding_dim
+        self.hidden_dim = hidden_dim
+        self.num_layers = num_layers
+        self.dropout = dropout
+        self.tagset_size = tagset_size
+        self.lookahead = lookahead
+
+        self.lstm = nn.LSTM(embedding_dim, hidden_dim, num_layers, batch_first=True, dropout=dropout)
+        self.hidden2tag = nn.Linear(hidden_dim, tagset_size)
+
+    def forward(self, embeds):
+        embeds = nn.functional.pad(embeds, (0, 0, 0, self.lookahead))
+        tags, _ = self.step(embeds)
+        return tags[:, self.lookahead:]
+
+    def step(self, embeds, state=None):
+        """Run LSTM on newly arrived embeddings from the previous state.
+
+        Returns logits of LSTM outputs (i.e. tags of positions shifted by
+        lookahead) and the new state.
+        """
+        lstm_outputs, state = self.lstm(embeds, state)
+        return self.hidden2tag(lstm_outputs), state
+
+class ConvTagger(nn.Module):
+    """Tagger of residual dilated 1-D convolutions, parallel over time steps.
+
+    Each layer sees ``dilation * (kernel_size - 1)`` more neighbors, so the
+    receptive field of the default config (kernel_size 3, dilations
+    [1, 2, 4, 8] x 2) is 61 tokens. Padded positions are zeroed after every
+    layer, so outputs do not depend on the padding of the batch.
+    """
+    def __init__(
+        self, 
+        embedding_dim, 
+        hidden_dim, 
+        kernel_size,
+        dilations,
+        dropout,
+        tagset_size, 
+    ):
+        super().__init__()
+
+        assert kernel_size % 2 == 1, "kernel_size should be odd"
+
+        self.embedding_dim = embedding_dim
+        self.hidden_dim = hidden_dim
+        self.kernel_size = kernel_size
+        self.dilations = list(dilations)
+        self.dropout = dropout
+        self.tagset_size = tagset_size
+
+        self.input_proj = nn.Linear(embedding_dim, hidden_dim)
+        self.convs = nn.ModuleList([
+            nn.Conv1d(
+                hidden_dim, hidden_dim, kernel_size,
+                dilation=dilation, padding=dilation * (kernel_size - 1) // 2)
+            for dilation in self.dilations])
+        self.norms = nn.ModuleList([nn.LayerNorm(hidden_dim) for _ in self.dilations])
+        self.drop = nn.Dropout(dropout)
+        self.hidden2tag = nn.Linear(hidden_dim, tagset_size)
+
+    def forward(self, embeds):
+        mask = (embeds != 0).any(dim=-1, keepdim=True).to(embeds.dtype)
+        hidden = self.input_proj(embeds) * mask
+        for conv, norm in zip(self.convs, self.norms):
+            outputs = torch.relu(conv(hidden.transpose(1, 2))).transpose(1, 2)
+            hidden = norm(hidden + self.drop(outputs)) * mask
+        tags = self.hidden2tag(hidden)
+        return tags
+
+class TagHead(nn.Module):
+    """Adapter and hidden2tag of ``BiLSTM``, applied to cached BiLSTM outputs.
+
+    Parameters are shared with the given model, so training the head
+    updates the model.
+    """
+    def __init__(self, model):
+        super().__init__()
+
+        self.adapter = model.adapter
+        self.hidden2tag = model.hidden2tag
+
+    def forward(self, bilstm_outputs):
+        if self.adapter is not None:
+            bilstm_outputs = self.adapter(bilstm_outputs)
+        return self.hidden2tag(bilstm_outputs)
+
+class MultiTagger(nn.Module):
+    """Run several taggers over the same embeddings.
+
+    Returns logits of all taggers stacked as (n_taggers, batch, length, tagset_size).
+    """
+    def __init__(self, taggers):
+        super().__init__()
+
+        self.tagger_names = list(taggers.keys())
+        self.taggers = nn.ModuleDict(taggers)
+
+    def forward(self, embeds):
+        return torch.stack([self.taggers[name](embeds) for name in self.tagger_names])
+
+class MultiHeadBiLSTM(nn.Module):
+    """BiLSTM trunk shared by all groups with a hidden2tag head (and adapter) per group.
+
+    Returns logits of all groups stacked as (n_groups, batch, length, tagset_size),
+    or logits of each sample's group as (batch, length, tagset_size) if group_ids is given.
+    """
+    def __init__(
+        self, 
+        embedding_dim, 
+        hidden_dim, 
+        num_layers,
+        dropout,
+        tagset_size, 
+        n_groups,
+        adapter_dim=0,
+    ):
+        super().__init__()
+
+        self.embedding_dim = embedding_dim
+        self.hidden_dim = hidden_dim
+        self.num_layers = num_layers
+        self.dropout = dropout
+        self.tagset_size = tagset_size
+        self.n_groups = n_groups
+        self.adapter_dim = adapter_dim
+
+        self.bilstm = nn.LSTM(embedding_dim, hidden_dim, num_layers, batch_first=True, dropout=dropout, bidirectional=True)
+        if adapter_dim > 0:
+            self.adapters = nn.ModuleList([
+                Adapter(hidden_dim * 2, adapter_dim) for _ in range(n_groups)])
+        else:
+            self.adapters = None
+        self.hidden2tag = nn.ModuleList([
+            nn.Linear(hidden_dim * 2, tagset_size) for _ in range(n_groups)])
+
+    def forward(self, embeds, group_ids=None):
+        bilstm_outputs, _  = self.bilstm(embeds)
+        tags = []
+        for i in range(self.n_groups):
+            outputs = bilstm_outputs if self.adapters is None else self.adapters[i](bilstm_outputs)
+            tags.append(self.hidden2tag[i](outputs))
+        tags = torch.stack(tags)
+
+        if group_ids is not None:
+            tags = tags[group_ids, torch.arange(embeds.size(0), device=embeds.device)]
+        return tags
+
+    def load_base_state_dict(self, state_dict):
+        """Initialize trunk and all heads from state dict of ``BiLSTM``."""
+        self.bilstm.load_state_dict({
+            k[len("bilstm."):]: v for k, v in state_dict.items() if k.startswith("bilstm.")})
+        for head in self.hidden2tag:
+            head.load_state_dict({
+                k[len("hidden2tag."):]: v for k, v in state_dict.items()
+                if k.startswith("hidden2tag.")})
+
+class GroupHead(nn.Module):
+    """Tagger of one group of ``MultiHeadBiLSTM``."""
+    def __init__(self, model, group_index):
+        super().__init__()
+
+        self.model = model
+        self.group_index = group_index
+
+    def forward(self, embeds):
+        return self.model(embeds)[self.group_index]
+
 if __name__=="__main__":
     model = BiLSTM(embedding_dim=300, hidden_dim=1024, num_layers=1, dropout=0.0, tagset_size=14)    
     model.eval()
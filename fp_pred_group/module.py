@@ -2,10 +2,11 @@ import numpy as np
 import torch
 from torch import nn, optim
 import pytorch_lightning as pl
-from tqdm import tqdm
 
 # My library
-from .util.eval_util import calc_score_all, calc_score_each_fp
+from .util.eval_util import METRICS, calc_confusion_matrix, calc_scores
+from .util.timing_util import StepTimer
+from .util.train_util import get_mask
 
 class MyLightningModel(pl.LightningModule):
 
@@ -20,6 +21,9 @@ class MyLightningModel(pl.LightningModule):
         optimizer_params=None,
         lr_scheduler_name="StepLR",
         lr_scheduler_params=None,
+        distill_alpha=0.0,
+        distill_temperature=1.0,
+        step_timer=None,
     ):
 
         super().__init__()
@@ -40,188 +44,129 @@ class MyLightningModel(pl.LightningModule):
         self.lr_scheduler_name=lr_scheduler_name
         self.lr_scheduler_params=lr_scheduler_params
 
+        self.distill_alpha = distill_alpha
+        self.distill_temperature = distill_temperature
+
+        # Timing of sections of training steps (no-op if disabled)
+        self.step_timer = step_timer if step_timer is not None else StepTimer(enabled=False)
+
     def forward(self, x):
         return self.model(x)
 
+    def _forward_batch(self, batch):
+        # Group-tagged batch of (x, target, group_ids) for multi-head models
+        if len(batch) == 3 and isinstance(batch[2], torch.Tensor):
+            x, target, group_ids = batch
+            return x, target, self.model(x, group_ids=group_ids)
+        x, target = batch[:2]
+        return x, target, self.model(x)
+
+    def _distill_loss(self, output, teacher_logits, mask):
+        """KL divergence from softened teacher distribution, averaged over valid positions."""
+        temperature = self.distill_temperature
+        kl = nn.functional.kl_div(
+            nn.functional.log_softmax(output / temperature, dim=-1),
+            nn.functional.softmax(teacher_logits / temperature, dim=-1),
+            reduction="none").sum(dim=-1)
+        return kl[mask].mean() * temperature ** 2
+
+    def on_before_batch_transfer(self, batch, dataloader_idx):
+        # Batches of (batch, timings of loading and collating) if instrumented
+        if self.step_timer.enabled:
+            batch, timings = batch
+            if self.trainer.training:
+                for name, duration in timings.items():
+                    self.step_timer.add(name, duration)
+        return batch
+
     def training_step(self, batch, batch_index):
-        x, target = batch
-        output = self.model(x)
+        with self.step_timer.section("forward"):
+            x, target, output = self._forward_batch(batch)
+        mask = get_mask(x)
 
         # Loss
-        loss = self.criterion(output.transpose(1, -1), target.to(torch.long))
+        with self.step_timer.section("loss"):
+            loss = self.criterion(output.transpose(1, -1), target.to(torch.long))
+
+            # Distillation from cached teacher logits
+            if len(batch) == 3 and isinstance(batch[2], dict) and "teacher_logits" in batch[2]:
+                loss = (1 - self.distill_alpha) * loss \
+                    + self.distill_alpha * self._distill_loss(output, batch[2]["teacher_logits"], mask)
 
         # Logging
         train_logger = self.logger[0].experiment
         train_logger.add_scalar("Loss", loss, global_step=self.global_step)
 
-        return {
-            "loss": loss,
-            "output": output.detach(),
-            "target": target.detach(),
-        }
+        # Accumulate confusion matrix
+        with self.step_timer.section("metrics"):
+            self.train_confusion_matrix += calc_confusion_matrix(
+                output.detach(), target.detach(), mask=mask)
 
-    def training_epoch_end(self, training_step_outputs):
-        train_logger = self.logger[0].experiment
-        bar = tqdm(total=len(self.fp_list) + 1, desc="Calculate scores (validation)...")
-
-        # Scores
-        epoch_outputs = []
-        epoch_targets = []
-        for output in training_step_outputs:
-            for o in output["output"]:
-                epoch_outputs.append(o)
-            for o in output["target"]:
-                epoch_targets.append(o)
-
-        precision, recall, f_score, specificity = calc_score_all(epoch_outputs, epoch_targets)
-        precision = np.nan if precision is None else precision
-        recall = np.nan if recall is None else recall
-        f_score = np.nan if f_score is None else f_score
-        specificity = np.nan if specificity is None else specificity
-
-        train_logger.add_scalar("FP_position/precision", precision, global_step=self.global_step)
-        train_logger.add_scalar("FP_position/recall", recall, global_step=self.global_step)
-        train_logger.add_scalar("FP_position/f_score", f_score, global_step=self.global_step)
-        train_logger.add_scalar("FP_position/specificity", specificity, global_step=self.global_step)
-
-        bar.update(1)
+        return loss
 
-        # Score and logging in each fp
-        precision_word = 0
-        recall_word = 0
-        f_score_word = 0
-        specificity_word = 0
-        rate_sum = 0
-        for i, fp in enumerate(self.fp_list):
-            fp_rate = self.train_fp_rate_dict[fp]
-            rate_sum += fp_rate
-
-            precision, recall, f_score, specificity = \
-                calc_score_each_fp(epoch_outputs, epoch_targets, i+1)
-            if precision is None:
-                precision = np.nan
-            elif torch.isnan(precision).sum() == 0:
-                precision_word += precision * fp_rate
-            if recall is None:
-                recall = np.nan
-            elif torch.isnan(recall).sum() == 0:
-                recall_word += recall * fp_rate
-            if f_score is None:
-                f_score = np.nan
-            elif torch.isnan(f_score).sum() == 0:
-                f_score_word += f_score * fp_rate
-            if specificity is None:
-                specificity = np.nan
-            elif torch.isnan(specificity).sum() == 0:
-                specificity_word += specificity * fp_rate
-
-            train_logger.add_scalar(f"{fp}/precision", precision, global_step=self.global_step)
-            train_logger.add_scalar(f"{fp}/recall", recall, global_step=self.global_step)
-            train_logger.add_scalar(f"{fp}/f_score", f_score, global_step=self.global_step)
-            train_logger.add_scalar(f"{fp}/specificity", specificity, global_step=self.global_step)
-
-            bar.update(1)
-
-        train_logger.add_scalar(
-            "FP_word/precision", precision_word / rate_sum, global_step=self.global_step)
-        train_logger.add_scalar(
-            "FP_word/recall", recall_word / rate_sum, global_step=self.global_step)
-        train_logger.add_scalar(
-            "FP_word/f_score", f_score_word / rate_sum, global_step=self.global_step)
-        train_logger.add_scalar(
-            "FP_word/specificity", specificity_word / rate_sum, global_step=self.global_step)
+    def on_train_epoch_start(self):
+        self.train_confusion_matrix = self._init_confusion_matrix()
+
+    def on_train_epoch_end(self):
+        train_logger = self.logger[0].experiment
+        with self.step_timer.section("epoch_scores"):
+            self._log_scores(
+                train_logger, self.train_confusion_matrix, self.train_fp_rate_dict)
 
     def validation_step(self, batch, batch_index):
-        x, target = batch
-        output = self.model(x)
+        x, target, output = self._forward_batch(batch)
 
         # Loss
         loss = self.criterion(output.transpose(1, -1), target.to(torch.long))
         self.log("val_loss", loss)
 
-        return {
-            "loss": loss,
-            "output": output.detach(),
-            "target": target.detach(),
-        }
+        # Accumulate loss and confusion matrix
+        self.val_loss_sum += loss.detach()
+        self.val_n_steps += 1
+        self.val_confusion_matrix += calc_confusion_matrix(
+            output.detach(), target.detach(), mask=get_mask(x))
 
-    def validation_epoch_end(self, validation_step_outputs):
+        return loss
+
+    def on_validation_epoch_start(self):
+        self.val_loss_sum = torch.zeros((), device=self.device)
+        self.val_n_steps = 0
+        self.val_confusion_matrix = self._init_confusion_matrix()
+
+    def on_validation_epoch_end(self):
         val_logger = self.logger[1].experiment
-        bar = tqdm(total=len(self.fp_list) + 1, desc="Calculate scores (training)...")
 
         # Loss
-        epoch_losses = []
-        for output in validation_step_outputs:
-            epoch_losses.append(output["loss"])
-        epoch_loss = torch.mean(torch.Tensor(epoch_losses)) if len(epoch_losses) != 0 else np.nan
+        epoch_loss = self.val_loss_sum / self.val_n_steps if self.val_n_steps != 0 else np.nan
         val_logger.add_scalar("Loss", epoch_loss, global_step=self.global_step)
 
-        # Scores
-        epoch_outputs = []
-        epoch_targets = []
-        for output in validation_step_outputs:
-            for o in output["output"]:
-                epoch_outputs.append(o)
-            for o in output["target"]:
-                epoch_targets.append(o)
+        self._log_scores(
+            val_logger, self.val_confusion_matrix, self.dev_fp_rate_dict)
 
-        precision, recall, f_score, specificity = calc_score_all(epoch_outputs, epoch_targets)
-        precision = np.nan if precision is None else precision
-        recall = np.nan if recall is None else recall
-        f_score = np.nan if f_score is None else f_score
-        specificity = np.nan if specificity is None else specificity
+    def _init_confusion_matrix(self):
+        tagset_size = len(self.fp_list) + 1
+        return torch.zeros(
+            (tagset_size, tagset_size), dtype=torch.long, device=self.device)
 
-        val_logger.add_scalar("FP_position/precision", precision, global_step=self.global_step)
-        val_logger.add_scalar("FP_position/recall", recall, global_step=self.global_step)
-        val_logger.add_scalar("FP_position/f_score", f_score, global_step=self.global_step)
-        val_logger.add_scalar("FP_position/specificity", specificity, global_step=self.global_step)
+    def _log_scores(self, logger, confusion_matrix, fp_rate_dict):
+        scores = calc_scores(confusion_matrix, self.fp_list, fp_rate_dict)
 
-        bar.update(1)
+        for metric in METRICS:
+            logger.add_scalar(
+                f"FP_position/{metric}", scores["fp_position"][metric],
+                global_step=self.global_step)
 
         # Score and logging in each fp
-        precision_word = 0
-        recall_word = 0
-        f_score_word = 0
-        specificity_word = 0
-        rate_sum = 0
         for i, fp in enumerate(self.fp_list):
-            fp_rate = self.dev_fp_rate_dict[fp]
-            rate_sum += fp_rate
-
-            precision, recall, f_score, specificity = \
-                calc_score_each_fp(epoch_outputs, epoch_targets, i+1)
-            if precision is None:
-                precision = np.nan
-            elif torch.isnan(precision).sum() == 0:
-                precision_word += precision * fp_rate
-            if recall is None:
-                recall = np.nan
-            elif torch.isnan(recall).sum() == 0:
-                recall_word += recall * fp_rate
-            if f_score is None:
-                f_score = np.nan
-            elif torch.isnan(f_score).sum() == 0:
-                f_score_word += f_score * fp_rate
-            if specificity is None:
-                specificity = np.nan
-            elif torch.isnan(specificity).sum() == 0:
-                specificity_word += specificity * fp_rate
-
-            val_logger.add_scalar(f"{fp}/precision", precision, global_step=self.global_step)
-            val_logger.add_scalar(f"{fp}/recall", recall, global_step=self.global_step)
-            val_logger.add_scalar(f"{fp}/f_score", f_score, global_step=self.global_step)
-            val_logger.add_scalar(f"{fp}/specificity", specificity, global_step=self.global_step)
-
-            bar.update(1)
-
-        val_logger.add_scalar(
-            "FP_word/precision", precision_word / rate_sum, global_step=self.global_step)
-        val_logger.add_scalar(
-            "FP_word/recall", recall_word / rate_sum, global_step=self.global_step)
-        val_logger.add_scalar(
-            "FP_word/f_score", f_score_word / rate_sum, global_step=self.global_step)
-        val_logger.add_scalar(
-            "FP_word/specificity", specificity_word / rate_sum, global_step=self.global_step)
+            for metric in METRICS:
+                logger.add_scalar(
+                    f"{fp}/{metric}", scores["each_fp"][metric][i],
+                    global_step=self.global_step)
+
+        for metric in METRICS:
+            logger.add_scalar(
+                f"FP_word/{metric}", scores["fp_word"][metric],
+                global_step=self.global_step)
 
     def predict_step(self, batch, batch_idx, dataloader_idx=None):
         # this calls forward
@@ -230,14 +175,16 @@ class MyLightningModel(pl.LightningModule):
             return {
                 "predictions": self(x),
                 "targets": y,
+                "masks": get_mask(x),
                 "batch_idx": batch_idx,
             }
         elif len(batch) == 3:
-            x, y, t = batch
+            x, y, info = batch
             return {
                 "predictions": self(x),
                 "targets": y,
-                "texts": t,
+                "masks": get_mask(x),
+                **info,
                 "batch_idx": batch_idx,
             }
 
@@ -0,0 +1,201 @@
+import time
+
+import numpy as np
+import torch
+
+# My library
+from .preprocessor.preprocess_feat import load_bert, project_feats, tagtext_to_tokens
+from .util.pred_util import insert_fps
+from .util.train_util import pad_2d
+
+class StageStats:
+    """Number of items and processing time of a pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.n_items = 0
+        self.n_batches = 0
+        self.elapsed_time = 0.0
+
+    def throughput(self):
+        return self.n_items / self.elapsed_time if self.elapsed_time > 0 else np.nan
+
+    def __str__(self):
+        return "{}: {} items, {} batches, {:.3f} [sec], {:.2f} [items/sec]".format(
+            self.name, self.n_items, self.n_batches, self.elapsed_time, self.throughput())
+
+def batch_stage(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+def morph_stage(utts, analyzer, stats):
+    """Segment raw texts to morphemes.
+
+    Params
+    ------
+    utts: iterable of tuple
+        (utterance id, raw text)
+    analyzer: callable
+        Function from raw text to list of morphemes
+    stats: StageStats
+
+    Yields
+    ------
+    utt: tuple
+        (utterance id, list of morphemes)
+    """
+    for utt_id, text in utts:
+        start = time.perf_counter()
+        morphs = analyzer(text)
+        stats.elapsed_time += time.perf_counter() - start
+        stats.n_items += 1
+        stats.n_batches += 1
+        yield utt_id, morphs
+
+def embed_stage(batches, bert_tokenizer, bert_model, fp_list, device, stats, projection=None):
+    """Get bert embeddings of batches of morpheme sequences.
+
+    Embeddings are projected if the projection of the training features is given.
+
+    Yields
+    ------
+    batch: list of tuple
+        (utterance id, list of morphemes, embedding of shape (len(morphs) + 2, embedding_dim))
+    """
+    pad_id = bert_tokenizer.convert_tokens_to_ids("[PAD]")
+    for batch in batches:
+        start = time.perf_counter()
+
+        token_ids = []
+        for _, morphs in batch:
+            tokens, _ = tagtext_to_tokens(" ".join(morphs), fp_list)
+            token_ids.append(bert_tokenizer.convert_tokens_to_ids(tokens))
+        lengths = [len(ids) for ids in token_ids]
+        max_len = max(lengths)
+        token_tensor = torch.tensor(
+            [ids + [pad_id] * (max_len - len(ids)) for ids in token_ids],
+            dtype=torch.long, device=device)
+        attention_mask = (
+            torch.arange(max_len, device=device).unsqueeze(0)
+            < torch.tensor(lengths, device=device).unsqueeze(1)).to(torch.long)
+        with torch.no_grad():
+            outputs = bert_model(token_tensor, attention_mask=attention_mask)[0].cpu().numpy()
+
+        out_batch = [
+            (utt_id, morphs, outputs[i, :lengths[i]] if projection is None
+                else project_feats(outputs[i, :lengths[i]], projection))
+            for i, (utt_id, morphs) in enumerate(batch)]
+
+        stats.elapsed_time += time.perf_counter() - start
+        stats.n_items += len(batch)
+        stats.n_batches += 1
+        yield out_batch
+
+def tag_stage(batches, model, device, stats):
+    """Predict fp tags of batches of embeddings.
+
+    Yields
+    ------
+    batch: list of tuple
+        (utterance id, list of morphemes, list of fp tags)
+    """
+    for batch in batches:
+        start = time.perf_counter()
+
+        max_len = max([len(embeds) for _, _, embeds in batch])
+        x_batch = torch.stack([
+            torch.from_numpy(pad_2d(embeds, max_len)) for _, _, embeds in batch]).to(device)
+        with torch.no_grad():
+            fp_tags = torch.argmax(model(x_batch), dim=-1).tolist()
+
+        out_batch = [
+            (utt_id, morphs, tags)
+            for (utt_id, morphs, _), tags in zip(batch, fp_tags)]
+
+        stats.elapsed_time += time.perf_counter() - start
+        stats.n_items += len(batch)
+        stats.n_batches += 1
+        yield out_batch
+
+def juman_analyzer():
+    from pyknp import Juman
+    juman = Juman()
+    def analyze(text):
+        return [m.midasi for m in juman.analysis(text).mrph_list()]
+    return analyze
+
+class FPPredictionPipeline:
+    """Predict fps from raw texts without intermediate feature files.
+
+    Raw texts flow through morph analysis, bert embedding and the tagger
+    as generator stages, with batching between morph analysis and bert.
+
+    Params
+    ------
+    bert_model_dir: str
+        Directory of bert model
+    model: torch.nn.Module
+        Tagger (e.g. ``BiLSTM``) from embeddings to fp tag logits
+    fp_list: list of str
+        List of fp words
+    batch_size: int
+        Number of utterances per batch of bert and tagger
+    device: str
+        Device of bert and tagger
+    analyzer: callable | None
+        Function from raw text to list of morphemes, Juman if None
+    projection: tuple of np.ndarray | None
+        Projection of bert features (``load_projection``), if the tagger is trained on projected features
+    """
+
+    def __init__(
+        self, bert_model_dir, model, fp_list, batch_size=32, device="cpu", analyzer=None,
+        projection=None):
+
+        self.fp_list = fp_list
+        self.projection = projection
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+
+        self.analyzer = juman_analyzer() if analyzer is None else analyzer
+        self.bert_tokenizer, self.bert_model = load_bert(bert_model_dir)
+        self.bert_model.to(self.device)
+        self.model = model.to(self.device)
+        self.model.eval()
+
+        self.stats = {}
+
+    def __call__(self, utts):
+        """Predict fps of utterances.
+
+        Params
+        ------
+        utts: iterable of tuple
+            (utterance id, raw text)
+
+        Yields
+        ------
+        utt: tuple
+            (utterance id, morpheme sequence, morpheme sequence with predicted fps)
+        """
+        self.stats = {name: StageStats(name) for name in ["morph", "embed", "tag"]}
+
+        morphs = morph_stage(utts, self.analyzer, self.stats["morph"])
+        embeds = embed_stage(
+            batch_stage(morphs, self.batch_size),
+            self.bert_tokenizer, self.bert_model, self.fp_list,
+            self.device, self.stats["embed"], projection=self.projection)
+        tags = tag_stage(embeds, self.model, self.device, self.stats["tag"])
+
+        for batch in tags:
+            for utt_id, morphs, fp_tags in batch:
+                yield utt_id, " ".join(morphs), insert_fps(morphs, fp_tags, self.fp_list)
+
+    def report(self):
+        return "\n".join([str(stats) for stats in self.stats.values()])
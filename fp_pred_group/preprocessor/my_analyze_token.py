@@ -4,6 +4,9 @@ import copy
 # 言語処理
 from pyknp import Juman
 
+# My library
+from ..util.trace_util import get_tracer
+
 def get_morph(text):
     morphs = []
 
@@ -157,15 +160,18 @@ def tagtext_to_morphwithfp(
     tagtext, start_tag, 
     remove_tags={"D", "D2", "X", "Al", "Kf", "Wf", "Bf", "L"}):
 
-    tagcharacters, end_tag = tagtext_to_tagcharacters(
-        tagtext, start_tag)
-    cleantext = tagcharacters_to_cleantext(
-        tagcharacters, remove_tags=remove_tags|{"F"})
-    fp_list, f_start_pos = characters_to_fpinfo(
-        tagcharacters, remove_tags=remove_tags)
+    tracer = get_tracer()
+    with tracer.span("tag_state_machine"):
+        tagcharacters, end_tag = tagtext_to_tagcharacters(
+            tagtext, start_tag)
+        cleantext = tagcharacters_to_cleantext(
+            tagcharacters, remove_tags=remove_tags|{"F"})
+        fp_list, f_start_pos = characters_to_fpinfo(
+            tagcharacters, remove_tags=remove_tags)
     
-    morphwithfp = cleantext_to_morphwithfp(
-        cleantext, fp_list, f_start_pos)
+    with tracer.span("juman"):
+        morphwithfp = cleantext_to_morphwithfp(
+            cleantext, fp_list, f_start_pos)
     
     return tagcharacters, cleantext, end_tag, morphwithfp
 
@@ -255,11 +261,20 @@ def get_morpheme_with_fptag(
         list of tuple (speaker ID, koen ID, IPU ID, morpheme sequence)
     """
 
+    tracer = get_tracer()
+    with tracer.span("lecture", speaker_id=speaker_id, koen_id=koen_id):
+        return _get_morpheme_with_fptag(
+            speaker_id, koen_id, transcription_path, remove_tags, tracer)
+
+def _get_morpheme_with_fptag(
+    speaker_id, koen_id, transcription_path, remove_tags, tracer):
+
     # Get dictionary of {ID of IPU: text of IPU}
-    with open(transcription_path, "r", encoding="shift-jis") as f:
-        trn_text_lines = f.readlines()        
-    trn_text_lines = [l for l in trn_text_lines if l!="" and l[0]!="%"]
-    ipu_textlist_dict = get_ipu_dict(trn_text_lines)
+    with tracer.span("trn_parse", speaker_id=speaker_id, koen_id=koen_id):
+        with open(transcription_path, "r", encoding="shift-jis") as f:
+            trn_text_lines = f.readlines()        
+        trn_text_lines = [l for l in trn_text_lines if l!="" and l[0]!="%"]
+        ipu_textlist_dict = get_ipu_dict(trn_text_lines)
 
     # Get IDs and segmented morpheme sequence with fps
     ipu_list = []
@@ -267,12 +282,13 @@ def get_morpheme_with_fptag(
     start_tag = []
     for ipu_id in ipu_textlist_dict.keys():
         # Get information of each IPU
-        ipu = IPU(
-            ipu_id,
-            ipu_textlist_dict,
-            start_tag,
-            remove_tags,
-            )
+        with tracer.span("ipu", speaker_id=speaker_id, koen_id=koen_id, ipu_id=ipu_id):
+            ipu = IPU(
+                ipu_id,
+                ipu_textlist_dict,
+                start_tag,
+                remove_tags,
+                )
 
         # Skip if IPU includes "R" or "?" tag
         if ipu.r_tag or ipu.hatena_tag or ipu.fv_tag:
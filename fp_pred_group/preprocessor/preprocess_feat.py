@@ -1,3 +1,4 @@
+import random
 import time
 from pathlib import Path
 from tqdm import tqdm
@@ -13,6 +14,111 @@ from transformers import BertTokenizer, BertModel
 import numpy as np
 import torch
 
+# My library
+from ..util.trace_util import get_tracer
+
+def load_bert(bert_model_dir):
+    bert_model_dir = Path(bert_model_dir)
+    vocab_file_path = bert_model_dir / "vocab.txt"
+    bert_tokenizer = BertTokenizer(
+        vocab_file_path, do_lower_case=False, do_basic_tokenize=False)
+    bert_model = BertModel.from_pretrained(bert_model_dir)
+    bert_model.eval()
+    return bert_tokenizer, bert_model
+
+def tagtext_to_tokens(tagtext, fp_list):
+    """Get bert tokens and fp labels from morpheme sequence with fp tags.
+
+    Parameters
+    ----------
+    tagtext: str
+        morpheme sequence separated by spaces, with fps in the format of "(F<fp>)"
+    fp_list: list of str
+        list of fp words
+
+    Returns
+    -------
+    tokens: list of str
+        morphemes between "[CLS]" and "[SEP]"
+    fp_labels: list of int
+        fp label after each token (0: no fp, i: i-th fp in fp_list)
+    """
+
+    fp_labels = [0]     # fps sometimes appear at the head of the breath group
+    tokens = ["[CLS]"]
+    for m in tagtext.split(" "):
+        if m.startswith("(F"):
+            fp = m.split("(F")[1].split(")")[0]
+            if fp in fp_list:
+                fp_labels[-1] = fp_list.index(fp) + 1
+        elif m != "":
+            tokens.append(m)
+            fp_labels.append(0)
+
+    tokens += ["[SEP]"]
+    fp_labels.append(0)
+
+    return tokens, fp_labels
+
+def fit_pca_projection(feats_list, dim):
+    """Fit PCA projection on bert features.
+
+    Parameters
+    ----------
+    feats_list: list of np.ndarray
+        bert features of sampled IPUs, each of shape (n_tokens, hidden_size)
+    dim: int
+        dimension of projected features
+
+    Returns
+    -------
+    projection: tuple of np.ndarray
+        principal components of shape (dim, hidden_size) and mean of shape (hidden_size,)
+    """
+
+    feats = np.concatenate(feats_list)
+    mean = feats.mean(axis=0)
+    _, _, vt = np.linalg.svd(feats - mean, full_matrices=False)
+    return vt[:dim].astype(np.float32), mean.astype(np.float32)
+
+def get_model_projection(ckpt_path, dim):
+    """Get projection from input weights of the first layer of trained BiLSTM.
+
+    The projection is onto the top right singular vectors of the input-to-hidden
+    weights of both directions, i.e. the subspace of bert features the trained
+    model is most sensitive to.
+
+    Parameters
+    ----------
+    ckpt_path: str
+        checkpoint of ``MyLightningModel`` with ``BiLSTM``
+    dim: int
+        dimension of projected features
+
+    Returns
+    -------
+    projection: tuple of np.ndarray
+        components of shape (dim, hidden_size) and zero mean of shape (hidden_size,)
+    """
+
+    state_dict = torch.load(ckpt_path, map_location="cpu")["state_dict"]
+    weights = np.concatenate([
+        v.numpy() for k, v in state_dict.items() if "bilstm.weight_ih_l0" in k])
+    _, _, vt = np.linalg.svd(weights, full_matrices=False)
+    return vt[:dim].astype(np.float32), np.zeros(vt.shape[1], dtype=np.float32)
+
+def save_projection(path, projection):
+    np.savez(path, components=projection[0], mean=projection[1])
+
+def load_projection(path):
+    projection = np.load(path)
+    return projection["components"], projection["mean"]
+
+def project_feats(feats, projection):
+    """Project features of shape (n_tokens, hidden_size) to (n_tokens, dim)."""
+    components, mean = projection
+    return ((feats - mean) @ components.T).astype(np.float32)
+
 def extract_feats(config):
     start = time.time()
 
@@ -21,39 +127,31 @@ def extract_feats(config):
         fp_list = [l.strip() for l in f]
 
     # Prepare bert
-    bert_model_dir = Path(config.bert_model_dir)
-    vocab_file_path = bert_model_dir / "vocab.txt"
-    bert_tokenizer = BertTokenizer(vocab_file_path, do_lower_case=False, do_basic_tokenize=False)
-    bert_model = BertModel.from_pretrained(bert_model_dir)
-    bert_model.eval()
-    def preprocess_ipu(speaker_id, koen_id, ipu_id, ipu_tagtext, in_dir, out_dir):
+    bert_tokenizer, bert_model = load_bert(config.bert_model_dir)
+    tracer = get_tracer()
+    def get_embedding(ipu_tagtext, **ids):
+        with tracer.span("tokenize", **ids):
+            tokens, fp_labels = tagtext_to_tokens(ipu_tagtext, fp_list)
+            token_ids = bert_tokenizer.convert_tokens_to_ids(tokens)
+            token_tensor = torch.Tensor(token_ids).unsqueeze(0).to(torch.long)
+        with tracer.span("bert_forward", n_tokens=len(token_ids), **ids):
+            outputs = bert_model(token_tensor)
+        return outputs[0].numpy().squeeze(axis=0).copy(), fp_labels
 
-        # get tokens and fp labels
-        fp_labels = [0]     # fps sometimes appear at the head of the breath group
-        tokens = ["[CLS]"]
-        for m in ipu_tagtext.split(" "):
-            if m.startswith("(F"):
-                fp = m.split("(F")[1].split(")")[0]
-                if fp in fp_list:
-                    fp_labels[-1] = fp_list.index(fp) + 1
-            elif m != "":
-                tokens.append(m)
-                fp_labels.append(0)
-
-        tokens += ["[SEP]"]
-        fp_labels.append(0)
+    def preprocess_ipu(speaker_id, koen_id, ipu_id, ipu_tagtext, in_dir, out_dir):
+        ids = {"speaker_id": speaker_id, "koen_id": koen_id, "ipu_id": ipu_id}
 
-        # get embedding
-        token_ids = bert_tokenizer.convert_tokens_to_ids(tokens)
-        token_tensor = torch.Tensor(token_ids).unsqueeze(0).to(torch.long)
-        outputs = bert_model(token_tensor)
-        outputs_numpy = outputs[0].numpy().squeeze(axis=0).copy()
+        # get tokens, fp labels and embedding
+        outputs_numpy, fp_labels = get_embedding(ipu_tagtext, **ids)
+        if projection is not None:
+            outputs_numpy = project_feats(outputs_numpy, projection)
         
         assert outputs_numpy.shape[0] == np.array(fp_labels).shape[0], \
             "1st array length {} should be equal to 2nd array length {}".format(
                 outputs_numpy.shape[0], np.array(fp_labels).shape[0])
-        np.save(in_dir / f"{speaker_id}-{koen_id}-{ipu_id}-feats.npy", outputs_numpy)
-        np.save(out_dir / f"{speaker_id}-{koen_id}-{ipu_id}-feats.npy", np.array(fp_labels))
+        with tracer.span("save", **ids):
+            np.save(in_dir / f"{speaker_id}-{koen_id}-{ipu_id}-feats.npy", outputs_numpy)
+            np.save(out_dir / f"{speaker_id}-{koen_id}-{ipu_id}-feats.npy", np.array(fp_labels))
 
     # extraxt features
     infeats_dir = Path(config.out_dir) / "infeats"
@@ -62,6 +160,30 @@ def extract_feats(config):
     outfeats_dir.mkdir(parents=True, exist_ok=True)
     with open(Path(config.out_dir) / f"ipu.list", "r") as f:
         ipus = [tuple(l.split(":")) for l in f.readlines()]
+
+    # projection to lower dimension
+    projection = None
+    projection_config = config.get("projection", None)
+    if projection_config is not None and projection_config.method == "pca":
+        # Sample of train split (split_data runs first), drawn without touching the global random state
+        print("fit pca projection...")
+        train_list_path = Path(config.out_dir) / "train_all.list"
+        assert train_list_path.exists(), \
+            "pca projection is fitted on {}, run split_data first".format(train_list_path)
+        with open(train_list_path, "r") as f:
+            train_ids = {tuple(l.split(":")[:3]) for l in f if len(l.strip()) > 0}
+        train_ipus = [ipu for ipu in ipus if ipu[:3] in train_ids]
+        sample_ipus = random.Random(config.random_seed).sample(
+            train_ipus, min(projection_config.n_sample_ipus, len(train_ipus)))
+        with torch.no_grad():
+            projection = fit_pca_projection(
+                [get_embedding(ipu)[0] for _, _, _, ipu in tqdm(sample_ipus)],
+                projection_config.dim)
+    elif projection_config is not None and projection_config.method == "model":
+        projection = get_model_projection(projection_config.ckpt_path, projection_config.dim)
+    if projection is not None:
+        save_projection(Path(config.out_dir) / "projection.npz", projection)
+
     with torch.no_grad():
         for speaker_id, koen_id, ipu_id, ipu in tqdm(ipus):
             preprocess_ipu(speaker_id, koen_id, ipu_id, ipu, infeats_dir, outfeats_dir)
@@ -72,11 +194,15 @@ def extract_feats(config):
     time_log = "elapsed_time of feature extraction: {} [sec]".format(elapsed_time)
     time_log_ipu = "elapsed_time of feature extraction (per IPU): \
         {} [sec]".format(elapsed_time / n_ipu)
-    print(time_log + "\n" + time_log_ipu)
+    infeats_size = sum([p.stat().st_size for p in infeats_dir.glob("*.npy")])
+    size_log = "size of infeats ({} dims): {:.1f} [MB]".format(
+        bert_model.config.hidden_size if projection is None else len(projection[0]),
+        infeats_size / 1e6)
+    print(time_log + "\n" + time_log_ipu + "\n" + size_log)
     with open(Path(config.out_dir) / "time.log", "w") as f:
-        f.write(time_log + "\n" + time_log_ipu)
+        f.write(time_log + "\n" + time_log_ipu + "\n" + size_log)
 
-def extract_feats_test(data_dir, fp_list_path, bert_model_dir, utt_list_name):
+def extract_feats_test(data_dir, fp_list_path, bert_model_dir, utt_list_name, projection_path=None):
     start = time.time()
 
     # FPs
@@ -84,34 +210,22 @@ def extract_feats_test(data_dir, fp_list_path, bert_model_dir, utt_list_name):
         fp_list = [l.strip() for l in f]
 
     # Prepare bert
-    bert_model_dir = Path(bert_model_dir)
-    vocab_file_path = bert_model_dir / "vocab.txt"
-    bert_tokenizer = BertTokenizer(
-        vocab_file_path, do_lower_case=False, do_basic_tokenize=False)
-    bert_model = BertModel.from_pretrained(bert_model_dir)
-    bert_model.eval()
+    bert_tokenizer, bert_model = load_bert(bert_model_dir)
+
+    # projection of training features
+    projection = load_projection(projection_path) if projection_path is not None else None
     def preprocess_utt(utt_id, utt, in_dir, out_dir):
 
         # get tokens and fp labels
-        fp_labels = [0]     # fps sometimes appear at the head of the breath group
-        tokens = ["[CLS]"]
-        for m in utt.split(" "):
-            if m.startswith("(F"):
-                fp = m.split("(F")[1].split(")")[0]
-                if fp in fp_list:
-                    fp_labels[-1] = fp_list.index(fp) + 1
-            elif m != "":
-                tokens.append(m)
-                fp_labels.append(0)
-
-        tokens += ["[SEP]"]
-        fp_labels.append(0)
+        tokens, fp_labels = tagtext_to_tokens(utt, fp_list)
 
         # get embedding
         token_ids = bert_tokenizer.convert_tokens_to_ids(tokens)
         token_tensor = torch.Tensor(token_ids).unsqueeze(0).to(torch.long)
         outputs = bert_model(token_tensor)
         outputs_numpy = outputs[0].numpy().squeeze(axis=0).copy()
+        if projection is not None:
+            outputs_numpy = project_feats(outputs_numpy, projection)
         
         assert outputs_numpy.shape[0] == np.array(fp_labels).shape[0], \
             "1st array length {} should be equal to 2nd array length {}".format(
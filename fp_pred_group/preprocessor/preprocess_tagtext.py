@@ -6,6 +6,7 @@ from omegaconf import DictConfig
 
 # My library
 from .my_analyze_token import get_morpheme_with_fptag
+from ..util.trace_util import get_tracer, run_traced
 
 def process_tagtext(config):
     # Read person list file
@@ -47,10 +48,13 @@ def process_tagtext(config):
         "L"     # ささやき声など
     }
 
-    # Multi processing
+    # Multi processing (trace events of workers are merged into the tracer of this process)
+    tracer = get_tracer()
     with ProcessPoolExecutor(config.n_jobs) as executor:
         futures = [
             executor.submit(
+                run_traced,
+                tracer.enabled,
                 get_morpheme_with_fptag,
                 speaker_id,
                 koen_id,
@@ -62,7 +66,9 @@ def process_tagtext(config):
    
         ipu_list = []
         for future in tqdm(futures):
-            ipu_list += future.result()
+            ipus, events = future.result()
+            ipu_list += ipus
+            tracer.extend(events)
 
         print(f"num of breath groups: {len(ipu_list)}")
         with open(out_dir / "ipu.list", "w") as f:
@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+
+# My library
+from .preprocess_feat import load_bert, tagtext_to_tokens
+
+def collect_texts(text_paths):
+    """Read morpheme sequences from lists in the format of "<id>:...:<text>" (e.g. ipu.list, utt_morphs.list)."""
+    texts = []
+    for text_path in text_paths:
+        with open(text_path, "r") as f:
+            texts += [l.strip().split(":")[-1] for l in f if len(l.strip()) > 0]
+    return texts
+
+def prune_bert_vocab(bert_model_dir, texts, fp_list, out_dir):
+    """Write bert model directory with vocabulary pruned to tokens in texts.
+
+    Special tokens and tokens of texts found in the original vocabulary are
+    kept in the original order; other tokens fall back to [UNK], as
+    out-of-vocabulary tokens already do. The output directory can be loaded
+    by ``load_bert`` as it is.
+
+    Parameters
+    ----------
+    bert_model_dir: str
+        directory of original bert model
+    texts: list of str
+        morpheme sequences (with fp tags) expected at inference
+    fp_list: list of str
+        list of fp words
+    out_dir: str
+        directory of pruned bert model
+
+    Returns
+    -------
+    n_tokens: tuple of int
+        sizes of original and pruned vocabularies
+    """
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    bert_tokenizer, bert_model = load_bert(bert_model_dir)
+
+    # covered tokens
+    vocab = bert_tokenizer.vocab
+    keep_tokens = set(bert_tokenizer.all_special_tokens)
+    for text in texts:
+        keep_tokens |= set(tagtext_to_tokens(text, fp_list)[0])
+    keep_ids = sorted([vocab[token] for token in keep_tokens if token in vocab.keys()])
+    id_to_token = {i: token for token, i in vocab.items()}
+
+    # shrunk embedding table
+    word_embeddings = bert_model.embeddings.word_embeddings.weight.data[keep_ids].clone()
+    new_pad_id = keep_ids.index(bert_model.config.pad_token_id)
+    bert_model.embeddings.word_embeddings = nn.Embedding(
+        len(keep_ids), word_embeddings.size(1), padding_idx=new_pad_id)
+    bert_model.embeddings.word_embeddings.weight.data = word_embeddings
+    bert_model.config.vocab_size = len(keep_ids)
+    bert_model.config.pad_token_id = new_pad_id
+
+    bert_model.save_pretrained(out_dir)
+    with open(out_dir / "vocab.txt", "w") as f:
+        f.write("\n".join([id_to_token[i] for i in keep_ids]) + "\n")
+
+    return len(vocab), len(keep_ids)
+
+def verify_pruned_bert(bert_model_dir, pruned_bert_model_dir, texts, fp_list):
+    """Check that pruned bert gives bit-identical embeddings for covered tokens.
+
+    Returns
+    -------
+    n_mismatch: int
+        number of texts whose bert outputs differ
+    """
+
+    bert_tokenizer, bert_model = load_bert(bert_model_dir)
+    pruned_bert_tokenizer, pruned_bert_model = load_bert(pruned_bert_model_dir)
+
+    # word embeddings of all covered tokens
+    for token, pruned_id in pruned_bert_tokenizer.vocab.items():
+        assert torch.equal(
+            bert_model.embeddings.word_embeddings.weight[bert_tokenizer.vocab[token]],
+            pruned_bert_model.embeddings.word_embeddings.weight[pruned_id],
+        ), f"word embedding of {token} differs"
+
+    # bert outputs of texts
+    n_mismatch = 0
+    with torch.no_grad():
+        for text in texts:
+            tokens, _ = tagtext_to_tokens(text, fp_list)
+            outputs = bert_model(torch.tensor(
+                [bert_tokenizer.convert_tokens_to_ids(tokens)], dtype=torch.long))[0]
+            pruned_outputs = pruned_bert_model(torch.tensor(
+                [pruned_bert_tokenizer.convert_tokens_to_ids(tokens)], dtype=torch.long))[0]
+            if not np.array_equal(outputs.numpy(), pruned_outputs.numpy()):
+                n_mismatch += 1
+    return n_mismatch
@@ -5,7 +5,12 @@ import random
 import hydra
 from omegaconf import DictConfig
 
+# My library
+from ..util.trace_util import get_tracer
+
 def split_data(config):
+    tracer = get_tracer()
+
     # Read utterance list file
     out_dir = Path(config.out_dir)
     with open(Path(config.out_dir) / "ipu.list", "r") as f:
@@ -22,20 +27,21 @@ def split_data(config):
     utt_list_eval = []
 
     for person_id in tqdm(person_id_list, desc="all..."):
-        utt_list_person = [utt for utt in utt_list if utt.startswith(f"{person_id}:")]
-        n = len(utt_list_person)
-        for phase in ["train", "dev", "eval"]:
-
-            if phase == "train":
-                utts_ = random.sample(utt_list_person, int(n*0.6))
-                utt_list_train += utts_
-                utt_list_person = [utt for utt in utt_list_person if not utt in utts_]
-            elif phase == "dev":
-                utts_ = random.sample(utt_list_person, int(n*0.2))
-                utt_list_dev += utts_
-                utt_list_person = [utt for utt in utt_list_person if not utt in utts_]
-            elif phase == "eval":
-                utt_list_eval += utt_list_person
+        with tracer.span("split_person", person_id=person_id, group="all"):
+            utt_list_person = [utt for utt in utt_list if utt.startswith(f"{person_id}:")]
+            n = len(utt_list_person)
+            for phase in ["train", "dev", "eval"]:
+
+                if phase == "train":
+                    utts_ = random.sample(utt_list_person, int(n*0.6))
+                    utt_list_train += utts_
+                    utt_list_person = [utt for utt in utt_list_person if not utt in utts_]
+                elif phase == "dev":
+                    utts_ = random.sample(utt_list_person, int(n*0.2))
+                    utt_list_dev += utts_
+                    utt_list_person = [utt for utt in utt_list_person if not utt in utts_]
+                elif phase == "eval":
+                    utt_list_eval += utt_list_person
 
     for phase, utt_list_phase in zip(
         ["train", "dev", "eval"],
@@ -62,20 +68,21 @@ def split_data(config):
         utt_list_dev = []
         utt_list_eval = []
         for person_id in tqdm(person_id_list, desc=f"group{i}"):
-            utt_list_person = [utt for utt in utt_list if utt.startswith(f"{person_id}:")]
-            n = len(utt_list_person)
-            for phase in ["train", "dev", "eval"]:
+            with tracer.span("split_person", person_id=person_id, group=i):
+                utt_list_person = [utt for utt in utt_list if utt.startswith(f"{person_id}:")]
+                n = len(utt_list_person)
+                for phase in ["train", "dev", "eval"]:
 
-                if phase == "train":
-                    utts_ = random.sample(utt_list_person, int(n*0.6))
-                    utt_list_train += utts_
-                    utt_list_person = [utt for utt in utt_list_person if not utt in utts_]
-                elif phase == "dev":
-                    utts_ = random.sample(utt_list_person, int(n*0.2))
-                    utt_list_dev += utts_
-                    utt_list_person = [utt for utt in utt_list_person if not utt in utts_]
-                elif phase == "eval":
-                    utt_list_eval += utt_list_person
+                    if phase == "train":
+                        utts_ = random.sample(utt_list_person, int(n*0.6))
+                        utt_list_train += utts_
+                        utt_list_person = [utt for utt in utt_list_person if not utt in utts_]
+                    elif phase == "dev":
+                        utts_ = random.sample(utt_list_person, int(n*0.2))
+                        utt_list_dev += utts_
+                        utt_list_person = [utt for utt in utt_list_person if not utt in utts_]
+                    elif phase == "eval":
+                        utt_list_eval += utt_list_person
 
         for phase, utt_list_phase in zip(
             ["train", "dev", "eval"],
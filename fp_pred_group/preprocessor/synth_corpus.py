@@ -0,0 +1,184 @@
+import random
+from pathlib import Path
+
+import torch
+from transformers import BertConfig, BertModel
+
+HIRAGANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+KANJI = "日本語音声研究発表結果方法実験学会講演模擬話者時間会社問題社会情報技術意味言葉文章"
+ALPHABET = "ＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺ"
+
+# FPs not in fp list, counted as "others"
+OTHER_FPS = ["うーん", "んー", "ほー"]
+
+def _char_type(c):
+    if "ぁ" <= c <= "ゟ":
+        return "hiragana"
+    elif "゠" <= c <= "ヿ":
+        return "katakana"
+    elif "一" <= c <= "鿿":
+        return "kanji"
+    return "other"
+
+def stub_get_morph(text, max_len=3):
+    """Stand-in for ``get_morph`` without Juman.
+
+    Text is segmented at changes of character type (hiragana, katakana, kanji
+    and others), and the segments are split into morphemes of at most
+    ``max_len`` characters. The output has the same format as ``get_morph``.
+    """
+
+    segments = []
+    for c in text:
+        if len(segments) == 0 or _char_type(c) != _char_type(segments[-1][0]) \
+                or len(segments[-1]) == max_len:
+            segments.append("")
+        segments[-1] += c
+
+    morphs = [{
+        "type": "L",
+        "surface": segment,
+        "reading_form": segment,
+        "dictionary_form": segment,
+        "pos": "名詞" if _char_type(segment[0]) == "kanji" else "助詞",
+    } for segment in segments]
+    return morphs
+
+def make_words(n_words, rng):
+    """Random words of kanji followed by hiragana."""
+    words = set()
+    while len(words) < n_words:
+        words.add(
+            "".join(rng.choices(KANJI, k=rng.randint(1, 3)))
+            + "".join(rng.choices(HIRAGANA, k=rng.randint(0, 3))))
+    return sorted(words)
+
+def _to_katakana(text):
+    return "".join([
+        chr(ord(c) + 0x60) if "ぁ" <= c <= "ゖ" else c for c in text])
+
+def make_tagtext(words, fp_list, rng, n_chunks, fp_rate=0.15, d_rate=0.03, a_rate=0.02):
+    """Random IPU text with (F…), (D…) and (A…;…) tags of CSJ."""
+    chunks = []
+    for _ in range(n_chunks):
+        r = rng.random()
+        if r < fp_rate:
+            fp = rng.choice(OTHER_FPS) if rng.random() < 0.1 else rng.choice(fp_list)
+            chunks.append(f"(F {fp})")
+        elif r < fp_rate + d_rate:
+            chunks.append("(D {})".format(rng.choice(words)[:1]))
+        elif r < fp_rate + d_rate + a_rate:
+            alphabet = "".join(rng.choices(ALPHABET, k=rng.randint(2, 4)))
+            chunks.append("(A {};{})".format(
+                "".join(rng.choices(HIRAGANA, k=len(alphabet) * 2)), alphabet))
+        else:
+            chunks.append(rng.choice(words))
+    return "".join(chunks)
+
+def write_synthetic_corpus(
+    corpus_dir, words, fp_list, n_speakers, n_lectures_per_speaker, n_ipus_per_lecture,
+    n_groups, seed=0):
+    """Write synthetic corpus in the layout of CSJ read by ``process_tagtext`` and ``split_data``.
+
+    TRN files are written in Shift-JIS with the same line format as CSJ
+    (comments, IPU headers with time spans, and "<text> & <reading>" lines).
+
+    Parameters
+    ----------
+    corpus_dir: str
+        directory to write speaker.list, speaker_koen.list, group.list and TRN
+    words: list of str
+        vocabulary (``make_words``)
+    fp_list: list of str
+        list of fp words
+    n_speakers: int
+        number of speakers
+    n_lectures_per_speaker: int
+        number of lectures ("学会講演(A)" or "模擬講演(S)") of each speaker
+    n_ipus_per_lecture: int
+        number of IPUs in each lecture
+    n_groups: int
+        number of groups of speakers in group.list
+    seed: int
+        random seed
+    """
+
+    rng = random.Random(seed)
+    corpus_dir = Path(corpus_dir)
+    trn_dir = corpus_dir / "TRN"
+    trn_dir.mkdir(parents=True, exist_ok=True)
+
+    speaker_ids = ["{:04d}".format(i + 1) for i in range(n_speakers)]
+    speaker_koens = []
+    for i, speaker_id in enumerate(speaker_ids):
+        koen_ids = [
+            "{}{:02d}{}{:04d}".format(
+                rng.choice(["A", "S"]), j + 1, rng.choice(["M", "F"]), i + 1)
+            for j in range(n_lectures_per_speaker)]
+        speaker_koens.append((speaker_id, koen_ids))
+
+        for koen_id in koen_ids:
+            lines = [f"%講演ID {koen_id}", f"%話者ID {speaker_id}"]
+            time = 0.0
+            for ipu_index in range(n_ipus_per_lecture):
+                duration = rng.uniform(0.5, 5.0)
+                lines.append("{:04d} {:09.3f}-{:09.3f} L:".format(
+                    ipu_index + 1, time, time + duration))
+                for _ in range(rng.randint(1, 2)):
+                    tagtext = make_tagtext(words, fp_list, rng, rng.randint(2, 12))
+                    lines.append(f"{tagtext} & {_to_katakana(tagtext)}")
+                time += duration + rng.uniform(0.2, 1.0)
+            with open(trn_dir / f"{koen_id}.trn", "w", encoding="shift-jis") as f:
+                f.write("\n".join(lines) + "\n")
+
+    with open(corpus_dir / "speaker.list", "w") as f:
+        f.write("\n".join(speaker_ids))
+    with open(corpus_dir / "speaker_koen.list", "w") as f:
+        f.write("\n".join([
+            "{}:{}".format(speaker_id, ",".join(koen_ids))
+            for speaker_id, koen_ids in speaker_koens]))
+    with open(corpus_dir / "group.list", "w") as f:
+        f.write("\n".join([
+            "{}:{}".format(speaker_id, i % n_groups + 1)
+            for i, speaker_id in enumerate(speaker_ids)]))
+
+def write_tiny_bert(
+    bert_model_dir, words, fp_list, hidden_size=64, num_hidden_layers=2,
+    num_attention_heads=2, intermediate_size=128, seed=0):
+    """Write randomly initialized small bert loadable by ``load_bert``.
+
+    The vocabulary consists of special tokens, fps and morphemes of
+    ``stub_get_morph`` of the words.
+
+    Parameters
+    ----------
+    bert_model_dir: str
+        directory to write vocab.txt, config and weights
+    words: list of str
+        vocabulary of the corpus
+    fp_list: list of str
+        list of fp words
+
+    Returns
+    -------
+    vocab_size: int
+        size of vocabulary
+    """
+
+    bert_model_dir = Path(bert_model_dir)
+    bert_model_dir.mkdir(parents=True, exist_ok=True)
+    morphs = sorted({m["surface"] for word in words for m in stub_get_morph(word)} - set(fp_list))
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(fp_list) + morphs
+    with open(bert_model_dir / "vocab.txt", "w") as f:
+        f.write("\n".join(vocab) + "\n")
+
+    torch.manual_seed(seed)
+    bert_config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=hidden_size,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=num_attention_heads,
+        intermediate_size=intermediate_size,
+    )
+    BertModel(bert_config).save_pretrained(bert_model_dir)
+    return len(vocab)
@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+import torch
+
+# My library
+from .util.pred_util import insert_fps
+from .util.train_util import pad_2d
+
+def quantize_tagger(model):
+    """Apply dynamic int8 quantization to LSTM and linear layers of tagger (CPU only)."""
+    model.eval()
+    return torch.quantization.quantize_dynamic(
+        model.cpu(), {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+
+def export_torchscript(model, path, fp_list, embedding_dim):
+    """Trace tagger and save it with fp list.
+
+    Params
+    ------
+    model: torch.nn.Module
+        Tagger from embeddings to fp tag logits
+    path: Path
+        Path to output file
+    fp_list: list of str
+        List of fp words
+    embedding_dim: int
+        Dimension of input embeddings
+    """
+    model.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.randn(2, 8, embedding_dim))
+    traced.save(str(path), _extra_files={"fp_list.json": json.dumps(fp_list, ensure_ascii=False)})
+
+class FPTagger:
+    """Predict fps with TorchScript tagger exported by ``export_torchscript``.
+
+    Only torch and numpy are imported (no pytorch-lightning, hydra or transformers).
+    """
+
+    def __init__(self, path, device="cpu"):
+        extra_files = {"fp_list.json": ""}
+        self.device = torch.device(device)
+        self.model = torch.jit.load(str(path), map_location=self.device, _extra_files=extra_files)
+        self.model.eval()
+        self.fp_list = json.loads(extra_files["fp_list.json"])
+
+    def predict_tags(self, feats_list):
+        """Predict fp tags.
+
+        Params
+        ------
+        feats_list: list of np.ndarray
+            Embeddings of utterances, each of shape (length, embedding_dim)
+
+        Returns
+        -------
+        tags_list: list of list of int
+            Fp tags of utterances
+        """
+        max_len = max([len(feats) for feats in feats_list])
+        x_batch = torch.stack([
+            torch.from_numpy(pad_2d(feats.astype(np.float32), max_len))
+            for feats in feats_list]).to(self.device)
+        with torch.no_grad():
+            tags = torch.argmax(self.model(x_batch), dim=-1).tolist()
+        return [t[:len(feats)] for t, feats in zip(tags, feats_list)]
+
+    def predict_texts(self, words_list, feats_list):
+        """Predict texts with fps.
+
+        Params
+        ------
+        words_list: list of list of str
+            Words (morphemes) of utterances without fps
+        feats_list: list of np.ndarray
+            Embeddings of utterances, each of shape (len(words) + 2, embedding_dim)
+
+        Returns
+        -------
+        texts: list of str
+            Texts with fps in the format of "(F<fp>)"
+        """
+        tags_list = self.predict_tags(feats_list)
+        return [
+            insert_fps(words, tags, self.fp_list)
+            for words, tags in zip(words_list, tags_list)]
@@ -0,0 +1,279 @@
+import asyncio
+import collections
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+# My library
+from .pipeline import StageStats, embed_stage, juman_analyzer, tag_stage
+from .preprocessor.preprocess_feat import load_bert
+from .util.pred_util import insert_fps
+
+class ServerStats:
+    """Latencies of requests and sizes of micro-batches."""
+
+    def __init__(self, max_records=10000):
+        self.latencies = collections.deque(maxlen=max_records)
+        self.batch_sizes = collections.Counter()
+        self.n_requests = 0
+
+    def add_latency(self, latency):
+        self.latencies.append(latency)
+        self.n_requests += 1
+
+    def add_batch(self, batch_size):
+        self.batch_sizes[batch_size] += 1
+
+    def summary(self):
+        latencies = np.array(self.latencies)
+        return {
+            "n_requests": self.n_requests,
+            "latency_p50": float(np.percentile(latencies, 50)) if len(latencies) > 0 else None,
+            "latency_p99": float(np.percentile(latencies, 99)) if len(latencies) > 0 else None,
+            "batch_size_histogram": {
+                str(size): n for size, n in sorted(self.batch_sizes.items())},
+        }
+
+class MicroBatcher:
+    """Merge concurrent requests into micro-batches.
+
+    A batch is run when it reaches ``max_batch_size`` requests or when its
+    oldest request has waited ``max_latency`` seconds. ``process_batch`` may
+    return an exception in place of the result of a failed request, which is
+    raised to that request only.
+    """
+
+    def __init__(self, process_batch, max_batch_size=32, max_latency=0.01, stats=None):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.stats = ServerStats() if stats is None else stats
+        self.queue = None
+        # Models are run in a single worker thread, one batch at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.task = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def submit(self, item):
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = batch[0][2] + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.stats.add_batch(len(batch))
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.process_batch, [item for item, _, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+
+            # Futures of requests cancelled while waiting (e.g. disconnected clients) are done
+            for (_, future, start), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    self.stats.add_latency(time.perf_counter() - start)
+                    future.set_result(result)
+
+class FPPredictionServer:
+    """Long-lived fp prediction service.
+
+    The morph analyzer, bert and the taggers of all models are loaded once.
+    Requests are JSON objects ``{"text": <raw text>, "model": <model name>}``
+    posted to ``/predict``, and ``/stats`` returns latency percentiles and
+    the histogram of micro-batch sizes.
+
+    Params
+    ------
+    bert_model_dir: str
+        Directory of bert model
+    models: dict
+        {model name: tagger (torch.nn.Module)}
+    fp_list: list of str
+        List of fp words
+    max_batch_size: int
+        Maximum number of requests per micro-batch
+    max_latency: float
+        Maximum waiting time [sec] of a request before its micro-batch runs
+    device: str
+        Device of bert and taggers
+    analyzer: callable | None
+        Function from raw text to list of morphemes, Juman if None
+    projection: tuple of np.ndarray | None
+        Projection of bert features (``load_projection``), if the taggers are trained on projected features
+    """
+
+    def __init__(
+        self, bert_model_dir, models, fp_list,
+        max_batch_size=32, max_latency=0.01, device="cpu", analyzer=None, projection=None):
+
+        self.fp_list = fp_list
+        self.projection = projection
+        self.device = torch.device(device)
+
+        self.analyzer = juman_analyzer() if analyzer is None else analyzer
+        self.bert_tokenizer, self.bert_model = load_bert(bert_model_dir)
+        self.bert_model.to(self.device)
+        self.models = {}
+        for model_name, model in models.items():
+            model.to(self.device)
+            model.eval()
+            self.models[model_name] = model
+
+        self.stage_stats = {name: StageStats(name) for name in ["morph", "embed", "tag"]}
+        self.batcher = MicroBatcher(
+            self.process_batch, max_batch_size=max_batch_size, max_latency=max_latency)
+
+    def process_batch(self, requests):
+        try:
+            return self._process_batch(requests)
+        except Exception:
+            if len(requests) == 1:
+                raise
+        # Run requests one by one, so that a failed request does not fail the others
+        results = []
+        for request in requests:
+            try:
+                results.append(self._process_batch([request])[0])
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _process_batch(self, requests):
+        # Morph analysis
+        start = time.perf_counter()
+        morphs_list = [self.analyzer(request["text"]) for request in requests]
+        self.stage_stats["morph"].elapsed_time += time.perf_counter() - start
+        self.stage_stats["morph"].n_items += len(requests)
+        self.stage_stats["morph"].n_batches += 1
+
+        # Bert embeddings shared by all models
+        embed_batch = next(embed_stage(
+            [list(enumerate(morphs_list))],
+            self.bert_tokenizer, self.bert_model, self.fp_list,
+            self.device, self.stage_stats["embed"], projection=self.projection))
+
+        # Tagger of each requested model
+        results = [None] * len(requests)
+        for model_name, model in self.models.items():
+            sub_batch = [
+                embed_batch[i] for i, request in enumerate(requests)
+                if request["model"] == model_name]
+            if len(sub_batch) == 0:
+                continue
+            for i, morphs, fp_tags in next(tag_stage(
+                    [sub_batch], model, self.device, self.stage_stats["tag"])):
+                results[i] = {
+                    "model": model_name,
+                    "text": " ".join(morphs),
+                    "predicted_text": insert_fps(morphs, fp_tags, self.fp_list),
+                }
+        return results
+
+    def stats(self):
+        stats = self.batcher.stats.summary()
+        stats["stages"] = {
+            name: {
+                "n_items": s.n_items,
+                "n_batches": s.n_batches,
+                "elapsed_time": s.elapsed_time,
+            }
+            for name, s in self.stage_stats.items()
+        }
+        return stats
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                # Malformed request line or headers, after which the stream cannot be followed
+                try:
+                    method, path, _ = request_line.decode().split(" ", 2)
+                    headers = {}
+                    while True:
+                        line = (await reader.readline()).decode().strip()
+                        if line == "":
+                            break
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                    content_length = int(headers.get("content-length", 0))
+                    if content_length < 0:
+                        raise ValueError(f"invalid content-length: {content_length}")
+                except ValueError as e:
+                    await self.respond(writer, "400 Bad Request", {"error": str(e)})
+                    break
+                body = await reader.readexactly(content_length)
+
+                status, response = await self.route(method, path, body)
+                await self.respond(writer, status, response)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, response):
+        response_body = json.dumps(response, ensure_ascii=False).encode()
+        writer.write(
+            "HTTP/1.1 {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n"
+            .format(status, len(response_body)).encode() + response_body)
+        await writer.drain()
+
+    async def route(self, method, path, body):
+        if method == "GET" and path == "/stats":
+            return "200 OK", self.stats()
+        if method == "POST" and path == "/predict":
+            # Validate request before it joins a micro-batch
+            try:
+                request = json.loads(body)
+            except ValueError as e:
+                return "400 Bad Request", {"error": str(e)}
+            if not isinstance(request, dict):
+                return "400 Bad Request", {"error": "request must be a JSON object"}
+            text = request.get("text", None)
+            if not isinstance(text, str) or text.strip() == "":
+                return "400 Bad Request", {"error": "\"text\" must be a non-empty string"}
+            model_name = request.get("model", next(iter(self.models)))
+            if not isinstance(model_name, str) or model_name not in self.models:
+                return "404 Not Found", {"error": f"unknown model: {model_name}"}
+
+            try:
+                result = await self.batcher.submit({"text": text, "model": model_name})
+            except Exception as e:
+                return "500 Internal Server Error", {"error": str(e)}
+            return "200 OK", result
+        return "404 Not Found", {"error": f"unknown path: {path}"}
+
+    async def serve(self, host="127.0.0.1", port=8080, unix_socket=None):
+        self.batcher.start()
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle, path=unix_socket)
+            print(f"serving on {unix_socket}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print(f"serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
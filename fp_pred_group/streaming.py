@@ -0,0 +1,175 @@
+import numpy as np
+import torch
+
+# My library
+from .preprocessor.preprocess_feat import project_feats
+
+class ChunkedBertEmbedder:
+    """Bert embeddings of incrementally arriving morphemes.
+
+    Every ``chunk_size`` morphemes, bert is run on the new chunk preceded by
+    up to ``left_context`` already embedded tokens (and [CLS]), and the
+    embeddings of the chunk are emitted. [CLS] is embedded with the first
+    chunk and [SEP] with the last one, as in ``extract_feats``.
+
+    Params
+    ------
+    bert_tokenizer: BertTokenizer
+    bert_model: BertModel
+    chunk_size: int
+        Number of morphemes per bert run
+    left_context: int
+        Maximum number of previous tokens given to bert as context
+    device: str
+        Device of bert
+    projection: tuple of np.ndarray | None
+        Projection of bert features (``load_projection``), if the tagger is trained on projected features
+    """
+
+    def __init__(
+        self, bert_tokenizer, bert_model, chunk_size=1, left_context=32, device="cpu",
+        projection=None):
+        self.bert_tokenizer = bert_tokenizer
+        self.bert_model = bert_model
+        self.projection = projection
+        self.embedding_dim = bert_model.config.hidden_size if projection is None \
+            else len(projection[0])
+        self.chunk_size = chunk_size
+        self.left_context = left_context
+        self.device = torch.device(device)
+        self.reset()
+
+    def reset(self):
+        self.history = []
+        self.pending = ["[CLS]"]
+
+    def _embed(self, tokens):
+        context = self.history[-self.left_context:] if self.left_context > 0 else []
+        if len(context) == 0 or context[0] != "[CLS]":
+            context = ["[CLS]"] + context
+        if tokens[0] == "[CLS]":
+            context = []
+        token_ids = self.bert_tokenizer.convert_tokens_to_ids(context + tokens)
+        token_tensor = torch.tensor(token_ids, dtype=torch.long, device=self.device).unsqueeze(0)
+        with torch.no_grad():
+            outputs = self.bert_model(token_tensor)[0][0, len(context):].cpu().numpy()
+        self.history += tokens
+        if self.projection is not None:
+            outputs = project_feats(outputs, self.projection)
+        return outputs
+
+    def push(self, morphs):
+        """Add morphemes and get embeddings of completed chunks, shape of (n_tokens, embedding_dim)."""
+        self.pending += morphs
+        embeds = []
+        while True:
+            # [CLS] is embedded together with the first chunk
+            n_tokens = self.chunk_size + int(self.pending[:1] == ["[CLS]"])
+            if len(self.pending) < n_tokens:
+                break
+            embeds.append(self._embed(self.pending[:n_tokens]))
+            self.pending = self.pending[n_tokens:]
+        if len(embeds) == 0:
+            return np.zeros((0, self.embedding_dim), dtype=np.float32)
+        return np.concatenate(embeds)
+
+    def flush(self):
+        """Get embeddings of the remaining morphemes and [SEP], and reset."""
+        embeds = self._embed(self.pending + ["[SEP]"])
+        self.reset()
+        return embeds
+
+class StreamingTagger:
+    """Run ``StreamingLSTM`` on embeddings arriving token by token.
+
+    The tag of position i is returned as soon as the embedding of position
+    i + lookahead has been pushed. Tags are the same as the ones of the
+    whole sequence given to ``StreamingLSTM.forward``.
+
+    Params
+    ------
+    model: StreamingLSTM
+    device: str
+        Device of model
+    """
+
+    def __init__(self, model, device="cpu"):
+        self.device = torch.device(device)
+        self.model = model.to(self.device)
+        self.model.eval()
+        self.reset()
+
+    def reset(self):
+        self.state = None
+        self.n_received = 0
+
+    def push(self, embeds):
+        """Add embeddings of shape (n_tokens, embedding_dim) and get list of determined tags."""
+        if len(embeds) == 0:
+            return []
+        x = torch.from_numpy(embeds.astype(np.float32)).unsqueeze(0).to(self.device)
+        with torch.no_grad():
+            logits, self.state = self.model.step(x, self.state)
+        tags = torch.argmax(logits[0], dim=-1).tolist()
+
+        # Output at position t is the tag of position t - lookahead
+        start = self.n_received
+        self.n_received += len(tags)
+        return [
+            tag for t, tag in enumerate(tags, start=start) if t >= self.model.lookahead]
+
+    def flush(self):
+        """Get tags of the last lookahead positions, and reset."""
+        tags = self.push(np.zeros(
+            (self.model.lookahead, self.model.embedding_dim), dtype=np.float32))
+        self.reset()
+        return tags
+
+class StreamingFPPredictor:
+    """Insert fps into morphemes arriving one by one.
+
+    ``push`` returns the morphemes (with fps after them) whose fp decisions
+    have been made, so the output lags the input by ``lookahead`` tokens
+    (plus the unfinished chunk of the embedder).
+
+    Params
+    ------
+    embedder: ChunkedBertEmbedder
+    tagger: StreamingTagger
+    fp_list: list of str
+        List of fp words
+    """
+
+    def __init__(self, embedder, tagger, fp_list):
+        self.embedder = embedder
+        self.tagger = tagger
+        self.fp_list = fp_list
+        self.reset()
+
+    def reset(self):
+        self.tokens = ["[CLS]"]
+        self.n_emitted = 0
+
+    def _emit(self, tags):
+        pieces = []
+        for tag in tags:
+            token = self.tokens[self.n_emitted]
+            self.n_emitted += 1
+            if token == "[SEP]":
+                continue
+            if token != "[CLS]":
+                pieces.append(token)
+            if tag > 0:
+                pieces.append("(F{})".format(self.fp_list[tag - 1]))
+        return pieces
+
+    def push(self, morphs):
+        self.tokens += morphs
+        return self._emit(self.tagger.push(self.embedder.push(morphs)))
+
+    def flush(self):
+        self.tokens.append("[SEP]")
+        tags = self.tagger.push(self.embedder.flush()) + self.tagger.flush()
+        pieces = self._emit(tags)
+        self.reset()
+        return pieces
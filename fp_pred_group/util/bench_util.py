@@ -0,0 +1,125 @@
+import io
+import itertools
+import time
+
+import numpy as np
+import torch
+from torch import nn
+from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import DataLoader
+
+# My library
+from ..dataset import MyDataset
+from .eval_util import calc_confusion_matrix, calc_scores
+from .train_util import collate_fn, get_mask
+
+def get_split_loader(data_config, preprocessed_dir, split_name, shuffle):
+    """Data loader of split (e.g. train_all, dev_all) of preprocessed features."""
+    with open(preprocessed_dir / "{}.list".format(split_name), "r") as f:
+        utts = [l.strip() for l in f if len(l.strip()) > 0]
+    in_feats_paths = [
+        preprocessed_dir / "infeats" / ("-".join(utt.split(":")[:3]) + "-feats.npy")
+        for utt in utts]
+    out_feats_paths = [
+        preprocessed_dir / "outfeats" / in_path.name for in_path in in_feats_paths]
+    return DataLoader(
+        MyDataset(in_feats_paths, out_feats_paths),
+        batch_size=data_config.batch_size,
+        collate_fn=collate_fn,
+        num_workers=data_config.num_workers,
+        shuffle=shuffle,
+    )
+
+def cache_split_batches(data_config, preprocessed_dir, device, n_train_steps):
+    """Cache ``n_train_steps`` shuffled train batches and all dev batches on device."""
+    train_loader = get_split_loader(data_config, preprocessed_dir, "train_all", True)
+    dev_loader = get_split_loader(data_config, preprocessed_dir, "dev_all", False)
+    return {
+        "train": [
+            (x.to(device), y.to(device)) for x, y in itertools.islice(train_loader, n_train_steps)],
+        "dev": [(x.to(device), y.to(device)) for x, y in dev_loader],
+    }
+
+def load_fp_rate_dict(fp_rate_list_path):
+    fp_rate_dict = {}
+    with open(fp_rate_list_path, "r") as f:
+        for l in f:
+            fp_rate_dict[l.strip().split(":")[0]] = float(l.strip().split(":")[1])
+    return fp_rate_dict
+
+def calc_batch_scores(model, batches, fp_list, fp_rate_dict):
+    """Scores (``calc_scores``) of model on cached batches."""
+    model.eval()
+    confusion_matrix = 0
+    with torch.no_grad():
+        for x, y in batches:
+            confusion_matrix = confusion_matrix + calc_confusion_matrix(model(x), y, mask=get_mask(x))
+    return calc_scores(confusion_matrix, fp_list, fp_rate_dict)
+
+def unpad_feats(batches):
+    """Features of utterances without padding from cached batches."""
+    return [x_i[mask] for x, _ in batches for x_i, mask in zip(x, get_mask(x))]
+
+def get_state_dict_size(model):
+    """Size [bytes] of serialized state dict of model."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+def measure_latency(model, feats, batch_size, n_batches):
+    """Median latency [sec] of forward of batches of the given utterances.
+
+    Params
+    ------
+    model: torch.nn.Module
+        Tagger from embeddings to fp tag logits
+    feats: list of torch.Tensor
+        Embeddings of utterances without padding, each of shape (length, embedding_dim)
+    batch_size: int
+        Number of utterances per batch
+    n_batches: int
+        Maximum number of batches to measure
+    """
+    model.eval()
+    latencies = []
+    with torch.no_grad():
+        for i in range(n_batches):
+            batch = feats[i * batch_size : (i + 1) * batch_size]
+            if len(batch) < batch_size:
+                break
+            x = pad_sequence(batch, batch_first=True)
+            start = time.perf_counter()
+            model(x)
+            latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies)) if len(latencies) > 0 else np.nan
+
+def measure_train_steps(model, batches, lr=1.0e-05):
+    """Training steps per second (forward, loss, backward and Adam update) on cached batches.
+
+    Params
+    ------
+    model: torch.nn.Module
+        Tagger from embeddings to fp tag logits
+    batches: list of tuple
+        (x, y) on the device of model, with float targets y of ``collate_fn``
+    lr: float
+        Learning rate of Adam
+    """
+    model.train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    criterion = nn.CrossEntropyLoss()
+
+    # Warm up
+    x, y = batches[0]
+    criterion(model(x).reshape(-1, model.tagset_size), y.reshape(-1).to(torch.long)).backward()
+    optimizer.zero_grad()
+
+    start = time.perf_counter()
+    for x, y in batches:
+        loss = criterion(model(x).reshape(-1, model.tagset_size), y.reshape(-1).to(torch.long))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    if next(model.parameters()).is_cuda:
+        torch.cuda.synchronize()
+    return len(batches) / (time.perf_counter() - start)
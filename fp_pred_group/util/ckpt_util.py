@@ -0,0 +1,97 @@
+import zlib
+from pathlib import Path
+
+import numpy as np
+import torch
+import hydra
+from omegaconf import OmegaConf
+
+def get_model_state_dict(ckpt_state_dict):
+    """Get state dict of tagger from state dict of ``MyLightningModel``."""
+    return {
+        k[len("model."):]: v for k, v in ckpt_state_dict.items() if k.startswith("model.")}
+
+def save_inference_ckpt(path, state_dict, netG_config):
+    """Save weight-only checkpoint with config of tagger.
+
+    Params
+    ------
+    path: Path
+        Path to output file
+    state_dict: dict
+        State dict of tagger
+    netG_config: DictConfig
+        Config to instantiate tagger (``model.netG`` of train config)
+    """
+    torch.save({
+        "netG": OmegaConf.to_container(netG_config, resolve=True),
+        "state_dict": {k: v.cpu() for k, v in state_dict.items()},
+    }, path)
+
+def save_delta_ckpt(path, state_dict, netG_config, base_path):
+    """Save checkpoint as compressed delta against weight-only base checkpoint.
+
+    Each tensor is stored as XOR of its bits and the bits of the base tensor,
+    compressed by zlib. Bits that did not change from the base are zeros, so
+    weights slightly fine-tuned from the base compress well, and loading is
+    lossless.
+
+    Params
+    ------
+    path: Path
+        Path to output file
+    state_dict: dict
+        State dict of tagger
+    netG_config: DictConfig
+        Config to instantiate tagger
+    base_path: Path
+        Path to weight-only checkpoint of base model, saved relative to ``path``
+    """
+    base_state_dict = torch.load(base_path, map_location="cpu")["state_dict"]
+
+    deltas = {}
+    for k, v in state_dict.items():
+        array = v.cpu().numpy()
+        base_array = base_state_dict[k].numpy()
+        assert array.shape == base_array.shape and array.dtype == base_array.dtype, \
+            "{} should have the same shape and dtype as base".format(k)
+        bits = array.view(np.uint8) ^ base_array.view(np.uint8)
+        deltas[k] = zlib.compress(bits.tobytes())
+
+    torch.save({
+        "netG": OmegaConf.to_container(netG_config, resolve=True),
+        "base": Path(base_path).name,
+        "delta": deltas,
+    }, path)
+
+def load_inference_ckpt(path):
+    """Load weight-only or delta checkpoint.
+
+    Returns
+    -------
+    state_dict: dict
+        State dict of tagger
+    netG_config: dict
+        Config to instantiate tagger
+    """
+    path = Path(path)
+    ckpt = torch.load(path, map_location="cpu")
+    if "delta" not in ckpt.keys():
+        return ckpt["state_dict"], ckpt["netG"]
+
+    base_state_dict = torch.load(path.parent / ckpt["base"], map_location="cpu")["state_dict"]
+    state_dict = {}
+    for k, base_v in base_state_dict.items():
+        base_array = base_v.numpy()
+        bits = np.frombuffer(zlib.decompress(ckpt["delta"][k]), dtype=np.uint8)
+        bits = bits ^ base_array.reshape(-1).view(np.uint8)
+        state_dict[k] = torch.from_numpy(bits.view(base_array.dtype).reshape(base_array.shape).copy())
+    return state_dict, ckpt["netG"]
+
+def load_inference_model(path):
+    """Instantiate tagger and load weights from weight-only or delta checkpoint."""
+    state_dict, netG_config = load_inference_ckpt(path)
+    model = hydra.utils.instantiate(OmegaConf.create(netG_config))
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model
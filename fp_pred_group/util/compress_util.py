@@ -0,0 +1,147 @@
+import torch
+
+# My library
+from ..model import BiLSTM
+
+def get_bilstm_netG_config(model):
+    """Config to instantiate ``BiLSTM`` with the same sizes as model."""
+    return {
+        "_target_": "fp_pred_group.model.BiLSTM",
+        "embedding_dim": model.embedding_dim,
+        "hidden_dim": model.hidden_dim,
+        "num_layers": model.num_layers,
+        "dropout": model.dropout,
+        "tagset_size": model.tagset_size,
+        "adapter_dim": model.adapter_dim,
+        "input_rank": model.input_rank,
+    }
+
+def _gate_rows(units, hidden_dim):
+    """Rows of the input, forget, cell and output gates of the given hidden units."""
+    return torch.cat([units + gate * hidden_dim for gate in range(4)])
+
+def prune_hidden_units(model, ratio):
+    """Structured magnitude pruning of hidden units of ``BiLSTM``.
+
+    Hidden units of each layer and direction are ranked by the L2 norm of
+    their weights (gate rows of the input and recurrent weights, and the
+    weights which read their outputs), and the top ``ratio`` of them are kept.
+
+    Params
+    ------
+    model: BiLSTM
+        Trained model
+    ratio: float
+        Fraction of hidden units to keep
+
+    Returns
+    -------
+    pruned_model: BiLSTM
+        Model with ``hidden_dim * ratio`` hidden units
+    """
+
+    hidden_dim = model.hidden_dim
+    new_hidden_dim = max(1, int(round(hidden_dim * ratio)))
+    state_dict = {k: v.detach().cpu() for k, v in model.state_dict().items()}
+    suffixes = ["", "_reverse"]
+
+    # Weights reading outputs of each layer, shape of (*, hidden_dim * 2)
+    readers = []
+    for layer in range(1, model.num_layers):
+        readers.append(torch.cat([
+            state_dict[f"bilstm.weight_ih_l{layer}{suffix}"] for suffix in suffixes]))
+    last_readers = [state_dict["hidden2tag.weight"]]
+    if model.adapter is not None:
+        last_readers.append(state_dict["adapter.down.weight"])
+    readers.append(torch.cat(last_readers))
+
+    # Kept units of each layer, as indices of outputs (forward units, then backward units)
+    keep = []
+    for layer in range(model.num_layers):
+        layer_keep = []
+        for direction, suffix in enumerate(suffixes):
+            w_ih = state_dict[f"bilstm.weight_ih_l{layer}{suffix}"]
+            w_hh = state_dict[f"bilstm.weight_hh_l{layer}{suffix}"]
+            outgoing = readers[layer][:, direction * hidden_dim:(direction + 1) * hidden_dim]
+            importance = (
+                w_ih.reshape(4, hidden_dim, -1).pow(2).sum(dim=(0, 2))
+                + w_hh.reshape(4, hidden_dim, hidden_dim).pow(2).sum(dim=(0, 2))
+                + w_hh.pow(2).sum(dim=0)
+                + outgoing.pow(2).sum(dim=0)
+            )
+            units = torch.topk(importance, new_hidden_dim).indices.sort().values
+            layer_keep.append(units + direction * hidden_dim)
+        keep.append(torch.cat(layer_keep))
+
+    # Slice weights
+    new_state_dict = dict(state_dict)
+    for layer in range(model.num_layers):
+        for direction, suffix in enumerate(suffixes):
+            units = keep[layer][direction * new_hidden_dim:(direction + 1) * new_hidden_dim] \
+                - direction * hidden_dim
+            rows = _gate_rows(units, hidden_dim)
+            w_ih = state_dict[f"bilstm.weight_ih_l{layer}{suffix}"][rows]
+            if layer > 0:
+                w_ih = w_ih[:, keep[layer - 1]]
+            new_state_dict[f"bilstm.weight_ih_l{layer}{suffix}"] = w_ih
+            new_state_dict[f"bilstm.weight_hh_l{layer}{suffix}"] = \
+                state_dict[f"bilstm.weight_hh_l{layer}{suffix}"][rows][:, units]
+            for name in ["bias_ih", "bias_hh"]:
+                new_state_dict[f"bilstm.{name}_l{layer}{suffix}"] = \
+                    state_dict[f"bilstm.{name}_l{layer}{suffix}"][rows]
+    new_state_dict["hidden2tag.weight"] = state_dict["hidden2tag.weight"][:, keep[-1]]
+    if model.adapter is not None:
+        new_state_dict["adapter.down.weight"] = state_dict["adapter.down.weight"][:, keep[-1]]
+        new_state_dict["adapter.up.weight"] = state_dict["adapter.up.weight"][keep[-1]]
+        new_state_dict["adapter.up.bias"] = state_dict["adapter.up.bias"][keep[-1]]
+
+    netG_config = get_bilstm_netG_config(model)
+    netG_config["hidden_dim"] = new_hidden_dim
+    netG_config.pop("_target_")
+    pruned_model = BiLSTM(**netG_config)
+    pruned_model.load_state_dict({k: v.contiguous() for k, v in new_state_dict.items()})
+    return pruned_model
+
+def factorize_input_weights(model, ratio):
+    """Low-rank factorization of input weights of the first layer of ``BiLSTM``.
+
+    Input weights of both directions are approximated by truncated SVD, and
+    their shared right singular vectors become ``input_proj`` of rank
+    ``embedding_dim * ratio``. ``hidden2tag`` is (tagset_size, hidden_dim * 2),
+    whose rank is already at most tagset_size, so it is not factorized.
+
+    Params
+    ------
+    model: BiLSTM
+        Trained model
+    ratio: float
+        Rank of input weights relative to embedding_dim
+
+    Returns
+    -------
+    factorized_model: BiLSTM
+        Model with ``input_rank`` of ``embedding_dim * ratio``
+    """
+
+    rank = max(1, int(round(model.embedding_dim * ratio)))
+    state_dict = {k: v.detach().cpu() for k, v in model.state_dict().items()}
+
+    # Effective input weights of both directions, shape of (hidden_dim * 8, embedding_dim)
+    weights = torch.cat([
+        state_dict["bilstm.weight_ih_l0"], state_dict["bilstm.weight_ih_l0_reverse"]])
+    if model.input_proj is not None:
+        weights = weights @ state_dict.pop("input_proj.weight")
+    u, s, v = torch.svd(weights)
+
+    new_state_dict = dict(state_dict)
+    new_state_dict["input_proj.weight"] = v[:, :rank].t().contiguous()
+    us = u[:, :rank] * s[:rank]
+    new_state_dict["bilstm.weight_ih_l0"] = us[:4 * model.hidden_dim].contiguous()
+    new_state_dict["bilstm.weight_ih_l0_reverse"] = us[4 * model.hidden_dim:].contiguous()
+
+    netG_config = get_bilstm_netG_config(model)
+    netG_config["input_rank"] = rank
+    netG_config.pop("_target_")
+    factorized_model = BiLSTM(**netG_config)
+    factorized_model.load_state_dict(new_state_dict)
+    return factorized_model
@@ -1,50 +1,43 @@
+import numpy as np
 import torch
 
-def calc_score_all(output, target):
-    """Calculate precision, recall, f-score, and specificity for fp position.
+METRICS = ("precision", "recall", "f_score", "specificity")
+
+def calc_confusion_matrices(prediction, target, tagset_size, group_index=None, n_groups=1):
+    """Calculate confusion matrices of all groups with a single bincount.
 
     Params
     ------
-    output: torch.Tensor
-        Output of model, shape of (batch, max_text_len, tagset_size)
+    prediction: torch.Tensor
+        Predicted tags of valid positions, shape of (n_positions,)
     target: torch.Tensor
-        Target, shape of (batch, max_text_len)
-    
+        Target tags of valid positions, shape of (n_positions,)
+    tagset_size: int
+        Number of tags
+    group_index: torch.Tensor | None
+        Group (e.g. speaker) index of each position, shape of (n_positions,)
+    n_groups: int
+        Number of groups
+
     Returns
     -------
-    precision: torch.Tensor | None
-        Precision score
-    recall: torch.Tensor | None
-        Recall score
-    f_score: torch.Tensor | None
-        F-score
-    specificity: torch.Tensor | None
-        Specificity score
+    confusion_matrices: torch.Tensor
+        Counts indexed by (group, target tag, predicted tag),
+        shape of (n_groups, tagset_size, tagset_size)
     """
 
-    # Precision, recall, specificity
-    tp_fp = tp_fn = tn_fp = tp = tn = 0
-    for i in range(len(output)):
-        tp_fp += (torch.argmax(output[i], dim=1) != 0).sum()
-        tp_fn += (target[i] != 0).sum()
-        tn_fp += (target[i] == 0).sum()
-        tp += ((torch.argmax(output[i], dim=1) != 0) & (target[i] != 0)).sum()
-        tn += ((torch.argmax(output[i], dim=1) == 0) & (target[i] == 0)).sum()
-
-    precision = tp / tp_fp if tp_fp != 0 else None
-    recall = tp / tp_fn if tp_fn != 0 else None
-    specificity = tn / tn_fp if tn_fp != 0 else None
-
-    # F-score
-    if precision is not None and recall is not None:
-        f_score = 2 * precision * recall / (precision + recall)
-    else:
-        f_score = None
-        
-    return precision, recall, f_score, specificity
-
-def calc_score_each_fp(output, target, fp_index):
-    """Calculate precision, recall, f-score, and specificity for each fp.
+    index = target.to(torch.long) * tagset_size + prediction.to(torch.long)
+    if group_index is not None:
+        index = index + group_index.to(torch.long) * tagset_size * tagset_size
+
+    confusion_matrices = torch.bincount(
+        index.flatten(),
+        minlength=n_groups * tagset_size * tagset_size,
+    )
+    return confusion_matrices.view(n_groups, tagset_size, tagset_size)
+
+def calc_confusion_matrix(output, target, mask=None):
+    """Calculate confusion matrix between targets and predicted tags.
 
     Params
     ------
@@ -52,39 +45,148 @@ def calc_score_each_fp(output, target, fp_index):
         Output of model, shape of (batch, max_text_len, tagset_size)
     target: torch.Tensor
         Target, shape of (batch, max_text_len)
-    fp_index : int
-        fp's index in fp list
+    mask: torch.Tensor | None
+        Boolean mask of valid (non-padding) positions, shape of (batch, max_text_len)
 
     Returns
     -------
-    precision: torch.Tensor | None
-        Precision score
-    recall: torch.Tensor | None
-        Recall score
-    f_score: torch.Tensor | None
-        F-score
-    specificity: torch.Tensor | None
-        Specificity score
+    confusion_matrix: torch.Tensor
+        Counts indexed by (target tag, predicted tag), shape of (tagset_size, tagset_size)
     """
 
-    # Precision, recall, specificity
-    tp_fp = tp_fn = tn_fp = tp = tn = 0
-    for i in range(len(output)):
-        tp_fp += (torch.argmax(output[i], dim=1) == fp_index).sum()
-        tp_fn += (target[i] == fp_index).sum()
-        tn_fp += (target[i] != fp_index).sum()
-        tp += ((torch.argmax(output[i], dim=1) == fp_index) & (target[i] == fp_index)).sum()
-        tn += ((torch.argmax(output[i], dim=1) != fp_index) & (target[i] != fp_index)).sum()
-
-    precision = tp / tp_fp if tp_fp != 0 else None
-    recall = tp / tp_fn if tp_fn != 0 else None
-    specificity = tn / tn_fp if tn_fp != 0 else None
-
-    # F-score
-    if precision is not None and recall is not None:
-        f_score = 2 * precision * recall / (precision + recall)
-    else:
-        f_score = None
-        
-    return precision, recall, f_score, specificity
+    prediction = torch.argmax(output, dim=-1)
+    if mask is not None:
+        prediction = prediction[mask]
+        target = target[mask]
+
+    return calc_confusion_matrices(prediction, target, output.size(-1))[0]
+
+def _safe_div(num, den):
+    nan = torch.full_like(num, float("nan"))
+    return torch.where(den != 0, num / torch.where(den != 0, den, torch.ones_like(den)), nan)
+
+def _calc_metrics(tp, tp_fp, tp_fn, tn, tn_fp):
+    precision = _safe_div(tp, tp_fp)
+    recall = _safe_div(tp, tp_fn)
+    specificity = _safe_div(tn, tn_fp)
+    f_score = 2 * precision * recall / (precision + recall)
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f_score": f_score,
+        "specificity": specificity,
+    }
+
+def calc_scores(confusion_matrix, fp_list, fp_rate_dict):
+    """Calculate all scores from confusion matrices.
+
+    Scores are calculated for fp position, each fp word, and fp word
+    (average of each fp word weighted by fp rate). Undefined scores are nan.
+
+    Params
+    ------
+    confusion_matrix: torch.Tensor
+        Counts indexed by (..., target tag, predicted tag),
+        shape of (..., tagset_size, tagset_size)
+    fp_list: list of str
+        List of fp words
+    fp_rate_dict: dict
+        Frequency rate of each fp word
+
+    Returns
+    -------
+    scores: dict
+        {"fp_position": {metric: torch.Tensor of shape (...)},
+         "each_fp": {metric: torch.Tensor of shape (..., len(fp_list))},
+         "fp_word": {metric: torch.Tensor of shape (...)}}
+    """
+
+    confusion_matrix = confusion_matrix.to(torch.float64)
+
+    # FP position
+    position_scores = _calc_metrics(
+        tp=confusion_matrix[..., 1:, 1:].sum(dim=(-2, -1)),
+        tp_fp=confusion_matrix[..., :, 1:].sum(dim=(-2, -1)),
+        tp_fn=confusion_matrix[..., 1:, :].sum(dim=(-2, -1)),
+        tn=confusion_matrix[..., 0, 0],
+        tn_fp=confusion_matrix[..., 0, :].sum(dim=-1),
+    )
+
+    # Each fp word
+    total = confusion_matrix.sum(dim=(-2, -1)).unsqueeze(-1)
+    tp = confusion_matrix.diagonal(dim1=-2, dim2=-1)[..., 1:]
+    tp_fp = confusion_matrix.sum(dim=-2)[..., 1:]
+    tp_fn = confusion_matrix.sum(dim=-1)[..., 1:]
+    each_fp_scores = _calc_metrics(
+        tp=tp,
+        tp_fp=tp_fp,
+        tp_fn=tp_fn,
+        tn=total - tp_fp - tp_fn + tp,
+        tn_fp=total - tp_fn,
+    )
+
+    # FP word
+    fp_rates = torch.tensor(
+        [fp_rate_dict[fp] for fp in fp_list],
+        dtype=confusion_matrix.dtype, device=confusion_matrix.device)
+    word_scores = {}
+    for metric, score in each_fp_scores.items():
+        score = torch.where(torch.isnan(score), torch.zeros_like(score), score)
+        word_scores[metric] = (score * fp_rates).sum(dim=-1) / fp_rates.sum()
+
+    return {
+        "fp_position": position_scores,
+        "each_fp": each_fp_scores,
+        "fp_word": word_scores,
+    }
+
+def bootstrap_scores(
+    confusion_matrices, fp_list, fp_rate_dict,
+    n_bootstrap=1000, confidence=0.95, random_seed=None):
+    """Calculate bootstrap confidence intervals of all scores.
+
+    Samples (e.g. IPUs) are resampled with replacement. Resampled confusion
+    matrices are computed at once as weighted sums of per-sample matrices.
+
+    Params
+    ------
+    confusion_matrices: torch.Tensor
+        Counts of each sample indexed by (sample, target tag, predicted tag),
+        shape of (n_samples, tagset_size, tagset_size)
+    fp_list: list of str
+        List of fp words
+    fp_rate_dict: dict
+        Frequency rate of each fp word
+    n_bootstrap: int
+        Number of bootstrap resamples
+    confidence: float
+        Confidence level of intervals
+    random_seed: int | None
+        Random seed of resampling
+
+    Returns
+    -------
+    intervals: dict
+        Same structure as the output of ``calc_scores``, each value being
+        np.ndarray of (lower, upper) bounds with shape of (2, ...)
+    """
+
+    n_samples, tagset_size, _ = confusion_matrices.shape
+    rng = np.random.default_rng(random_seed)
+
+    # Number of times each sample is drawn in each resample
+    weights = rng.multinomial(
+        n_samples, np.full(n_samples, 1 / n_samples), size=n_bootstrap)
+    resampled = torch.from_numpy(weights).to(torch.float64) @ \
+        confusion_matrices.reshape(n_samples, -1).to(torch.float64).cpu()
+    scores = calc_scores(
+        resampled.view(n_bootstrap, tagset_size, tagset_size), fp_list, fp_rate_dict)
 
+    alpha = (1 - confidence) / 2 * 100
+    intervals = {}
+    for score_type, metric_scores in scores.items():
+        intervals[score_type] = {
+            metric: np.nanpercentile(score.numpy(), [alpha, 100 - alpha], axis=0)
+            for metric, score in metric_scores.items()
+        }
+    return intervals
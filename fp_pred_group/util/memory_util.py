@@ -0,0 +1,225 @@
+import gc
+import json
+import resource
+import sys
+
+import numpy as np
+import torch
+from pytorch_lightning.callbacks import Callback
+
+def get_rss():
+    """Current resident set size [bytes], or the peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return get_peak_rss()
+
+def get_peak_rss():
+    """Peak resident set size [bytes] of the process so far."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+def get_tensor_stats(n_top=5):
+    """Live tensors found by the garbage collector, grouped by device, dtype and shape.
+
+    Tensors sharing storage (views) are counted once.
+
+    Returns
+    -------
+    stats: dict
+        {n_tensors, bytes, cuda_allocated, top} where top lists the
+        groups of the largest total size
+    """
+    storages = set()
+    groups = {}
+    n_tensors = 0
+    total_bytes = 0
+    for obj in gc.get_objects():
+        try:
+            if not torch.is_tensor(obj) or obj.is_sparse:
+                continue
+            storage = obj.storage()
+        except (ReferenceError, RuntimeError):
+            continue
+        n_tensors += 1
+        key = "{} {} {}".format(obj.device, str(obj.dtype).replace("torch.", ""), tuple(obj.shape))
+        group = groups.setdefault(key, {"tensor": key, "n": 0, "bytes": 0})
+        group["n"] += 1
+        if (obj.device, storage.data_ptr()) in storages:
+            continue
+        storages.add((obj.device, storage.data_ptr()))
+        size = storage.size() * storage.element_size()
+        group["bytes"] += size
+        total_bytes += size
+
+    return {
+        "n_tensors": n_tensors,
+        "bytes": total_bytes,
+        "cuda_allocated": torch.cuda.memory_allocated() if torch.cuda.is_available() else 0,
+        "top": sorted(groups.values(), key=lambda group: -group["bytes"])[:n_top],
+    }
+
+class MemoryTracker:
+    """Sample RSS and live tensors of steps and phases.
+
+    Each sample is labeled with what has just run (e.g. a training step or
+    the end of an epoch). The peak RSS between two samples is attributed to
+    the later one, with the tensors alive at that sample. RSS at the end of
+    each epoch gives the growth per epoch.
+
+    Params
+    ------
+    enabled: bool
+        Record samples if True
+    track_tensors: bool
+        Also collect live tensors (``get_tensor_stats``) at each sample,
+        which scans all objects of the garbage collector
+    n_top: int
+        Number of largest tensor groups kept in each sample
+    """
+
+    def __init__(self, enabled=True, track_tensors=True, n_top=5):
+        self.enabled = enabled
+        self.track_tensors = track_tensors
+        self.n_top = n_top
+        self.samples = []
+        self.epoch_rss = []
+        self.peak = None
+
+    def sample(self, phase, step=None):
+        if not self.enabled:
+            return None
+        sample = {
+            "phase": phase,
+            "step": step,
+            "rss": get_rss(),
+            "peak_rss": get_peak_rss(),
+        }
+        if self.track_tensors:
+            sample["tensors"] = get_tensor_stats(self.n_top)
+
+        # Peak reached after the previous sample
+        if self.peak is None or sample["peak_rss"] > self.peak["peak_rss"]:
+            previous = self.samples[-1] if len(self.samples) > 0 else None
+            self.peak = {
+                "peak_rss": sample["peak_rss"],
+                "phase": phase,
+                "step": step,
+                "after": None if previous is None else {
+                    "phase": previous["phase"], "step": previous["step"]},
+                "tensors": sample.get("tensors", None),
+            }
+        self.samples.append(sample)
+        return sample
+
+    def end_epoch(self, epoch):
+        sample = self.sample("epoch_end", epoch)
+        if sample is not None:
+            self.epoch_rss.append(sample["rss"])
+
+    def epoch_growth(self):
+        """Growth of RSS [bytes] at the end of each epoch from the previous one.
+
+        The first epoch is not counted, as it includes allocator and cache warm-up.
+        """
+        return np.diff(self.epoch_rss).tolist()
+
+    def exceeded_epochs(self, max_growth):
+        """Epochs (counted from 0) whose RSS grew by more than max_growth [bytes]."""
+        return [
+            epoch + 1 for epoch, growth in enumerate(self.epoch_growth())
+            if growth > max_growth]
+
+    def summary(self):
+        phases = {}
+        for sample in self.samples:
+            phases.setdefault(sample["phase"], []).append(sample["rss"])
+        return {
+            "peak": self.peak,
+            "phases": {
+                phase: {
+                    "n_samples": len(rss),
+                    "mean_rss": float(np.mean(rss)),
+                    "max_rss": int(max(rss)),
+                }
+                for phase, rss in phases.items()
+            },
+            "epoch_rss": self.epoch_rss,
+            "epoch_growth": self.epoch_growth(),
+        }
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"summary": self.summary(), "samples": self.samples}, f, indent=4)
+
+    def print_summary(self):
+        summary = self.summary()
+        if summary["peak"] is not None:
+            peak = summary["peak"]
+            print("peak rss: {:.1f} [MB] at {} (step {}) after {}".format(
+                peak["peak_rss"] / 1e6, peak["phase"], peak["step"], peak["after"]))
+            if peak["tensors"] is not None:
+                for group in peak["tensors"]["top"]:
+                    print("\t{}: {} tensors, {:.1f} [MB]".format(
+                        group["tensor"], group["n"], group["bytes"] / 1e6))
+        for phase, s in summary["phases"].items():
+            print("{}: mean rss {:.1f} [MB], max rss {:.1f} [MB]".format(
+                phase, s["mean_rss"] / 1e6, s["max_rss"] / 1e6))
+        if len(summary["epoch_growth"]) > 0:
+            print("rss growth per epoch [MB]: " + ", ".join([
+                "{:.1f}".format(growth / 1e6) for growth in summary["epoch_growth"]]))
+
+class MemoryCallback(Callback):
+    """Sample memory of training, validation and prediction steps and epoch ends.
+
+    Steps are sampled every ``sample_every_n_steps`` steps, and RSS of training
+    steps is logged to the train TensorBoard logger. Samples are written to
+    ``json_path`` at the end of training (after prediction, the caller saves
+    the tracker). If ``max_epoch_growth`` [bytes] is set, training fails when
+    RSS grows more than that in an epoch.
+    """
+
+    def __init__(self, memory_tracker, json_path, sample_every_n_steps=50, max_epoch_growth=None):
+        self.memory_tracker = memory_tracker
+        self.json_path = json_path
+        self.sample_every_n_steps = sample_every_n_steps
+        self.max_epoch_growth = max_epoch_growth
+
+    def _sample_step(self, phase, batch_idx, step):
+        if batch_idx % self.sample_every_n_steps == 0:
+            return self.memory_tracker.sample(phase, step)
+        return None
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx):
+        sample = self._sample_step("train_step", batch_idx, trainer.global_step)
+        if sample is not None:
+            train_logger = trainer.logger[0].experiment
+            train_logger.add_scalar("Memory/rss_mb", sample["rss"] / 1e6, global_step=trainer.global_step)
+
+    def on_validation_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx):
+        self._sample_step("validation_step", batch_idx, trainer.global_step)
+
+    def on_validation_epoch_end(self, trainer, pl_module):
+        self.memory_tracker.sample("validation_epoch_end", trainer.global_step)
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        self.memory_tracker.end_epoch(trainer.current_epoch)
+        self.check_growth()
+
+    def on_predict_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx):
+        self._sample_step("predict_step", batch_idx, batch_idx)
+
+    def on_train_end(self, trainer, pl_module):
+        self.memory_tracker.save(self.json_path)
+        self.memory_tracker.print_summary()
+
+    def check_growth(self):
+        if self.max_epoch_growth is None:
+            return
+        exceeded_epochs = self.memory_tracker.exceeded_epochs(self.max_epoch_growth)
+        if len(exceeded_epochs) > 0:
+            self.memory_tracker.save(self.json_path)
+        assert len(exceeded_epochs) == 0, \
+            "rss grew more than {:.1f} [MB] in epochs {} (see {})".format(
+                self.max_epoch_growth / 1e6, exceeded_epochs, self.json_path)
@@ -0,0 +1,28 @@
+def insert_fps(words, fp_tags, fp_list):
+    """Insert predicted fps into word sequence.
+
+    Params
+    ------
+    words: list of str
+        Words (morphemes) without fps
+    fp_tags: list of int
+        Predicted fp tags, length of len(words) + 2 ([CLS] and [SEP] positions).
+        Tag of position i means fp after the (i-1)-th word.
+    fp_list: list of str
+        List of fp words
+
+    Returns
+    -------
+    predicted_text: str
+        Text with fps in the format of "(F<fp>)"
+    """
+
+    predicted_text = []
+    if fp_tags[0] > 0:
+        predicted_text.append("(F{})".format(fp_list[fp_tags[0] - 1]))
+    for i in range(len(words)):
+        predicted_text.append(words[i])
+        if fp_tags[i + 1] > 0:
+            predicted_text.append("(F{})".format(fp_list[fp_tags[i + 1] - 1]))
+
+    return " ".join(predicted_text)
@@ -0,0 +1,159 @@
+import contextlib
+import json
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from pytorch_lightning.callbacks import Callback
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+class StepTimer:
+    """Accumulate durations [sec] of named sections of training steps.
+
+    When disabled, ``section`` returns a shared no-op context, so
+    instrumented code costs one method call per section.
+
+    Params
+    ------
+    enabled: bool
+        Record durations if True
+    cuda_sync: bool
+        Synchronize cuda at section boundaries, for accurate timings of GPU work
+    """
+
+    def __init__(self, enabled=True, cuda_sync=False):
+        self.enabled = enabled
+        self.cuda_sync = cuda_sync and torch.cuda.is_available()
+        self.step_durations = {}
+        self.durations = {}
+
+    def section(self, name):
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._section(name)
+
+    @contextlib.contextmanager
+    def _section(self, name):
+        if self.cuda_sync:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        yield
+        if self.cuda_sync:
+            torch.cuda.synchronize()
+        self.add(name, time.perf_counter() - start)
+
+    def add(self, name, duration):
+        self.step_durations[name] = self.step_durations.get(name, 0.0) + duration
+
+    def pop_step(self):
+        """Get durations of sections in the current step, and start the next step."""
+        step_durations = self.step_durations
+        for name, duration in step_durations.items():
+            self.durations.setdefault(name, []).append(duration)
+        self.step_durations = {}
+        return step_durations
+
+    def summary(self):
+        summary = {}
+        for name, durations in self.durations.items():
+            durations = np.array(durations)
+            summary[name] = {
+                "n_steps": len(durations),
+                "total": float(durations.sum()),
+                "mean": float(durations.mean()),
+                "p50": float(np.percentile(durations, 50)),
+                "p99": float(np.percentile(durations, 99)),
+            }
+        return summary
+
+class TimedDataset(Dataset):
+    """Dataset returning (item, loading time) of the wrapped dataset."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        item = self.dataset[index]
+        return item, time.perf_counter() - start
+
+    def __len__(self):
+        return len(self.dataset)
+
+def timed_collate(collate_fn):
+    """Wrap collate function for ``TimedDataset`` to return (batch, timings).
+
+    Loading and collating run in the DataLoader workers if num_workers > 0,
+    so their timings are measured there and travel with the batch.
+    """
+    def collate(items):
+        start = time.perf_counter()
+        batch = collate_fn([item for item, _ in items])
+        timings = {
+            "load": sum([duration for _, duration in items]),
+            "collate": time.perf_counter() - start,
+        }
+        return batch, timings
+    return collate
+
+class TimingCallback(Callback):
+    """Time data waiting, backward and optimizer step of training steps.
+
+    Sections recorded by ``MyLightningModel`` (forward, loss and metrics) and
+    by the data loader are collected in the same ``StepTimer``. Durations of
+    each step are logged to the train TensorBoard logger every
+    ``log_every_n_steps`` steps, and the summary is written to ``json_path``
+    at the end of training.
+    """
+
+    def __init__(self, step_timer, json_path, log_every_n_steps=50):
+        self.step_timer = step_timer
+        self.json_path = json_path
+        self.log_every_n_steps = log_every_n_steps
+        self.last_batch_end = None
+        self.section_start = None
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx, dataloader_idx):
+        now = time.perf_counter()
+        if self.last_batch_end is not None:
+            self.step_timer.add("data_wait", now - self.last_batch_end)
+
+    def on_before_backward(self, trainer, pl_module, loss):
+        self.section_start = time.perf_counter()
+
+    def on_after_backward(self, trainer, pl_module):
+        if self.step_timer.cuda_sync:
+            torch.cuda.synchronize()
+        self.step_timer.add("backward", time.perf_counter() - self.section_start)
+
+    def on_before_optimizer_step(self, trainer, pl_module, optimizer, opt_idx):
+        self.section_start = time.perf_counter()
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx):
+        if self.step_timer.cuda_sync:
+            torch.cuda.synchronize()
+        if self.section_start is not None:
+            self.step_timer.add("optimizer", time.perf_counter() - self.section_start)
+            self.section_start = None
+
+        step_durations = self.step_timer.pop_step()
+        if trainer.global_step % self.log_every_n_steps == 0:
+            train_logger = trainer.logger[0].experiment
+            for name, duration in step_durations.items():
+                train_logger.add_scalar(f"Time/{name}", duration, global_step=trainer.global_step)
+        self.last_batch_end = time.perf_counter()
+
+    def on_validation_start(self, trainer, pl_module):
+        # Validation is not counted as data waiting of the next training step
+        self.last_batch_end = None
+
+    def on_train_end(self, trainer, pl_module):
+        summary = self.step_timer.summary()
+        with open(self.json_path, "w") as f:
+            json.dump(summary, f, indent=4)
+        print("\n".join([
+            "{}: mean {:.2f} [ms], total {:.1f} [sec]".format(
+                name, s["mean"] * 1e3, s["total"])
+            for name, s in summary.items()]))
@@ -0,0 +1,118 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+class Tracer:
+    """Record spans as Chrome trace events (chrome://tracing, Perfetto).
+
+    Spans are "complete" events with wall-clock start time, so spans recorded
+    in worker processes (``run_traced``) line up with those of the main
+    process. When disabled, ``span`` returns a shared no-op context.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+
+    def span(self, name, **args):
+        """Context of a span, with args (e.g. ids of lecture and IPU) shown in the trace."""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._span(name, args)
+
+    @contextlib.contextmanager
+    def _span(self, name, args):
+        start_ts = time.time()
+        start = time.perf_counter()
+        yield
+        self.events.append({
+            "name": name,
+            "cat": "preprocess",
+            "ph": "X",
+            "ts": start_ts * 1e6,
+            "dur": (time.perf_counter() - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        })
+
+    def pop_events(self):
+        events = self.events
+        self.events = []
+        return events
+
+    def extend(self, events):
+        self.events += events
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self, n_slowest=10, n_bins=20):
+        """Latency statistics, histogram and slowest items of each span name.
+
+        Returns
+        -------
+        summary: dict
+            {span name: {n, total, mean, p50, p90, p99, max (in ms), histogram, slowest}}
+            where histogram has log-spaced bin edges [ms] and counts, and
+            slowest lists args and durations of the slowest spans.
+        """
+        durations_dict = {}
+        events_dict = {}
+        for event in self.events:
+            durations_dict.setdefault(event["name"], []).append(event["dur"] / 1e3)
+            events_dict.setdefault(event["name"], []).append(event)
+
+        summary = {}
+        for name, durations in durations_dict.items():
+            durations = np.array(durations)
+            low = max(durations.min(), 1e-3)
+            high = max(durations.max(), low * 1.01)
+            counts, bin_edges = np.histogram(
+                np.clip(durations, low, high), bins=np.geomspace(low, high, n_bins + 1))
+            slowest = np.argsort(durations)[::-1][:n_slowest]
+            summary[name] = {
+                "n": len(durations),
+                "total": float(durations.sum()),
+                "mean": float(durations.mean()),
+                "p50": float(np.percentile(durations, 50)),
+                "p90": float(np.percentile(durations, 90)),
+                "p99": float(np.percentile(durations, 99)),
+                "max": float(durations.max()),
+                "histogram": {
+                    "bin_edges": bin_edges.tolist(),
+                    "counts": counts.tolist(),
+                },
+                "slowest": [
+                    {"dur": float(durations[i]), "args": events_dict[name][i]["args"]}
+                    for i in slowest],
+            }
+        return summary
+
+    def save_summary(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=4)
+
+_tracer = Tracer()
+
+def get_tracer():
+    """Tracer of the process."""
+    return _tracer
+
+def run_traced(enabled, fn, *args, **kwargs):
+    """Run function in a worker process with tracing, and return (result, trace events).
+
+    Events are merged into the tracer of the main process by ``Tracer.extend``.
+    """
+    tracer = get_tracer()
+    tracer.enabled = enabled
+    tracer.pop_events()
+    result = fn(*args, **kwargs)
+    return result, tracer.pop_events()
@@ -25,3 +25,18 @@ def collate_fn(batch):
     x_batch = torch.stack([torch.from_numpy(pad_2d(x[0], max_len)) for x in batch])
     y_batch = torch.stack([torch.from_numpy(pad_1d(x[1], max_len)) for x in batch])
     return x_batch, y_batch
+
+def get_mask(x_batch):
+    """Get mask of valid positions from zero-padded features.
+
+    Params
+    ------
+    x_batch: torch.Tensor
+        Padded features, shape of (batch, max_text_len, embedding_dim)
+
+    Returns
+    -------
+    mask: torch.Tensor
+        Boolean mask, shape of (batch, max_text_len)
+    """
+    return (x_batch != 0).any(dim=-1)
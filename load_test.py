@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+async def request(reader, writer, method, path, body=None):
+    body = b"" if body is None else json.dumps(body, ensure_ascii=False).encode()
+    writer.write(
+        "{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n"
+        .format(method, path, len(body)).encode() + body)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if line == "":
+            break
+        key, value = line.split(":", 1)
+        headers[key.strip().lower()] = value.strip()
+    response = await reader.readexactly(int(headers["content-length"]))
+    return status_line.decode().split(" ")[1], json.loads(response)
+
+async def open_connection(args):
+    if args.unix_socket is not None:
+        return await asyncio.open_unix_connection(args.unix_socket)
+    return await asyncio.open_connection(args.host, args.port)
+
+async def client(args, texts, n_requests, latencies):
+    reader, writer = await open_connection(args)
+    for _ in range(n_requests):
+        body = {"text": random.choice(texts)}
+        if args.model is not None:
+            body["model"] = args.model
+        start = time.perf_counter()
+        status, _ = await request(reader, writer, "POST", "/predict", body)
+        latencies.append(time.perf_counter() - start)
+        assert status == "200", f"request failed with status {status}"
+    writer.close()
+
+async def main(args):
+    with open(args.utt_list, "r") as f:
+        texts = [l.strip().split(":", 1)[-1] for l in f if len(l.strip()) > 0]
+
+    # Concurrent clients
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client(args, texts, args.n_requests, latencies)
+        for _ in range(args.concurrency)])
+    elapsed_time = time.perf_counter() - start
+
+    # Statistics of client and server
+    reader, writer = await open_connection(args)
+    _, server_stats = await request(reader, writer, "GET", "/stats")
+    writer.close()
+
+    print(json.dumps({
+        "n_requests": len(latencies),
+        "requests_per_sec": len(latencies) / elapsed_time,
+        "client_latency_p50": float(np.percentile(latencies, 50)),
+        "client_latency_p99": float(np.percentile(latencies, 99)),
+        "server": server_stats,
+    }, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("utt_list", type=str, help="path to utterance list (utt_id:text)")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix_socket", type=str, default=None, help="path to unix socket of server")
+    parser.add_argument("--model", type=str, default=None, help="model name, server's first model if not set")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of concurrent clients")
+    parser.add_argument("--n_requests", type=int, default=100, help="number of requests per client")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
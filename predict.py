@@ -1,5 +1,4 @@
 from pathlib import Path
-from tqdm import tqdm
 import hydra
 from hydra.utils import to_absolute_path
 from omegaconf import OmegaConf, DictConfig
@@ -7,92 +6,127 @@ from omegaconf import OmegaConf, DictConfig
 import torch
 from torch.utils.data import DataLoader
 import pytorch_lightning as pl
+from pytorch_lightning.callbacks import BasePredictionWriter
 
 # My library
 import fp_pred_group.model
-from fp_pred_group.dataset import MyDataset
+from fp_pred_group.model import MultiTagger
+from fp_pred_group.dataset import NoFPDataset
 from fp_pred_group.module import MyLightningModel
-from fp_pred_group.util.train_util import collate_fn
+from fp_pred_group.runtime import quantize_tagger
+from fp_pred_group.util.ckpt_util import load_inference_model
+from fp_pred_group.util.pred_util import insert_fps
 
-def predict(utt_list_path, in_feat_dir, out_feat_dir, out_dir,
-            batch_size, num_workers, trainer, model, fp_list):
+class FPPredictionWriter(BasePredictionWriter):
+    """Write predicted texts to file as soon as each batch finishes."""
+
+    def __init__(self, out_path, fp_list):
+        super().__init__(write_interval="batch")
+        self.out_path = out_path
+        self.fp_list = fp_list
+        self.f = None
+
+    def on_predict_start(self, trainer, pl_module):
+        print("writing prediction...")
+        self.f = open(self.out_path, "w")
+        self.n_written = 0
+
+    def on_predict_end(self, trainer, pl_module):
+        self.f.close()
+        self.f = None
+
+    def write_on_batch_end(
+        self, trainer, pl_module, prediction, batch_indices, batch, batch_idx, dataloader_idx):
+
+        predicted_fp_tags = torch.argmax(prediction["predictions"], dim=-1).tolist()
+        for utt_id, utt_text, utt_wo_fps, fp_tags in zip(
+                prediction["utt_ids"],
+                prediction["tagged_texts"],
+                prediction["texts"],
+                predicted_fp_tags):
+
+            predicted_text = insert_fps(utt_wo_fps.split(" "), fp_tags, self.fp_list)
+            outtexts = [
+                "{}:".format(utt_id), 
+                "\ttarget text: \t{}".format(utt_text),
+                "\tpredicted text: \t{}".format(predicted_text),
+            ]
+
+            if self.n_written > 0:
+                self.f.write("\n")
+            self.f.write("\n".join(outtexts))
+            self.n_written += 1
+
+class MultiFPPredictionWriter(FPPredictionWriter):
+    """Write texts predicted by several models as columns of a tsv file."""
+
+    def __init__(self, out_path, fp_list, model_names):
+        super().__init__(out_path, fp_list)
+        self.model_names = model_names
+
+    def on_predict_start(self, trainer, pl_module):
+        super().on_predict_start(trainer, pl_module)
+        self.f.write("\t".join(["utt_id", "target text"] + self.model_names))
+        self.n_written = 1
+
+    def write_on_batch_end(
+        self, trainer, pl_module, prediction, batch_indices, batch, batch_idx, dataloader_idx):
+
+        # (n_models, batch, length) -> (batch, n_models, length)
+        predicted_fp_tags = torch.argmax(
+            prediction["predictions"], dim=-1).transpose(0, 1).tolist()
+        for utt_id, utt_text, utt_wo_fps, fp_tags_models in zip(
+                prediction["utt_ids"],
+                prediction["tagged_texts"],
+                prediction["texts"],
+                predicted_fp_tags):
+
+            predicted_texts = [
+                insert_fps(utt_wo_fps.split(" "), fp_tags, self.fp_list)
+                for fp_tags in fp_tags_models]
+            self.f.write("\n" + "\t".join([utt_id, utt_text] + predicted_texts))
+
+def load_tagger(exp_dir, step, fp_list):
+    train_config = OmegaConf.load(exp_dir / "config.yaml")
+    model = hydra.utils.instantiate(train_config.model.netG)
+    ckpt_path = list((exp_dir / "ckpt").glob(
+        "*-step={}.ckpt".format(str(step))
+    ))[0]
+    pl_model = MyLightningModel.load_from_checkpoint(
+        str(ckpt_path),
+        model=model,
+        fp_list=fp_list,
+        strict=False)
+    return pl_model.model
+
+def predict(utt_list_path, in_feat_dir, out_feat_dir,
+            batch_size, num_workers, trainer, model):
 
     # Load utt list
     with open(utt_list_path, "r") as f:
-        sentence_list = [l.strip() for l in f if len(l.strip()) > 0]
-        utt_name_list = [sen.split(":")[0] for sen in sentence_list]
+        utt_name_list = sorted(set(
+            l.strip().split(":")[0] for l in f if len(l.strip()) > 0))
 
     # Dataset
     in_feat_dir = Path(in_feat_dir)
     out_feat_dir = Path(out_feat_dir)
 
     in_feats_paths = [
-        p for p in in_feat_dir.glob("*-feats.npy") 
-        if p.stem.split("-feats")[0] in utt_name_list]
+        in_feat_dir / f"{utt_name}-feats.npy" for utt_name in utt_name_list
+        if (in_feat_dir / f"{utt_name}-feats.npy").exists()]
     out_feats_paths = [
         out_feat_dir / in_path.name for in_path in in_feats_paths]
 
-    dataset = MyDataset(in_feats_paths, out_feats_paths)
+    dataset = NoFPDataset(in_feats_paths, out_feats_paths, utt_list_path)
     data_loader = DataLoader(dataset,
                              batch_size=batch_size,
-                             collate_fn=collate_fn,
+                             collate_fn=dataset.collate_fn,
                              pin_memory=True,
                              num_workers=num_workers,
                              shuffle=False)
 
-    # Prediction
-    out_utt_list = []
-    outputs = trainer.predict(model, data_loader)
-    for output in tqdm(outputs):
-        batch_idx = output["batch_idx"]
-        predictions = output["predictions"]
-
-        for in_feats_path, prediction in zip(
-                in_feats_paths[
-                    batch_idx * batch_size : (batch_idx + 1) * batch_size],
-                predictions):
-
-            utt_id = in_feats_path.stem.split("-feats")[0]
-            for sen in sentence_list:
-                if sen.startswith(f"{utt_id}"):
-                    utt_text = sen.split(":")[-1]
-
-            utt_wo_fps = [
-                w for w in utt_text.split(" ") 
-                if not w.startswith("(F")]
-            predicted_fp_tags = torch.argmax(prediction, dim=1)
-
-            # print(prediction.shape)
-            # print(utt_wo_fps)
-            # print(len(utt_wo_fps), len(predicted_fp_tags))
-
-            predicted_text = []
-            if int(predicted_fp_tags[0]) > 0:
-                predicted_text.append(
-                    "(F{})".format(
-                        fp_list[int(predicted_fp_tags[0]) - 1]))
-            for i in range(len(utt_wo_fps)):
-                predicted_text.append(utt_wo_fps[i])
-                if int(predicted_fp_tags[i + 1]) > 0:
-                    predicted_text.append(
-                        "(F{})".format(
-                            fp_list[int(predicted_fp_tags[i + 1]) - 1]))
-
-            outtexts = [
-                "{}:".format(utt_id), 
-                "\ttarget text: \t{}".format(utt_text),
-                "\tpredicted text: \t{}".format(" ".join(predicted_text)),
-            ]
-
-            out_utt_list.append(outtexts)
-
-    out_utt_list = [
-        "\n".join(outtexts) 
-        for outtexts in sorted(out_utt_list, key=lambda x: x[0])]
-
-    with open(out_dir / "fp_prediction.txt", "w") as f:
-        print("writing prediction...")
-        f.write("\n".join(out_utt_list))
+    # Prediction (written by FPPredictionWriter)
+    trainer.predict(model, data_loader, return_predictions=False)
 
 @hydra.main(config_path="conf/predict", config_name="config")
 def main(config: DictConfig):
@@ -105,14 +139,9 @@ def main(config: DictConfig):
     out_feat_dir = Path(config.data.data_dir) / "outfeats"
 
     # Out directory
-    exp_dir = Path(to_absolute_path(config[phase].exp_dir))
-    ckpt_dir = exp_dir / "ckpt"
     out_dir = Path(to_absolute_path(config[phase].out_dir))
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    # Load config
-    train_config = OmegaConf.load(exp_dir / "config.yaml")
-
     # Save config
     with open(out_dir / "config.yaml", "w") as f:
         OmegaConf.save(config, f)
@@ -126,27 +155,43 @@ def main(config: DictConfig):
         fp_list = [l.strip() for l in f]
 
     # Load model
-    model = hydra.utils.instantiate(train_config.model.netG)
-    ckpt_path = list(ckpt_dir.glob(
-        "*-step={}.ckpt".format(str(config[phase].checkpoint.step))
-    ))[0]
-    pl_model = MyLightningModel.load_from_checkpoint(
-        str(ckpt_path),
-        model=model,
-        fp_list=fp_list,
-        strict=False)
+    if config[phase].models is None:
+        exp_dir = Path(to_absolute_path(config[phase].exp_dir))
+        if config[phase].checkpoint.path is not None:
+            model = load_inference_model(to_absolute_path(config[phase].checkpoint.path))
+        else:
+            model = load_tagger(exp_dir, config[phase].checkpoint.step, fp_list)
+        pred_writer = FPPredictionWriter(out_dir / "fp_prediction.txt", fp_list)
+    else:
+        # Several models run over each batch of shared features
+        exp_dir = out_dir
+        model = MultiTagger({
+            model_name: load_inference_model(to_absolute_path(model_config.path))
+            if "path" in model_config else load_tagger(
+                Path(to_absolute_path(model_config.exp_dir)), model_config.step, fp_list)
+            for model_name, model_config in config[phase].models.items()
+        })
+        pred_writer = MultiFPPredictionWriter(
+            out_dir / "fp_prediction.tsv", fp_list, model.tagger_names)
+    if config[phase].quantize:
+        # Dynamic int8 quantization for CPU
+        assert not config[phase].gpus, \
+            "quantized model runs on CPU only, set {}.gpus=0".format(phase)
+        model = quantize_tagger(model)
+    pl_model = MyLightningModel(model=model, fp_list=fp_list)
 
     # Trainer
     trainer = pl.Trainer(
         gpus=config[phase].gpus,
         auto_select_gpus=config[phase].auto_select_gpus,
-        default_root_dir=exp_dir)
+        default_root_dir=exp_dir,
+        callbacks=[pred_writer])
 
     # Predict
     predict(config.data.utt_list, 
-            in_feat_dir, out_feat_dir, out_dir,
+            in_feat_dir, out_feat_dir,
             config.data.batch_size, config.data.num_workers,
-            trainer, pl_model, fp_list)
+            trainer, pl_model)
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,55 @@
+import time
+start_time = time.perf_counter()
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# My library
+from fp_pred_group.runtime import FPTagger
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_path", type=str, help="path to TorchScript tagger (.ts) from export_model.py")
+    parser.add_argument("data_dir", type=str, help="path to directory of utt_morphs.list and infeats")
+    parser.add_argument("out_path", type=str, help="path to output fp_prediction.txt")
+    parser.add_argument("--utt_list_name", type=str, default="utt_morphs")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+    import_time = time.perf_counter() - start_time
+
+    # Load model
+    tagger = FPTagger(args.model_path, device=args.device)
+    load_time = time.perf_counter() - start_time - import_time
+
+    # Load utt list
+    data_dir = Path(args.data_dir)
+    with open(data_dir / "{}.list".format(args.utt_list_name), "r") as f:
+        utts = sorted([
+            tuple(l.strip().split(":", 1)) for l in f if len(l.strip()) > 0])
+
+    # Predict
+    out_utt_list = []
+    for i in range(0, len(utts), args.batch_size):
+        batch = utts[i : i + args.batch_size]
+        words_list = [
+            [w for w in utt_text.split(" ") if not w.startswith("(F")]
+            for _, utt_text in batch]
+        feats_list = [
+            np.load(data_dir / "infeats" / f"{utt_id}-feats.npy") for utt_id, _ in batch]
+        predicted_texts = tagger.predict_texts(words_list, feats_list)
+        for (utt_id, utt_text), predicted_text in zip(batch, predicted_texts):
+            out_utt_list.append("\n".join([
+                "{}:".format(utt_id),
+                "\ttarget text: \t{}".format(utt_text),
+                "\tpredicted text: \t{}".format(predicted_text),
+            ]))
+
+    with open(args.out_path, "w") as f:
+        f.write("\n".join(out_utt_list))
+    total_time = time.perf_counter() - start_time
+
+    print("import: {:.3f} [sec], load: {:.3f} [sec], total (cold start): {:.3f} [sec]".format(
+        import_time, load_time, total_time))
@@ -0,0 +1,164 @@
+import time
+from pathlib import Path
+from tqdm import tqdm
+import hydra
+from hydra.utils import to_absolute_path
+from omegaconf import OmegaConf, DictConfig
+
+import numpy as np
+import pytorch_lightning as pl
+
+# My library
+from fp_pred_group.module import MyLightningModel
+from fp_pred_group.pipeline import FPPredictionPipeline, juman_analyzer
+from fp_pred_group.preprocessor.preprocess_feat import load_bert, load_projection
+from fp_pred_group.streaming import ChunkedBertEmbedder, StreamingTagger, StreamingFPPredictor
+
+def read_utts(utt_list_path):
+    with open(utt_list_path, "r") as f:
+        for l in f:
+            if len(l.strip()) > 0:
+                utt_id, text = l.strip().split(":", 1)
+                yield utt_id, text
+
+def predict_streaming(config, model, fp_list, out_dir):
+    """Feed morphemes one by one to ``StreamingFPPredictor``.
+
+    Delay of fp decisions (number of morphemes received after each emitted
+    morpheme) and processing time per morpheme are written to streaming.log.
+    """
+
+    phase = "pred"
+    analyzer = juman_analyzer()
+    bert_tokenizer, bert_model = load_bert(to_absolute_path(config.bert_model_dir))
+    bert_model.to(config[phase].device)
+    predictor = StreamingFPPredictor(
+        ChunkedBertEmbedder(
+            bert_tokenizer, bert_model,
+            chunk_size=config[phase].streaming.chunk_size,
+            left_context=config[phase].streaming.left_context,
+            device=config[phase].device,
+            projection=load_projection(to_absolute_path(config.projection_path))
+                if config.projection_path is not None else None,
+        ),
+        StreamingTagger(model, device=config[phase].device),
+        fp_list,
+    )
+
+    delays = []
+    push_times = []
+    with open(out_dir / "fp_prediction.txt", "w") as f:
+        print("writing prediction...")
+        for i, (utt_id, utt_text) in enumerate(
+                tqdm(read_utts(to_absolute_path(config.data.utt_list)))):
+            morphs = analyzer(utt_text)
+            predicted_text = []
+            n_emitted = 0
+            for j, morph in enumerate(morphs):
+                start = time.perf_counter()
+                pieces = predictor.push([morph])
+                push_times.append(time.perf_counter() - start)
+                for piece in pieces:
+                    if not piece.startswith("(F"):
+                        delays.append(j - n_emitted)
+                        n_emitted += 1
+                predicted_text += pieces
+            predicted_text += predictor.flush()
+            delays += [len(morphs) - 1 - k for k in range(n_emitted, len(morphs))]
+
+            outtexts = [
+                "{}:".format(utt_id), 
+                "\ttarget text: \t{}".format(" ".join(morphs)),
+                "\tpredicted text: \t{}".format(" ".join(predicted_text)),
+            ]
+            if i > 0:
+                f.write("\n")
+            f.write("\n".join(outtexts))
+
+    report = "\n".join([
+        "lookahead: {}".format(model.lookahead),
+        "mean delay: {:.2f} [morphemes]".format(np.mean(delays)),
+        "mean time per morpheme: {:.2f} [ms]".format(np.mean(push_times) * 1e3),
+        "p99 time per morpheme: {:.2f} [ms]".format(np.percentile(push_times, 99) * 1e3),
+    ])
+    print(report)
+    with open(out_dir / "streaming.log", "w") as f:
+        f.write(report)
+
+@hydra.main(config_path="conf/predict_text", config_name="config")
+def main(config: DictConfig):
+
+    # Phase
+    phase = "pred"
+
+    # Out directory
+    exp_dir = Path(to_absolute_path(config[phase].exp_dir))
+    ckpt_dir = exp_dir / "ckpt"
+    out_dir = Path(to_absolute_path(config[phase].out_dir))
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # Load config
+    train_config = OmegaConf.load(exp_dir / "config.yaml")
+
+    # Save config
+    with open(out_dir / "config.yaml", "w") as f:
+        OmegaConf.save(config, f)
+
+    # Set random seed
+    pl.seed_everything(config.random_seed)
+
+    # FPs
+    fp_list_path = Path(to_absolute_path(config.data.fp_list))
+    with open(fp_list_path, "r") as f:
+        fp_list = [l.strip() for l in f]
+
+    # Load model
+    model = hydra.utils.instantiate(train_config.model.netG)
+    ckpt_path = list(ckpt_dir.glob(
+        "*-step={}.ckpt".format(str(config[phase].checkpoint.step))
+    ))[0]
+    pl_model = MyLightningModel.load_from_checkpoint(
+        str(ckpt_path),
+        model=model,
+        fp_list=fp_list,
+        strict=False)
+
+    # Streaming prediction
+    if config[phase].streaming.enable:
+        predict_streaming(config, pl_model.model, fp_list, out_dir)
+        return
+
+    # Pipeline
+    pipeline = FPPredictionPipeline(
+        to_absolute_path(config.bert_model_dir),
+        pl_model.model,
+        fp_list,
+        batch_size=config.data.batch_size,
+        device=config[phase].device,
+        projection=load_projection(to_absolute_path(config.projection_path))
+            if config.projection_path is not None else None,
+    )
+
+    # Raw utterances (utt_id:text)
+    # Predict
+    with open(out_dir / "fp_prediction.txt", "w") as f:
+        print("writing prediction...")
+        for i, (utt_id, utt_text, predicted_text) in enumerate(
+                pipeline(read_utts(to_absolute_path(config.data.utt_list)))):
+            outtexts = [
+                "{}:".format(utt_id), 
+                "\ttarget text: \t{}".format(utt_text),
+                "\tpredicted text: \t{}".format(predicted_text),
+            ]
+            if i > 0:
+                f.write("\n")
+            f.write("\n".join(outtexts))
+
+    # Throughput of each stage
+    report = pipeline.report()
+    print(report)
+    with open(out_dir / "pipeline.log", "w") as f:
+        f.write(report)
+
+if __name__=="__main__":
+    main()
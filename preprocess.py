@@ -6,6 +6,7 @@ import hydra
 from omegaconf import DictConfig, OmegaConf
 # My library
 from fp_pred_group.preprocessor import extract_feats, split_data, process_tagtext, analyze_fp
+from fp_pred_group.util.trace_util import get_tracer
 
 @hydra.main(config_path="conf/preprocess", config_name="config")
 def main(config: DictConfig):
@@ -18,15 +19,29 @@ def main(config: DictConfig):
     with open(out_dir / "config.yaml", "w") as f:
         OmegaConf.save(config, f)
 
+    # Tracing
+    tracer = get_tracer()
+    tracer.enabled = config.trace.enable
+
     # Preprocess
     print("process tagtext...")
-    process_tagtext(config)
-    print("extract features...")
-    extract_feats(config)
+    with tracer.span("process_tagtext"):
+        process_tagtext(config)
+    # Split before extracting features, so that pca projection is fitted on train split only
     print("split data...")
-    split_data(config)
+    with tracer.span("split_data"):
+        split_data(config)
+    print("extract features...")
+    with tracer.span("extract_feats"):
+        extract_feats(config)
     print("analyze filler...")
-    analyze_fp(config)
+    with tracer.span("analyze_fp"):
+        analyze_fp(config)
+
+    # Save trace (open in chrome://tracing or Perfetto) and latency summary
+    if tracer.enabled:
+        tracer.save(out_dir / "trace.json")
+        tracer.save_summary(out_dir / "trace_summary.json")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
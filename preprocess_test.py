@@ -22,7 +22,9 @@ def main(config: DictConfig):
     print("process morphs...")
     process_morph(data_dir)
     print("extract features...")
-    extract_feats_test(data_dir, config.fp_list_path, config.bert_model_dir, "utt_morphs")
+    extract_feats_test(
+        data_dir, config.fp_list_path, config.bert_model_dir, "utt_morphs",
+        projection_path=config.projection_path)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
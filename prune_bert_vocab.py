@@ -0,0 +1,37 @@
+import argparse
+import random
+from pathlib import Path
+
+# My library
+from fp_pred_group.preprocessor.prune_vocab import collect_texts, prune_bert_vocab, verify_pruned_bert
+
+def get_dir_size(path):
+    return sum([p.stat().st_size for p in Path(path).glob("*") if p.is_file()])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("bert_model_dir", type=str, help="directory of original bert model")
+    parser.add_argument("out_dir", type=str, help="directory of pruned bert model")
+    parser.add_argument("text_paths", type=str, nargs="+", help="lists of morpheme sequences (e.g. ipu.list, utt_morphs.list)")
+    parser.add_argument("--fp_list", type=str, default="./corpus/CSJ/fp.list")
+    parser.add_argument("--n_verify", type=int, default=200, help="number of texts to compare bert outputs on")
+    parser.add_argument("--random_seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with open(args.fp_list, "r") as f:
+        fp_list = [l.strip() for l in f]
+    texts = collect_texts(args.text_paths)
+
+    # Prune
+    n_tokens, n_pruned_tokens = prune_bert_vocab(args.bert_model_dir, texts, fp_list, args.out_dir)
+    print("vocab: {} -> {} tokens".format(n_tokens, n_pruned_tokens))
+    print("model directory: {:.1f} -> {:.1f} [MB]".format(
+        get_dir_size(args.bert_model_dir) / 1e6, get_dir_size(args.out_dir) / 1e6))
+
+    # Verify
+    random.seed(args.random_seed)
+    verify_texts = random.sample(texts, min(args.n_verify, len(texts)))
+    n_mismatch = verify_pruned_bert(args.bert_model_dir, args.out_dir, verify_texts, fp_list)
+    print("bert outputs: {}/{} texts bit-identical".format(
+        len(verify_texts) - n_mismatch, len(verify_texts)))
+    assert n_mismatch == 0, "pruned bert gives different outputs"
@@ -0,0 +1,63 @@
+import asyncio
+from pathlib import Path
+import hydra
+from hydra.utils import to_absolute_path
+from omegaconf import OmegaConf, DictConfig
+
+import pytorch_lightning as pl
+
+# My library
+from fp_pred_group.module import MyLightningModel
+from fp_pred_group.preprocessor.preprocess_feat import load_projection
+from fp_pred_group.server import FPPredictionServer
+
+@hydra.main(config_path="conf/serve", config_name="config")
+def main(config: DictConfig):
+
+    # Phase
+    phase = "serve"
+
+    # Set random seed
+    pl.seed_everything(config.random_seed)
+
+    # FPs
+    fp_list_path = Path(to_absolute_path(config.fp_list))
+    with open(fp_list_path, "r") as f:
+        fp_list = [l.strip() for l in f]
+
+    # Load models
+    exp_dir = Path(to_absolute_path(config[phase].exp_dir))
+    models = {}
+    for model_name, step in config[phase].models.items():
+        train_config = OmegaConf.load(exp_dir / model_name / "config.yaml")
+        model = hydra.utils.instantiate(train_config.model.netG)
+        ckpt_path = list((exp_dir / model_name / "ckpt").glob(
+            "*-step={}.ckpt".format(str(step))
+        ))[0]
+        pl_model = MyLightningModel.load_from_checkpoint(
+            str(ckpt_path),
+            model=model,
+            fp_list=fp_list,
+            strict=False)
+        models[model_name] = pl_model.model
+
+    # Server
+    server = FPPredictionServer(
+        to_absolute_path(config.bert_model_dir),
+        models,
+        fp_list,
+        max_batch_size=config[phase].max_batch_size,
+        max_latency=config[phase].max_latency,
+        device=config[phase].device,
+        projection=load_projection(to_absolute_path(config.projection_path))
+            if config.projection_path is not None else None,
+    )
+    unix_socket = config[phase].unix_socket
+    asyncio.run(server.serve(
+        host=config[phase].host,
+        port=config[phase].port,
+        unix_socket=to_absolute_path(unix_socket) if unix_socket is not None else None,
+    ))
+
+if __name__=="__main__":
+    main()
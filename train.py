@@ -1,5 +1,11 @@
+import copy
+import multiprocessing
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
 
+import numpy as np
+import torch
 import hydra
 from hydra.utils import to_absolute_path
 from omegaconf import OmegaConf, DictConfig
@@ -11,28 +17,57 @@ from pytorch_lightning.callbacks import LearningRateMonitor
 from pytorch_lightning.callbacks.model_checkpoint import ModelCheckpoint
 
 # My Library
+from fp_pred_group.model import TagHead
 from fp_pred_group.module import MyLightningModel
-from fp_pred_group.dataset import MyDataset
+from fp_pred_group.dataset import MyDataset, GroupDataset, DistillDataset
+from fp_pred_group.util.ckpt_util import get_model_state_dict, load_inference_ckpt
+from fp_pred_group.util.memory_util import MemoryCallback, MemoryTracker
+from fp_pred_group.util.timing_util import StepTimer, TimedDataset, TimingCallback, timed_collate
 from fp_pred_group.util.train_util import collate_fn
 
-def get_data_loaders(data_config, utt_list_paths, in_dir, out_dir, collate_fn):
+def get_data_loaders(
+    data_config, utt_list_paths, in_dir, out_dir, collate_fn, teacher_dir=None, instrument=False):
     data_loaders = {}
 
     for phase in ["train", "dev"]:
 
-        with open(utt_list_paths[phase], "r") as f:
-            utts = [l.strip() for l in f if len(l.strip()) > 0]
+        # List of utt list paths of groups for multi-head models
+        group_utt_list_paths = utt_list_paths[phase] \
+            if isinstance(utt_list_paths[phase], list) else [utt_list_paths[phase]]
+
+        utts = []
+        group_ids = []
+        for group_index, utt_list_path in enumerate(group_utt_list_paths):
+            with open(utt_list_path, "r") as f:
+                group_utts = [l.strip() for l in f if len(l.strip()) > 0]
+            utts += group_utts
+            group_ids += [group_index] * len(group_utts)
 
         in_feats_paths = [
             in_dir / ("-".join(utt.split(":")[:3]) + "-feats.npy") 
             for utt in utts]
         out_feats_paths = [out_dir / in_path.name for in_path in in_feats_paths]
 
-        dataset = MyDataset(in_feats_paths, out_feats_paths)
+        if isinstance(utt_list_paths[phase], list):
+            dataset = GroupDataset(in_feats_paths, out_feats_paths, group_ids)
+            phase_collate_fn = dataset.collate_fn
+        elif teacher_dir is not None and phase == "train":
+            # Cached logits of teacher for distillation
+            dataset = DistillDataset(
+                in_feats_paths, out_feats_paths,
+                [teacher_dir / in_path.name for in_path in in_feats_paths])
+            phase_collate_fn = dataset.collate_fn
+        else:
+            dataset = MyDataset(in_feats_paths, out_feats_paths)
+            phase_collate_fn = collate_fn
+        if instrument:
+            # Time loading and collating in the workers
+            dataset = TimedDataset(dataset)
+            phase_collate_fn = timed_collate(phase_collate_fn)
         data_loaders[phase] = DataLoader(
             dataset,
             batch_size=data_config.batch_size,
-            collate_fn=collate_fn,
+            collate_fn=phase_collate_fn,
             pin_memory=True,
             num_workers=data_config.num_workers,
             shuffle=phase.startswith("train"),
@@ -40,23 +75,40 @@ def get_data_loaders(data_config, utt_list_paths, in_dir, out_dir, collate_fn):
 
     return data_loaders    
 
+def load_fp_rate_dict(fp_rate_list_path, utt_list_path):
+    """Load fp rates, averaged over groups weighted by number of utterances if lists are given."""
+
+    if not isinstance(fp_rate_list_path, list):
+        fp_rate_list_path = [fp_rate_list_path]
+        utt_list_path = [utt_list_path]
+
+    fp_rate_dicts = []
+    n_utts = []
+    for rate_path, utt_path in zip(fp_rate_list_path, utt_list_path):
+        fp_rate_dict = {}
+        with open(rate_path, "r") as f:
+            for l in f:
+                fp_rate_dict[l.strip().split(":")[0]] = float(l.strip().split(":")[1])
+        fp_rate_dicts.append(fp_rate_dict)
+        with open(utt_path, "r") as f:
+            n_utts.append(len([l for l in f if len(l.strip()) > 0]))
+
+    return {
+        fp: sum([d[fp] * n for d, n in zip(fp_rate_dicts, n_utts)]) / sum(n_utts)
+        for fp in fp_rate_dicts[0].keys()
+    }
+
 def setup_each_model(
     config, out_dir, fp_list, 
     train_fp_rate_list_path, dev_fp_rate_list_path, 
     utt_list_paths, in_feat_dir, out_feat_dir, collate_fn,
     model, fine_tune, max_steps,
-    load_ckpt_path=None,
+    load_ckpt_path=None, load_state_dict=None,
     ):
 
     # Get fp rate
-    train_fp_rate_dict = {}
-    dev_fp_rate_dict = {}
-    with open(train_fp_rate_list_path, "r") as f:
-        for l in f:
-            train_fp_rate_dict[l.strip().split(":")[0]] = float(l.strip().split(":")[1])
-    with open(dev_fp_rate_list_path, "r") as f:
-        for l in f:
-            dev_fp_rate_dict[l.strip().split(":")[0]] = float(l.strip().split(":")[1])
+    train_fp_rate_dict = load_fp_rate_dict(train_fp_rate_list_path, utt_list_paths["train"])
+    dev_fp_rate_dict = load_fp_rate_dict(dev_fp_rate_list_path, utt_list_paths["dev"])
 
     # Get loss weights
     loss_weights = [1 / (train_fp_rate_dict["no_fp"] + train_fp_rate_dict["others"])]
@@ -67,7 +119,14 @@ def setup_each_model(
             loss_weights.append(1 / train_fp_rate_dict[fp])
 
     # data loaders
-    data_loaders = get_data_loaders(config.data, utt_list_paths, in_feat_dir, out_feat_dir, collate_fn)
+    teacher_dir = None
+    if config.train.distill.enable:
+        teacher_dir = cache_teacher_logits(config, utt_list_paths["train"], in_feat_dir)
+    instrument = config.train.instrument.enable
+    data_loaders = get_data_loaders(
+        config.data, utt_list_paths, in_feat_dir, out_feat_dir, collate_fn,
+        teacher_dir=teacher_dir, instrument=instrument)
+    step_timer = StepTimer(enabled=instrument, cuda_sync=config.train.instrument.cuda_sync)
 
     # model
     lr_scheduler_params = config.train.optim.lr_scheduler.params
@@ -82,8 +141,17 @@ def setup_each_model(
         "optimizer_params": config.train.optim.optimizer.params,
         "lr_scheduler_name": config.train.optim.lr_scheduler.name,
         "lr_scheduler_params": lr_scheduler_params,
+        "step_timer": step_timer,
     }
-    if fine_tune:
+    if config.train.distill.enable:
+        model_params["distill_alpha"] = config.train.distill.alpha
+        model_params["distill_temperature"] = config.train.distill.temperature
+    if fine_tune and load_state_dict is not None:
+        pl_model = MyLightningModel(
+            **model_params,
+        )
+        pl_model.load_state_dict(load_state_dict)
+    elif fine_tune:
         pl_model = MyLightningModel.load_from_checkpoint(
             load_ckpt_path,
             **model_params,
@@ -107,6 +175,17 @@ def setup_each_model(
     )
     lr_monitor = LearningRateMonitor("step")
     callbacks = [ckpt_callback, lr_monitor]
+    if instrument:
+        callbacks.append(TimingCallback(
+            step_timer, out_dir / "timing.json",
+            log_every_n_steps=config.train.instrument.log_every_n_steps))
+    if config.train.memory.enable:
+        max_epoch_growth_mb = config.train.memory.max_epoch_growth_mb
+        callbacks.append(MemoryCallback(
+            MemoryTracker(track_tensors=config.train.memory.track_tensors),
+            out_dir / "memory.json",
+            sample_every_n_steps=config.train.memory.sample_every_n_steps,
+            max_epoch_growth=max_epoch_growth_mb * 1e6 if max_epoch_growth_mb is not None else None))
 
     # logging
     loggers = []
@@ -131,22 +210,226 @@ def setup_each_model(
         default_root_dir=out_dir,
         callbacks=callbacks,
         logger=loggers,
-        profiler="simple",
+        profiler=config.train.profiler,
     )
 
     return data_loaders, pl_model, trainer
 
 
+def cache_trunk_outputs(model, utt_list_paths, in_feat_dir, cache_dir):
+    """Save outputs of BiLSTM of each utterance in train/dev lists.
+
+    Each utterance is run alone (without padding), and outputs are saved
+    with the same file names as input features. Existing files are reused,
+    so cache_dir must be specific to the weights of the BiLSTM.
+
+    In padded batches (``evaluate.py``, ``predict.py``), the backward
+    direction of the BiLSTM also runs over the zero padding after shorter
+    utterances, so its outputs differ slightly from these. The head is
+    trained on outputs as in batches of one utterance.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    model.eval()
+    for phase in ["train", "dev"]:
+        with open(utt_list_paths[phase], "r") as f:
+            utts = [l.strip() for l in f if len(l.strip()) > 0]
+        with torch.no_grad():
+            for utt in tqdm(utts, desc=f"cache trunk outputs ({phase})..."):
+                feats_name = "-".join(utt.split(":")[:3]) + "-feats.npy"
+                if (cache_dir / feats_name).exists():
+                    continue
+                in_feat = torch.from_numpy(
+                    np.load(in_feat_dir / feats_name).astype(np.float32)).unsqueeze(0)
+                if model.input_proj is not None:
+                    in_feat = model.input_proj(in_feat)
+                bilstm_outputs, _ = model.bilstm(in_feat)
+                np.save(cache_dir / feats_name, bilstm_outputs.squeeze(0).numpy())
+
+def add_trunk_to_checkpoints(model, ckpt_dir):
+    """Add frozen BiLSTM to head-only checkpoints so that they load as full models."""
+    for ckpt_path in ckpt_dir.glob("*.ckpt"):
+        ckpt = torch.load(ckpt_path, map_location="cpu")
+        for k, v in model.state_dict().items():
+            if k.startswith("bilstm.") or k.startswith("input_proj."):
+                ckpt["state_dict"]["model." + k] = v
+        torch.save(ckpt, ckpt_path)
+
+def cache_teacher_logits(config, utt_list_path, in_feat_dir):
+    """Save logits of teacher for each utterance in the list.
+
+    Logits are saved under the directory of the teacher with the same file
+    names as input features, so they are computed once and reused by every
+    student of the teacher.
+    """
+    distill_config = config.train.distill
+    teacher_dir = Path(to_absolute_path(config.train.out_dir)) / distill_config.teacher_model_name
+    cache_dir = teacher_dir / "logit_cache" / "step{}".format(str(distill_config.teacher_step))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # Teacher
+    teacher_config = OmegaConf.load(teacher_dir / "config.yaml")
+    ckpt_path = list((teacher_dir / teacher_config.train.checkpoint.params.dirname).glob(
+        "*-step={}.ckpt".format(str(distill_config.teacher_step))
+    ))[0]
+    teacher = hydra.utils.instantiate(teacher_config.model.netG)
+    teacher.load_state_dict(get_model_state_dict(
+        torch.load(ckpt_path, map_location="cpu")["state_dict"]))
+    device = torch.device("cuda" if config.train.gpus and torch.cuda.is_available() else "cpu")
+    teacher.to(device)
+    teacher.eval()
+
+    with open(utt_list_path, "r") as f:
+        utts = [l.strip() for l in f if len(l.strip()) > 0]
+    with torch.no_grad():
+        for utt in tqdm(utts, desc="cache teacher logits..."):
+            feats_name = "-".join(utt.split(":")[:3]) + "-feats.npy"
+            if (cache_dir / feats_name).exists():
+                continue
+            in_feat = torch.from_numpy(
+                np.load(in_feat_dir / feats_name).astype(np.float32)).unsqueeze(0).to(device)
+            np.save(cache_dir / feats_name, teacher(in_feat).squeeze(0).cpu().numpy())
+    return cache_dir
+
+def load_base_state_dict(config, out_dir):
+    """Load state dict of non-personalized model (or student) to fine-tune from."""
+    base_name = "non_personalized_student" if config.train.distill.enable else "non_personalized"
+    ckpt_dir = out_dir / base_name / config.train.checkpoint.params.dirname
+    load_ckpt_path = list(ckpt_dir.glob(
+        "*-step={}.ckpt".format(str(config.train.load_ckpt_step))
+    ))[0]
+    return torch.load(load_ckpt_path, map_location="cpu")["state_dict"]
+
+def train_group(
+    config, out_dir_m, fp_list, in_feat_dir, out_feat_dir,
+    model, group_id, base_state_dict):
+
+    max_steps = config.train.max_steps
+    fine_tune = config.train.fine_tune
+
+    train_fp_rate_list_path = \
+        Path(config.data.preprocessed_dir) / "train_group{}_fp_rate.list".format(str(group_id))
+    dev_fp_rate_list_path = \
+        Path(config.data.preprocessed_dir) / "dev_group{}_fp_rate.list".format(str(group_id))
+    utt_list_paths = {}
+    utt_list_paths["train"] = Path(config.data.preprocessed_dir) / "train_group{}.list".format(str(group_id))
+    utt_list_paths["dev"] = Path(config.data.preprocessed_dir) / "dev_group{}.list".format(str(group_id))
+    if config.train.head_only:
+        # Fine-tune only head on cached outputs of frozen non-personalized BiLSTM
+        model.load_state_dict({
+            k[len("model."):]: v for k, v in base_state_dict.items() if k.startswith("model.")},
+            strict=False)
+        cache_dir = out_dir_m / "trunk_cache" / "step{}".format(str(config.train.load_ckpt_step))
+        cache_trunk_outputs(model, utt_list_paths, in_feat_dir, cache_dir)
+        data_loaders, pl_model, trainer = setup_each_model(
+            config, out_dir_m, fp_list, 
+            train_fp_rate_list_path, dev_fp_rate_list_path, 
+            utt_list_paths, cache_dir, out_feat_dir, collate_fn,
+            TagHead(model), False, max_steps,
+            )
+        trainer.fit(pl_model, data_loaders["train"], data_loaders["dev"])
+        add_trunk_to_checkpoints(
+            model, out_dir_m / config.train.checkpoint.params.dirname)
+    else:
+        data_loaders, pl_model, trainer = setup_each_model(
+            config, out_dir_m, fp_list, 
+            train_fp_rate_list_path, dev_fp_rate_list_path, 
+            utt_list_paths, in_feat_dir, out_feat_dir, collate_fn,
+            model, fine_tune, max_steps,
+            load_state_dict=base_state_dict,
+            )
+        trainer.fit(pl_model, data_loaders["train"], data_loaders["dev"])
+
+# State dict of non-personalized model shared by forked workers
+_base_state_dict = None
+
+def _train_group_worker(config, out_dir, fp_list, group_id, n_threads):
+    torch.set_num_threads(n_threads)
+
+    config = copy.deepcopy(config)
+    config.train.group_id = group_id
+
+    # Set output directory
+    out_dir_m = out_dir / "group{}".format(str(group_id))
+    if config.train.distill.enable:
+        out_dir_m = out_dir_m.parent / (out_dir_m.name + "_student")
+    exist_ok = True if config.train.resume else False
+    out_dir_m.mkdir(parents=True, exist_ok=exist_ok)
+
+    # Save config
+    with open(out_dir_m / "config.yaml", "w") as f:
+        OmegaConf.save(config, f)
+
+    # Random seed
+    pl.seed_everything(config.random_seed)
+
+    in_feat_dir = Path(config.data.preprocessed_dir) / "infeats"
+    out_feat_dir = Path(config.data.preprocessed_dir) / "outfeats"
+    model = hydra.utils.instantiate(config.model.netG)
+    train_group(
+        config, out_dir_m, fp_list, in_feat_dir, out_feat_dir,
+        model, group_id, _base_state_dict)
+    return group_id
+
+def train_groups_parallel(config, out_dir, fp_list):
+    """Fine-tune all groups in ``train.group_ids`` on a process pool.
+
+    The non-personalized model is loaded once and shared with workers by fork.
+    """
+    global _base_state_dict
+    _base_state_dict = load_base_state_dict(config, out_dir)
+
+    parallel_config = config.train.parallel
+    with ProcessPoolExecutor(
+            parallel_config.n_jobs, mp_context=multiprocessing.get_context("fork")) as executor:
+        futures = [
+            executor.submit(
+                _train_group_worker,
+                config, out_dir, fp_list, group_id, parallel_config.n_threads)
+            for group_id in config.train.group_ids
+        ]
+        for future in as_completed(futures):
+            print(f"finished group{future.result()}")
+
 @hydra.main(config_path="conf/train", config_name="config")
 def myapp(config: DictConfig):
 
     # Set output directory
     out_dir = Path(to_absolute_path(config.train.out_dir))
+
+    # Input dimension of features projected at extraction
+    projection_path = Path(config.data.preprocessed_dir) / "projection.npz"
+    if projection_path.exists():
+        config.model.netG.embedding_dim = int(np.load(projection_path)["components"].shape[0])
+
+    # Model initialized from weight-only checkpoint, whose netG replaces model.netG
+    init_state_dict = None
+    if config.train.init_ckpt is not None:
+        init_state_dict, netG_config = load_inference_ckpt(to_absolute_path(config.train.init_ckpt))
+        config.model.netG = OmegaConf.create(netG_config)
+
+    # Fine-tune all groups in parallel
+    if config.train.model_type == "group" and config.train.parallel.enable:
+        fp_list_path = Path(to_absolute_path(config.data.fp_list))
+        with open(fp_list_path, "r") as f:
+            fp_list = [l.strip() for l in f]
+        train_groups_parallel(config, out_dir, fp_list)
+        return
+
     if config.train.model_type == "non_personalized":
         out_dir_m = out_dir / "non_personalized"
     elif config.train.model_type == "group":
         group_id = config.train.group_id
         out_dir_m = out_dir / "group{}".format(str(group_id))
+    elif config.train.model_type == "multi_group":
+        out_dir_m = out_dir / "multi_group"
+    if config.train.distill.enable:
+        # Student of non-personalized or group model
+        assert config.train.model_type in ["non_personalized", "group"] and not config.train.head_only, \
+            "distillation is for non_personalized or group models without head_only"
+        out_dir_m = out_dir_m.parent / (out_dir_m.name + "_student")
+    if config.train.model_name is not None:
+        # Several models of the same type side by side (e.g. streaming models of each lookahead)
+        out_dir_m = out_dir / config.train.model_name
     exist_ok = True if config.train.resume else False
     out_dir_m.mkdir(parents=True, exist_ok=exist_ok)
 
@@ -175,6 +458,8 @@ def myapp(config: DictConfig):
 
     # Trainig non-personalized model
     if config.train.model_type == "non_personalized":
+        if init_state_dict is not None:
+            model.load_state_dict(init_state_dict)
         train_fp_rate_list_path = Path(config.data.preprocessed_dir) / "train_all_fp_rate.list"
         dev_fp_rate_list_path = Path(config.data.preprocessed_dir) / "dev_all_fp_rate.list"
         utt_list_paths = {}
@@ -190,26 +475,35 @@ def myapp(config: DictConfig):
 
     # Trainig group-dependent models
     elif config.train.model_type == "group":
-        ckpt_dir = out_dir / "non_personalized" / config.train.checkpoint.params.dirname
-        load_ckpt_path = list(ckpt_dir.glob(
-            "*-step={}.ckpt".format(str(config.train.load_ckpt_step))
-        ))[0]
-        group_id = config.train.group_id
-        train_fp_rate_list_path = \
-            Path(config.data.preprocessed_dir) / "train_group{}_fp_rate.list".format(str(group_id))
-        dev_fp_rate_list_path = \
-            Path(config.data.preprocessed_dir) / "dev_group{}_fp_rate.list".format(str(group_id))
+        base_state_dict = load_base_state_dict(config, out_dir)
+        train_group(
+            config, out_dir_m, fp_list, in_feat_dir, out_feat_dir,
+            model, config.train.group_id, base_state_dict)
+
+    # Training group-dependent heads on shared trunk
+    elif config.train.model_type == "multi_group":
+        group_ids = config.train.group_ids
+        if fine_tune:
+            state_dict = load_base_state_dict(config, out_dir)
+            model.load_base_state_dict({
+                k[len("model."):]: v for k, v in state_dict.items() if k.startswith("model.")})
+        fp_rate_list_paths = {}
         utt_list_paths = {}
-        utt_list_paths["train"] = Path(config.data.preprocessed_dir) / "train_group{}.list".format(str(group_id))
-        utt_list_paths["dev"] = Path(config.data.preprocessed_dir) / "dev_group{}.list".format(str(group_id))
+        for phase in ["train", "dev"]:
+            fp_rate_list_paths[phase] = [
+                Path(config.data.preprocessed_dir) / "{}_group{}_fp_rate.list".format(phase, str(group_id))
+                for group_id in group_ids]
+            utt_list_paths[phase] = [
+                Path(config.data.preprocessed_dir) / "{}_group{}.list".format(phase, str(group_id))
+                for group_id in group_ids]
+        # Trunk and heads are initialized above, so the model is not loaded from checkpoint
         data_loaders, pl_model, trainer = setup_each_model(
             config, out_dir_m, fp_list, 
-            train_fp_rate_list_path, dev_fp_rate_list_path, 
+            fp_rate_list_paths["train"], fp_rate_list_paths["dev"], 
             utt_list_paths, in_feat_dir, out_feat_dir, collate_fn,
-            model, fine_tune, max_steps,
-            load_ckpt_path=load_ckpt_path,
+            model, False, max_steps,
             )
         trainer.fit(pl_model, data_loaders["train"], data_loaders["dev"])
-        
+
 if __name__=="__main__":
     myapp()
\ No newline at end of file